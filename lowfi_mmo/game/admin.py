@@ -32,7 +32,7 @@ class EndPathInline(CollapsibleTabularInline):
     
 class LocationAdmin(admin.ModelAdmin):
     inlines = [StartPathInline, EndPathInline]
-    search_fields = ["name", "description"]
+    search_fields = ["names__name", "description"]
     list_filter = ["category"]
     list_display = ["name", "category"]
     list_editable = ["category"]
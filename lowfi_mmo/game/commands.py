@@ -1,21 +1,126 @@
 import re
-from game import systems, models
-from dataclasses import dataclass
-from django.db.transaction import atomic
+from game import systems, models, live, metrics, replica
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Awaitable, Callable
+from django.db.transaction import atomic, on_commit
+from asgiref.sync import sync_to_async
 
 @dataclass
 class Command:
     name: str
-    regex: str
+    args_regex: str # matched against everything after the verb, including the leading space
     arg_syntax: str
     description: str
+    aliases: tuple[str, ...] = ()
+    handler: Callable[..., systems.Result] | None = None
+    async_handler: Callable[..., Awaitable[systems.Result]] | None = None # used by async views when set
+    pattern: re.Pattern = field(init=False, repr=False)
 
-COMMANDS = [
-    Command('look', r"^(?:look|l)$", "", "Examine your surroundings"),
-    Command('go', r"^(?:go|g)(?: (back|to|through|inside|outside|further|north|south|east|west|up|farther|down|deeper))?(?: ([a-zA-Z\ ]*))?$", "[position]", "Follow a path to a new location"),
-    Command('take', r"^(?:take|t) ([a-zA-Z\ ]*)$", "[item]", "Pick up a nearby item"),
-    Command('use', r"^^(?:use|u) \"?([a-zA-Z\ ]*)\"? on \"?([a-zA-Z\ ]*)\"?$", "[item] on [entity]", "Use an item on something"),
-]
+    def __post_init__(self):
+        self.pattern = re.compile(self.args_regex, re.IGNORECASE)
+
+# the first word is looked up in a dict and only the precompiled argument patterns of the verbs
+# starting with it run, longest verb first, so parsing costs the same however many commands are registered
+VERB_REGEX = re.compile(r"(\S+)(.*)", re.DOTALL)
+
+class CommandRegistry:
+    def __init__(self, cache_size=1024):
+        self.commands: list[Command] = [] # in help order
+        self.verbs: dict[str, Command] = {} # name and aliases -> command
+        self.verbs_by_word: dict[str, list[str]] = {} # first word -> verbs starting with it, longest first
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def register(self, name, args_regex, arg_syntax, description, aliases=()):
+        def decorator(handler):
+            command = Command(name, args_regex, arg_syntax, description, tuple(aliases), handler)
+            for verb in [name, *aliases]:
+                verb = " ".join(verb.lower().split())
+                assert verb not in self.verbs, f"\"{verb}\" is already a command"
+                self.verbs[verb] = command
+                verbs = self.verbs_by_word.setdefault(verb.split()[0], [])
+                verbs.append(verb)
+                verbs.sort(key=len, reverse=True)
+            self.commands.append(command)
+            self.parse.cache_clear()
+            return handler
+        return decorator
+
+    def register_async(self, name):
+        def decorator(async_handler):
+            self.verbs[name].async_handler = async_handler
+            return async_handler
+        return decorator
+
+    def _parse(self, normalized_input):
+        verb_match = VERB_REGEX.fullmatch(normalized_input)
+        for verb in self.verbs_by_word.get(verb_match.group(1).lower(), ()) if verb_match else ():
+            if normalized_input[:len(verb)].lower() != verb:
+                continue
+            command = self.verbs[verb]
+            args_match = command.pattern.fullmatch(normalized_input[len(verb):])
+            if args_match:
+                return command.name, args_match.groups()
+        return None, None
+
+    def dispatch(self, character, raw_input) -> systems.Result:
+        name, args = parse_command(character, raw_input, self)
+        if not name:
+            return systems.Result.fail(f'"{raw_input}" is not a valid command.')
+        return self.verbs[name].handler(character, *args)
+
+    async def adispatch(self, character, raw_input) -> systems.Result:
+        name, args = parse_command(character, raw_input, self)
+        if not name:
+            return systems.Result.fail(f'"{raw_input}" is not a valid command.')
+        return await self.verbs[name].async_handler(character, *args)
+
+    def runs_async(self, character, raw_input):
+        name, _ = parse_command(character, raw_input, self)
+        return not name or bool(self.verbs[name].async_handler)
+
+registry = CommandRegistry()
+command = registry.register
+async_command = registry.register_async
+COMMANDS = registry.commands
+
+@command('look', r"", "", "Examine your surroundings", aliases=['l'])
+def look(character):
+    with replica.reading(): # only leaves the default database outside a transaction, see replica.py
+        return systems.look(character)
+
+@async_command('look')
+async def alook(character):
+    with replica.reading():
+        return await systems.alook(character)
+
+@command('go', r"(?: (back|to|through|inside|outside|further|north|south|east|west|up|farther|down|deeper))?(?: ([a-zA-Z\ ]*))?", "[position]", "Follow a path to a new location", aliases=['g'])
+def go(character, preposition, noun):
+    return systems.move(character, preposition, noun)
+
+@async_command('go')
+async def ago(character, preposition, noun):
+    return await systems.amove(character, preposition, noun)
+
+@command('travel', r"(?: to)? ([a-zA-Z\ ]*)", "to [location]", "Take the quickest route to a faraway location")
+def travel(character, destination):
+    return systems.travel(character, destination)
+
+@async_command('travel')
+async def atravel(character, destination):
+    return await systems.atravel(character, destination)
+
+@command('take', r" ([a-zA-Z\ ]*)", "[item]", "Pick up a nearby item", aliases=['t'])
+def take(character, item_name):
+    return systems.take(character, item_name)
+
+@command('use', r" \"?([a-zA-Z\ ]*)\"? on \"?([a-zA-Z\ ]*)\"?", "[item] on [entity]", "Use an item on something", aliases=['u'])
+def use(character, item_name, entity_name):
+    return systems.use(character, item_name, entity_name)
+
+@command('talk', r"(?: to)? ([a-zA-Z\ ]*?) about ([a-zA-Z\ ]*)", "to [character] about [topic]", "Ask someone nearby what they know about something", aliases=['ask'])
+def talk(character, npc_name, topic_name):
+    return systems.talk(character, npc_name, topic_name)
 
 # TODO: add the following commands
 # search (for locations and items tagged hidden)
@@ -24,35 +129,48 @@ COMMANDS = [
 # help (display help modal)
 # exit (route to world details)
 # text <group|name> message
-# tell/ask/talk to or something
 # drop <item>
 
-@atomic
+def command_name(character, raw_input):
+    return parse_command(character, raw_input)[0] or "unknown"
+
+# timed outside the transaction, so commands' times include holding it and committing
+@metrics.timed("command", command_name)
 def handle_command(character, raw_input):
-    command, args = parse_command(character, raw_input)
-    result: systems.Result
-    match command:
-        case 'go':
-            result = systems.move(character, args[0], args[1])
-        case 'look':
-            result = systems.look(character)
-        case 'take':
-            result = systems.take(character, args[0])
-        case 'use':
-            result = systems.use(character, args[0], args[1])
-        case _:
-            result = systems.Result.fail(f'"{raw_input}" is not a valid command.')
-    
-    models.CharacterLog.objects.create(
+    return dispatch_and_log(character, raw_input)
+
+@atomic
+def dispatch_and_log(character, raw_input):
+    previous_position_id = character.position_id
+    result = registry.dispatch(character, raw_input)
+
+    log = models.CharacterLog.objects.create(
         character=character,
         command=raw_input,
         success=result.success,
         message=result.message
         )
-    
-def parse_command(character, raw_input):
-    for command in COMMANDS:
-        match = re.match(command.regex, raw_input.strip().replace("'", ""), re.IGNORECASE)
-        if match:
-            return command.name.lower(), match.groups()
-    return None, None
\ No newline at end of file
+    on_commit(lambda: live.publish_command(character, log, result, previous_position_id))
+    return log
+
+@metrics.timed("command", command_name)
+async def ahandle_command(character, raw_input):
+    if not registry.runs_async(character, raw_input):
+        # commands that write several rows (take, use, talk) run in a thread, in one transaction with their
+        # log like handle_command's, so they're never left half done or done without a log
+        return await sync_to_async(dispatch_and_log)(character, raw_input)
+    # no surrounding transaction: the async commands make at most one write before their log
+    previous_position_id = character.position_id
+    result = await registry.adispatch(character, raw_input)
+
+    log = await models.CharacterLog.objects.acreate(
+        character=character,
+        command=raw_input,
+        success=result.success,
+        message=result.message
+        )
+    live.publish_command(character, log, result, previous_position_id)
+    return log
+
+def parse_command(character, raw_input, registry=registry):
+    return registry.parse(raw_input.strip().replace("'", ""))
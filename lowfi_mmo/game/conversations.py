@@ -0,0 +1,193 @@
+from game import models, live, llm, llm_cache, metrics, prompt_templates
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils.html import escape
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+import threading
+import time
+import uuid
+
+# npc conversations for the talk command. the command only builds the prompt and starts the reply once
+# it commits. the model runs on this module's own small thread pool and the reply is streamed to the
+# player's play page as "talk" messages on the live channel, piece by piece as the model writes it, then
+# saved to the player's log like any command result. web workers never wait on the model: at
+# most MAX_CONCURRENT replies are written at once, MAX_WAITING more can queue, and past that npcs are busy.
+# replies come from game/llm_cache.py when they can, and a request identical to one already being
+# written joins it instead of calling the model again.
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT = getattr(settings, "LLM_MAX_CONCURRENT", 4)
+MAX_WAITING = getattr(settings, "LLM_MAX_WAITING", 16)
+
+@dataclass
+class Conversation:
+    id: str
+    character_id: int
+    npc_id: int
+    topic_id: int
+    location_id: int
+    clue_ids: tuple
+    prompt: str
+    command: str # what goes in the log next to the reply
+
+def prepare(character, npc, topic, command="") -> Conversation:
+    clues = known_clues(npc, topic)
+    prompt = prompt_templates.npc_conversation.format(
+        location=character.position.name,
+        player_name=character.name, player_description=character.description or "a visitor", player_personality=character.personality,
+        npc_name=npc.name, npc_description=npc.description, npc_appearance=npc.appearance, npc_personality=npc.personality,
+        topic_name=topic.name, topic_location=topic_location(topic), topic_description=topic.description,
+        clues="\n".join(f"- {summary}" for _, summary in clues) or "Nothing more than anyone in town.",
+    )
+    return Conversation(
+        uuid.uuid4().hex, character.id, npc.id, topic.id, character.position_id, tuple(clue_id for clue_id, _ in clues), prompt,
+        command or f"talk to {npc.name} about {topic.name}",
+    )
+
+def topic_location(topic):
+    if hasattr(topic, "location"):
+        return topic.name
+    if hasattr(topic, "character"):
+        return topic.character.position.name
+    if hasattr(topic, "item"):
+        item = topic.item
+        return item.position.name if item.position_id else f"carried by {item.carrier.name}"
+    return "unknown"
+
+def known_clues(npc, topic):
+    """(id, summary) of the clues the npc knows plus any the topic gives away."""
+    condition = Q(clueknowledge__character_id__in={npc.id, npc.origin_id})
+    if hasattr(topic, "location"):
+        condition |= Q(locations_arrive=topic.id) | Q(locations_search=topic.id)
+    if hasattr(topic, "item"):
+        condition |= Q(inspectable_from=topic.id) | Q(readable_from=topic.id)
+    return list(models.Clue.objects.filter(condition).order_by("pk").distinct().values_list("id", "summary"))
+
+class Flight:
+    """One reply being written, and everyone waiting to hear it."""
+    def __init__(self, key, prompt, layer):
+        self.key = key
+        self.prompt = prompt
+        self.layer = layer
+        self.listeners = [] # conversations
+        self.pieces = []
+        self.failed = False
+        self._lock = threading.Lock()
+
+    def join(self, conversation):
+        with self._lock:
+            if self.pieces:
+                self.publish(conversation, "".join(self.pieces)) # catch up in one go
+            self.listeners.append(conversation)
+
+    def send(self, text):
+        with self._lock:
+            self.pieces.append(text)
+            for conversation in self.listeners:
+                self.publish(conversation, text)
+
+    def finish(self):
+        """Log the reply for everyone who heard it, then tell their pages it's done."""
+        with self._lock:
+            reply = "".join(self.pieces)
+            logs = models.CharacterLog.objects.bulk_create([
+                models.CharacterLog(character_id=conversation.character_id, command=conversation.command, success=not self.failed, message=escape(reply))
+                for conversation in self.listeners
+            ])
+            for conversation, log in zip(self.listeners, logs):
+                self.publish(conversation, "", done=True)
+                self.layer.publish(live.character_group(conversation.character_id), {
+                    "type": "log", "id": log.id, "command": log.command, "success": log.success, "css_class": log.css_class, "message": log.message,
+                })
+        return logs
+
+    def publish(self, conversation, text, done=False):
+        self.layer.publish(live.character_group(conversation.character_id), {"type": "talk", "id": conversation.id, "text": text, "done": done})
+
+class Narrator:
+    def __init__(self, backend=None, layer=None, max_concurrent=MAX_CONCURRENT, max_waiting=MAX_WAITING, executor=None):
+        self.backend = backend
+        self.layer = layer
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.flights = {} # cache key -> Flight, so identical requests share one model call
+        self._lock = threading.Lock()
+        self._executor = executor
+
+    def busy(self):
+        return self.in_flight >= self.max_concurrent + self.max_waiting
+
+    def start(self, conversation):
+        layer = self.layer or live.get_channel_layer()
+        key = llm_cache.cache_key(conversation, self.backend or llm.get_backend())
+        with self._lock:
+            flight = self.flights.get(key)
+            if flight:
+                flight.join(conversation)
+                llm_cache.stats.record("shared")
+                return True
+            # checked again here since the talk command, others may have got in first
+            busy = self.busy()
+            if not busy:
+                self.in_flight += 1
+                flight = self.flights[key] = Flight(key, conversation.prompt, layer)
+                flight.join(conversation)
+                if not self._executor:
+                    self._executor = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix="npc-conversation")
+        if busy:
+            flight = Flight(key, conversation.prompt, layer)
+            flight.join(conversation)
+            flight.send("No answer, they're lost in thought.")
+            flight.failed = True
+            flight.finish()
+            return False
+        self._executor.submit(self.run, flight)
+        return True
+
+    def run(self, flight):
+        try:
+            self.narrate(flight)
+        except Exception:
+            flight.failed = True
+            logger.exception("NPC conversation failed")
+        finally:
+            try:
+                self.land(flight)
+            finally:
+                close_old_connections()
+
+    def land(self, flight):
+        with self._lock:
+            self.in_flight -= 1
+            del self.flights[flight.key]
+        # no one joins once it's out of flights, so everyone who did is logged
+        return flight.finish()
+
+    @metrics.timed("llm", "conversation")
+    def narrate(self, flight):
+        reply = llm_cache.get(flight.key)
+        if reply is not None:
+            flight.send(reply)
+            return reply
+        deadline = time.monotonic() + llm.llm_timeout_seconds()
+        pieces = []
+        try:
+            for piece in (self.backend or llm.get_backend()).stream(flight.prompt):
+                pieces.append(piece)
+                flight.send(piece)
+                if time.monotonic() > deadline:
+                    raise llm.LLMError("Timed out")
+        except llm.LLMError as error:
+            logger.warning("NPC conversation cut short: %s", error)
+            flight.send("...")
+            flight.failed = True
+            return "".join(pieces)
+        reply = "".join(pieces)
+        llm_cache.store(flight.key, reply)
+        return reply
+
+narrator = Narrator()
@@ -18,8 +18,9 @@ class CharacterForm(ModelForm):
         model = models.Character
         fields = ["name", "appearance", "personality", "description"]
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, world=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.world = world
         # Add the "name" field back to the form, but use TextInput widget
         self.fields["name"].widget = forms.TextInput(attrs={'placeholder': 'Enter character name'})
         self.fields["appearance"].widget.attrs['placeholder'] = "Tall, dark, handsome male teenager"
@@ -27,4 +28,17 @@ class CharacterForm(ModelForm):
         self.fields["description"].widget.attrs['placeholder'] = "Has a girlfriend who goes to a different school. Loves tacos. Flunked second grade"
         for field in ["appearance", "personality", "description"]:
             self.fields[field].widget.attrs['required'] = True
-            self.fields[field].widget.attrs['rows'] = 5
\ No newline at end of file
+            self.fields[field].widget.attrs['rows'] = 5
+
+    def clean_name(self):
+        name = self.cleaned_data["name"]
+        if not self.world:
+            return name
+        # names are unique in a world, npcs and places included, and so is the apartment a new character gets
+        slugs = [models.slugify_spaceless(name)]
+        if not self.instance.pk:
+            slugs.append(models.slugify_spaceless(f"{name}'s apartment"))
+        taken = models.Name.objects.filter(world_id__in=self.world.content_world_ids, slug__in=slugs).exclude(entity_id=self.instance.pk)
+        if taken.exists():
+            raise forms.ValidationError(f"Something in {self.world} is already called {name}.")
+        return name
@@ -0,0 +1,140 @@
+from game import models
+from game.world_cache import WorldCache
+import threading
+
+# in-process trigram index over each world's Name slugs, a sqlite friendly stand-in for postgres pg_trgm.
+# slugs are already lowercase and spaceless (see models.slugify_spaceless), so "Bronze Key" and "bronzekey" agree.
+SIMILARITY_THRESHOLD = 0.4
+
+def trigrams(slug):
+    padded = f"  {slug} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i]
+        for j, b_char in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a_char != b_char)))
+        previous = current
+    return previous[-1]
+
+def max_typos(slug):
+    return 0 if len(slug) < 3 else 1 if len(slug) < 6 else 2
+
+def score(query_slug, query_trigram_count, slug, slug_trigram_count, shared_trigrams):
+    """Trigram similarity if slug is close enough to the query to count as a match, otherwise None."""
+    sim = shared_trigrams / (query_trigram_count + slug_trigram_count - shared_trigrams)
+    if sim >= SIMILARITY_THRESHOLD:
+        return sim
+    # short names share few trigrams, so also allow a typo or two.
+    # each edit changes at most 3 trigrams, which rules most candidates out before the edit distance
+    typos = max_typos(query_slug)
+    if abs(len(slug) - len(query_slug)) > typos or shared_trigrams < query_trigram_count - 3 * typos:
+        return None
+    return sim if edit_distance(query_slug, slug) <= typos else None
+
+def rank(query, slugs):
+    """Slugs matching the query, best match first. Exact matches always win."""
+    query_slug = models.slugify_spaceless(query)
+    query_trigrams = trigrams(query_slug)
+    scored = []
+    for slug in set(slugs):
+        if not slug: continue
+        slug_trigrams = trigrams(slug)
+        sim = score(query_slug, len(query_trigrams), slug, len(slug_trigrams), len(query_trigrams & slug_trigrams))
+        if sim is not None: scored.append((sim, slug))
+    return [slug for _, slug in sorted(scored, reverse=True)]
+
+class NameIndex:
+    def __init__(self, names):
+        self.slugs_by_name = {} # name id -> slug
+        self.entities_by_name = {} # name id -> entity id
+        self.name_ids_by_slug = {}
+        self.entity_ids_by_slug = {} # slug -> {entity id: how many of its names have the slug}
+        self.slugs_by_trigram = {}
+        self.trigram_counts = {} # slug -> number of distinct trigrams
+        self._lock = threading.RLock() # names are kept up to date by signals while other requests search
+        for name_id, slug, entity_id in names:
+            self.add(name_id, slug, entity_id)
+
+    def add(self, name_id, slug, entity_id):
+        with self._lock:
+            self._remove(name_id)
+            self._add(name_id, slug, entity_id)
+
+    def remove(self, name_id):
+        with self._lock:
+            self._remove(name_id)
+
+    def _add(self, name_id, slug, entity_id):
+        self.slugs_by_name[name_id] = slug
+        self.entities_by_name[name_id] = entity_id
+        self.name_ids_by_slug.setdefault(slug, set()).add(name_id)
+        entity_ids = self.entity_ids_by_slug.setdefault(slug, {})
+        entity_ids[entity_id] = entity_ids.get(entity_id, 0) + 1
+        slug_trigrams = trigrams(slug)
+        self.trigram_counts[slug] = len(slug_trigrams)
+        for trigram in slug_trigrams:
+            self.slugs_by_trigram.setdefault(trigram, set()).add(slug)
+
+    def _remove(self, name_id):
+        slug = self.slugs_by_name.pop(name_id, None)
+        if slug is None:
+            return
+        entity_id = self.entities_by_name.pop(name_id)
+        entity_ids = self.entity_ids_by_slug[slug]
+        entity_ids[entity_id] -= 1
+        if not entity_ids[entity_id]:
+            del entity_ids[entity_id]
+        self.name_ids_by_slug[slug].discard(name_id)
+        if self.name_ids_by_slug[slug]:
+            return
+        del self.name_ids_by_slug[slug]
+        del self.entity_ids_by_slug[slug]
+        del self.trigram_counts[slug]
+        for trigram in trigrams(slug):
+            self.slugs_by_trigram[trigram].discard(slug)
+
+    def search(self, query, limit=10, entity_ids=None):
+        """Best matching slugs first. With entity_ids, only slugs naming one of those entities count towards the limit."""
+        query_slug = models.slugify_spaceless(query)
+        if not query_slug:
+            return []
+        query_trigrams = trigrams(query_slug)
+        shared = {}
+        with self._lock:
+            for trigram in query_trigrams:
+                for slug in self.slugs_by_trigram.get(trigram, ()):
+                    shared[slug] = shared.get(slug, 0) + 1
+            if entity_ids is not None:
+                shared = {slug: count for slug, count in shared.items() if not entity_ids.isdisjoint(self.entity_ids_by_slug[slug])}
+            trigram_counts = {slug: self.trigram_counts[slug] for slug in shared}
+        scored = [(score(query_slug, len(query_trigrams), slug, trigram_counts[slug], count), slug) for slug, count in shared.items()]
+        matches = sorted((item for item in scored if item[0] is not None), reverse=True)
+        return [slug for _, slug in matches[:limit]]
+
+def build_index(world):
+    return NameIndex(models.Name.objects.filter(world_id__in=world.content_world_ids).values_list("id", "slug", "entity_id"))
+
+_indexes = WorldCache(build_index)
+
+def search(world, query, limit=10, entity_ids=None):
+    """Name slugs in the world (including its template) that fuzzily match the query, best first."""
+    return _indexes.get(world).search(query, limit, entity_ids)
+
+async def asearch(world, query, limit=10, entity_ids=None):
+    return (await _indexes.aget(world)).search(query, limit, entity_ids)
+
+def name_saved(name):
+    for index in _indexes.cached(name.world_id):
+        index.add(name.id, name.slug, name.entity_id)
+
+def names_saved(names):
+    # for bulk_create, which skips the post_save signal
+    for name in names:
+        name_saved(name)
+
+def name_deleted(name):
+    for index in _indexes.cached(name.world_id):
+        index.remove(name.id)
@@ -0,0 +1,69 @@
+from game import models, look_cache
+from django.db import transaction
+from django.db.models import F, Sum, Count
+from dataclasses import dataclass
+
+# every change of an item's carrier goes through transfer, which keeps the characters' carried_kg
+# and carried_count in step with an F() update in the same transaction, so checking capacity is a
+# field read instead of an aggregate over their items
+
+@transaction.atomic
+def transfer(item, carrier=None, position=None) -> bool:
+    """Give an item to a character or leave it at a location.
+
+    False if the character can't carry any more, or if the item isn't where this instance says any more,
+    in which case the instance is refreshed to show where it went.
+    """
+    carrier_id, position_id = getattr(carrier, "id", None), getattr(position, "id", None)
+    # claim the item as the caller saw it, so two transfers from the same stale instance can't both go through
+    # and the totals below are adjusted for whoever really had it
+    if not models.Item.objects.filter(pk=item.pk, carrier_id=item.carrier_id, position_id=item.position_id).update(
+        carrier_id=carrier_id, position_id=position_id
+    ):
+        item.refresh_from_db(fields=["carrier", "position"])
+        return False
+    if carrier and carrier.id != item.carrier_id:
+        # the limit is checked in the update itself, so two pickups at once can't both squeeze in
+        if not models.Character.objects.filter(pk=carrier.id, carried_kg__lte=F("carry_limit") - item.kg).update(
+            carried_kg=F("carried_kg") + item.kg, carried_count=F("carried_count") + 1
+        ):
+            transaction.set_rollback(True) # and the claim with it
+            return False
+        carrier.carried_kg += item.kg
+        carrier.carried_count += 1
+    if item.carrier_id and item.carrier_id != carrier_id:
+        models.Character.objects.filter(pk=item.carrier_id).update(carried_kg=F("carried_kg") - item.kg, carried_count=F("carried_count") - 1)
+    # update() skips signals.py, so the look cache hears about both places here
+    for changed_position_id in {item.position_id, position_id}:
+        look_cache.changed(item.world_id, changed_position_id)
+    item.carrier = carrier
+    item.position = position
+    item.loaded_position_id = position_id
+    return True
+
+@dataclass
+class Mismatch:
+    character_id: int
+    carried_kg: float
+    carried_count: int
+    actual_kg: float
+    actual_count: int
+
+def find_mismatches(tolerance=1e-6) -> list[Mismatch]:
+    actual = {
+        carrier_id: (kg, count)
+        for carrier_id, kg, count in models.Item.objects.filter(carrier__isnull=False)
+            .values("carrier_id").annotate(kg=Sum("kg"), count=Count("id")).values_list("carrier_id", "kg", "count")
+    }
+    mismatches = []
+    for character_id, carried_kg, carried_count in models.Character.objects.values_list("id", "carried_kg", "carried_count").iterator():
+        actual_kg, actual_count = actual.get(character_id, (0.0, 0))
+        if abs(carried_kg - actual_kg) > tolerance or carried_count != actual_count:
+            mismatches.append(Mismatch(character_id, carried_kg, carried_count, actual_kg, actual_count))
+    return mismatches
+
+@transaction.atomic
+def rebuild(mismatches) -> int:
+    characters = [models.Character(pk=m.character_id, carried_kg=m.actual_kg, carried_count=m.actual_count) for m in mismatches]
+    models.Character.objects.bulk_update(characters, ["carried_kg", "carried_count"], batch_size=500)
+    return len(characters)
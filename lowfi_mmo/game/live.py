@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from collections import defaultdict
+from functools import cache
+import asyncio
+import json
+import threading
+
+# pushes command results and location events to players' open play pages over server-sent events.
+# the default channel layer only reaches subscribers in the same process; point LIVE_CHANNEL_LAYER
+# at a class with the same subscribe/publish interface to fan out through a broker instead.
+KEEPALIVE_SECONDS = 15
+MAX_QUEUED_MESSAGES = 100
+
+def character_group(character_id):
+    return f"character.{character_id}"
+
+def location_group(world_id, location_id):
+    return f"location.{world_id}.{location_id}"
+
+class Subscription:
+    def __init__(self, layer):
+        self.layer = layer
+        self.groups = set()
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(MAX_QUEUED_MESSAGES)
+
+    def put(self, message):
+        # called from whichever thread published the message
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError: # the stream's event loop is gone
+            self.close()
+
+    def _put(self, message):
+        if self.queue.full():
+            self.queue.get_nowait() # slow readers lose the oldest messages rather than holding memory
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def join(self, group):
+        self.layer.join(self, group)
+
+    def leave(self, group):
+        self.layer.leave(self, group)
+
+    def close(self):
+        for group in list(self.groups):
+            self.leave(group)
+
+class InMemoryChannelLayer:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, *groups) -> Subscription:
+        subscription = Subscription(self)
+        for group in groups:
+            subscription.join(group)
+        return subscription
+
+    def join(self, subscription, group):
+        with self._lock:
+            self._subscribers[group].add(subscription)
+            subscription.groups.add(group)
+
+    def leave(self, subscription, group):
+        with self._lock:
+            self._subscribers[group].discard(subscription)
+            subscription.groups.discard(group)
+            if not self._subscribers[group]:
+                del self._subscribers[group]
+
+    def move(self, member_group, from_group, to_group):
+        """Move everyone subscribed to member_group from one group to another, e.g. a character's streams between locations."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(member_group, ()))
+        for subscription in subscribers:
+            self.leave(subscription, from_group)
+            self.join(subscription, to_group)
+
+    def publish(self, group, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(group, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+
+@cache
+def get_channel_layer():
+    return import_string(getattr(settings, "LIVE_CHANNEL_LAYER", "game.live.InMemoryChannelLayer"))()
+
+def publish_command(character, log, result, previous_position_id):
+    layer = get_channel_layer()
+    layer.publish(character_group(character.id), {
+        "type": "log", "id": log.id, "command": log.command, "success": log.success, "css_class": log.css_class, "message": log.message,
+    })
+    if previous_position_id != character.position_id:
+        layer.move(character_group(character.id), location_group(character.world_id, previous_position_id), location_group(character.world_id, character.position_id))
+        layer.publish(location_group(character.world_id, previous_position_id), {"type": "event", "from": character.id, "message": f"{character.name} leaves."})
+        layer.publish(location_group(character.world_id, character.position_id), {"type": "event", "from": character.id, "message": f"{character.name} arrives."})
+    elif result.success and result.event:
+        layer.publish(location_group(character.world_id, character.position_id), {"type": "event", "from": character.id, "message": result.event})
+
+async def stream(character):
+    """Server-sent events for one character: their own command results plus what happens where they are."""
+    subscription = get_channel_layer().subscribe(character_group(character.id), location_group(character.world_id, character.position_id))
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            message = await subscription.get(timeout=KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+    finally:
+        subscription.close()
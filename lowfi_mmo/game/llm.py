@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from functools import cache
+import hashlib
+import random
+import time
+
+# language model backends for npc conversations (see game/conversations.py). a backend has one method,
+# stream(prompt), yielding the response a piece at a time as the model produces it. LLM_BACKEND picks
+# the class: the stub writes plausible nonsense without a network, OpenAIBackend needs the openai package.
+
+class LLMError(Exception):
+    pass
+
+class StubBackend:
+    """Same prompt, same response, for tests and playing offline."""
+    WORDS = (
+        "the", "a", "town", "storm", "drain", "whispers", "lights", "quietly", "shrugs", "leans", "in", "closer",
+        "nobody", "knows", "rumor", "old", "secret", "night", "strange", "figures", "maybe", "you", "should", "look",
+    )
+    def __init__(self, word_count=40, seconds_per_word=0.0):
+        self.word_count = word_count
+        self.seconds_per_word = seconds_per_word
+
+    def stream(self, prompt):
+        rng = random.Random(hashlib.sha256(prompt.encode()).digest())
+        for index in range(self.word_count):
+            if self.seconds_per_word:
+                time.sleep(self.seconds_per_word)
+            word = rng.choice(self.WORDS)
+            yield (word.capitalize() if index == 0 else " " + word) + ("." if index == self.word_count - 1 else "")
+
+class OpenAIBackend:
+    def __init__(self, model=None, timeout=None):
+        try:
+            import openai
+        except ImportError:
+            raise LLMError("OpenAIBackend needs the openai package") from None
+        self.client = openai.OpenAI(timeout=timeout or llm_timeout_seconds()) # OPENAI_API_KEY from the environment
+        self.model = model or getattr(settings, "LLM_MODEL", "gpt-4o-mini")
+
+    def stream(self, prompt):
+        import openai
+        try:
+            chunks = self.client.chat.completions.create(model=self.model, messages=[{"role": "user", "content": prompt}], stream=True)
+            for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError as error:
+            raise LLMError(str(error)) from error
+
+def llm_timeout_seconds():
+    return getattr(settings, "LLM_TIMEOUT_SECONDS", 30)
+
+@cache
+def get_backend():
+    return import_string(getattr(settings, "LLM_BACKEND", "game.llm.StubBackend"))()
@@ -0,0 +1,99 @@
+from game import models, metrics, prompt_templates
+from django.conf import settings
+from django.db.models import F, Sum
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+
+# npc replies take seconds and cost money to write, and the same player asks the same npc about the
+# same thing over and over. replies are kept in the LLMResponse table under a hash of the normalized
+# prompt: the ids that went into it, not its wording, so the key only changes when the conversation
+# would. bump prompt_templates.NPC_CONVERSATION_VERSION to retire replies to an old template.
+# entries are evicted past MAX_AGE, and least recently used first once they add up to MAX_BYTES.
+MAX_BYTES = getattr(settings, "LLM_CACHE_MAX_BYTES", 50 * 1024 * 1024)
+MAX_AGE = timedelta(seconds=getattr(settings, "LLM_CACHE_MAX_AGE_SECONDS", 30 * 24 * 60 * 60))
+EVICT_EVERY = 100 # stores per process between evictions
+DELETE_BATCH_SIZE = 500
+
+def normalized_prompt(conversation, backend):
+    return {
+        "version": prompt_templates.NPC_CONVERSATION_VERSION,
+        "backend": f"{type(backend).__name__}:{getattr(backend, 'model', '')}", # different models write different replies
+        "npc": conversation.npc_id,
+        "topic": conversation.topic_id,
+        "clues": sorted(set(conversation.clue_ids)),
+        "player": conversation.character_id,
+        "location": conversation.location_id,
+    }
+
+def cache_key(conversation, backend):
+    return hashlib.sha256(json.dumps(normalized_prompt(conversation, backend), sort_keys=True).encode()).hexdigest()
+
+class Stats:
+    """Lookups in this process. The metrics view has every process's as kind="llm_cache"."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0 # requests that joined an identical one already being written
+        self._lock = threading.Lock()
+
+    def record(self, outcome, seconds=0.0, queries=0):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        metrics.registry.record("llm_cache", outcome, "ok", seconds, queries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+stats = Stats()
+_stores = 0
+_stores_lock = threading.Lock()
+
+def hit_rate(totals=None):
+    """Hits over lookups across every process publishing metrics."""
+    totals = metrics.collect() if totals is None else totals
+    def count(outcome):
+        series = totals.get(("llm_cache", outcome))
+        return series.outcomes["ok"] if series else 0
+    hits, misses = count("hits"), count("misses")
+    return hits / (hits + misses) if hits + misses else 0.0
+
+def get(key):
+    started = time.perf_counter()
+    now = datetime.now()
+    entry = models.LLMResponse.objects.filter(key=key, created_at__gte=now - MAX_AGE).values_list("pk", "response").first()
+    if entry:
+        models.LLMResponse.objects.filter(pk=entry[0]).update(hits=F("hits") + 1, used_at=now)
+    stats.record("hits" if entry else "misses", time.perf_counter() - started, 2 if entry else 1)
+    return entry[1] if entry else None
+
+def store(key, response):
+    global _stores
+    now = datetime.now()
+    models.LLMResponse.objects.bulk_create([models.LLMResponse(
+        key=key, prompt_version=prompt_templates.NPC_CONVERSATION_VERSION, response=response, size=len(response.encode()), used_at=now,
+    )], update_conflicts=True, unique_fields=["key"], update_fields=["prompt_version", "response", "size", "hits", "created_at", "used_at"])
+    with _stores_lock:
+        _stores += 1
+        due = _stores % EVICT_EVERY == 0
+    if due:
+        evict()
+
+def evict(max_bytes=MAX_BYTES, max_age=MAX_AGE):
+    """Delete entries older than max_age, then the least recently used until the rest fit in max_bytes. Returns how many went."""
+    deleted, _ = models.LLMResponse.objects.filter(created_at__lt=datetime.now() - max_age).delete()
+    excess = (models.LLMResponse.objects.aggregate(total=Sum("size"))["total"] or 0) - max_bytes
+    ids = []
+    if excess > 0:
+        for pk, size in models.LLMResponse.objects.order_by("used_at", "pk").values_list("pk", "size").iterator():
+            ids.append(pk)
+            excess -= size
+            if excess <= 0:
+                break
+    for start in range(0, len(ids), DELETE_BATCH_SIZE):
+        deleted += models.LLMResponse.objects.filter(pk__in=ids[start:start + DELETE_BATCH_SIZE]).delete()[0]
+    return deleted
@@ -0,0 +1,100 @@
+from game import models
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+import json
+import zlib
+
+# CharacterLogs older than the retention period are moved into compressed per-character
+# CharacterLogArchive segments. The newest logs (and the newest success and error, which the
+# play page shows) always stay in the live table.
+RETENTION_DAYS = getattr(settings, "CHARACTER_LOG_RETENTION_DAYS", 30)
+KEEP_LATEST = getattr(settings, "CHARACTER_LOG_KEEP_LATEST", 50)
+SEGMENT_SIZE = getattr(settings, "CHARACTER_LOG_ARCHIVE_SEGMENT_SIZE", 500)
+
+@dataclass
+class ArchiveReport:
+    characters: int = 0
+    logs: int = 0
+    segments: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+
+def archive_logs(retention_days=RETENTION_DAYS, keep_latest=KEEP_LATEST, segment_size=SEGMENT_SIZE, now=None) -> ArchiveReport:
+    cutoff = (now or datetime.now()) - timedelta(days=retention_days)
+    report = ArchiveReport()
+    character_ids = models.CharacterLog.objects.filter(created_at__lt=cutoff).values_list("character_id", flat=True).distinct()
+    for character_id in list(character_ids):
+        archived = archive_character_logs(character_id, cutoff, keep_latest, segment_size, report)
+        report.characters += bool(archived)
+    return report
+
+def archive_character_logs(character_id, cutoff, keep_latest, segment_size, report):
+    logs = models.CharacterLog.objects.filter(character_id=character_id)
+    newest = ("-created_at", "-id")
+    kept_ids = set(logs.order_by(*newest).values_list("id", flat=True)[:keep_latest])
+    kept_ids |= set(logs.filter(success=True).order_by(*newest).values_list("id", flat=True)[:1])
+    kept_ids |= set(logs.filter(success=False).order_by(*newest).values_list("id", flat=True)[:1])
+    old_logs = logs.filter(created_at__lt=cutoff).exclude(id__in=kept_ids).order_by("created_at", "id")
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            segment = list(old_logs[:segment_size])
+            if not segment:
+                return archived
+            entries = [[log.id, log.command, log.success, log.message, log.created_at.isoformat()] for log in segment]
+            raw = json.dumps(entries).encode()
+            data = zlib.compress(raw, 6)
+            models.CharacterLogArchive.objects.create(
+                character_id=character_id,
+                first_created_at=segment[0].created_at,
+                last_created_at=segment[-1].created_at,
+                log_count=len(segment),
+                data=data,
+            )
+            models.CharacterLog.objects.filter(id__in=[log.id for log in segment]).delete()
+        archived += len(segment)
+        report.logs += len(segment)
+        report.segments += 1
+        report.bytes_before += len(raw)
+        report.bytes_after += len(data)
+
+def unpack(archive):
+    return [
+        models.CharacterLog(id=log_id, character_id=archive.character_id, command=command, success=success, message=message, created_at=datetime.fromisoformat(created_at))
+        for log_id, command, success, message, created_at in json.loads(zlib.decompress(archive.data))
+    ]
+
+def encode_cursor(log):
+    return f"{log.created_at.isoformat()}_{log.id}"
+
+def decode_cursor(cursor):
+    created_at, log_id = cursor.rsplit("_", 1)
+    return datetime.fromisoformat(created_at), int(log_id)
+
+def history(character, before=None, limit=20):
+    """Logs older than the cursor, newest first, from the live table and then the archives.
+
+    Returns the page and the cursor for the next one (None at the beginning of time).
+    """
+    key = lambda log: (log.created_at, log.id)
+    logs = models.CharacterLog.objects.filter(character=character)
+    archives = models.CharacterLogArchive.objects.filter(character=character)
+    if before:
+        created_at, log_id = before
+        logs = logs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=log_id))
+        archives = archives.filter(first_created_at__lte=created_at)
+    candidates = list(logs.order_by("-created_at", "-id")[:limit + 1])
+
+    # segments can overlap each other and the live logs, so keep reading them (newest first)
+    # until none could hold anything newer than what's already on the page
+    for archive in archives.order_by("-last_created_at").iterator():
+        if len(candidates) > limit and archive.last_created_at < key(sorted(candidates, key=key, reverse=True)[limit])[0]:
+            break
+        candidates += [log for log in unpack(archive) if not before or key(log) < before]
+
+    page = sorted(candidates, key=key, reverse=True)[:limit + 1]
+    return page[:limit], (encode_cursor(page[limit - 1]) if len(page) > limit else None)
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+import time
+
+# the items and paths part of look, cached per (world, location) under version numbers that signals.py
+# bumps when items come or go, paths change or names change. a look at an unchanged location is a couple
+# of cache reads. template worlds have versions too, so a change there reaches every world built on it.
+CACHE_ALIAS = getattr(settings, "LOOK_CACHE", "default")
+TIMEOUT_SECONDS = 60 * 60
+WHOLE_WORLD = "*" # version bumped by changes that can show up anywhere in a world, e.g. renamed items
+
+def version_key(world_id, location_id):
+    return f"look:version:{world_id}:{location_id}"
+
+def version_keys(world, location_id):
+    return [version_key(world_id, scope) for world_id in world.content_world_ids for scope in [location_id, WHOLE_WORLD]]
+
+def fragment_key(world, location_id, versions):
+    return f"look:{world.id}:{location_id}:{'.'.join(str(versions[key]) for key in sorted(versions))}"
+
+def new_version():
+    # never restart from 0, or an evicted version could bring back fragments cached under an old one
+    return time.time_ns()
+
+def get(world, location_id, build):
+    cache = caches[CACHE_ALIAS]
+    keys = version_keys(world, location_id)
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    key = fragment_key(world, location_id, versions)
+    fragment = cache.get(key)
+    if fragment is None:
+        fragment = build()
+        cache.set(key, fragment, TIMEOUT_SECONDS)
+    return fragment
+
+async def aget(world, location_id, abuild):
+    cache = caches[CACHE_ALIAS]
+    keys = version_keys(world, location_id)
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, new_version(), None)
+            versions[key] = await cache.aget(key)
+    key = fragment_key(world, location_id, versions)
+    fragment = await cache.aget(key)
+    if fragment is None:
+        fragment = await abuild()
+        await cache.aset(key, fragment, TIMEOUT_SECONDS)
+    return fragment
+
+def bump(world_id, location_id=WHOLE_WORLD):
+    caches[CACHE_ALIAS].set(version_key(world_id, location_id), new_version(), None)
+
+def changed(world_id, location_id=WHOLE_WORLD):
+    # now, and again once committed so a look that ran mid-transaction doesn't stay cached
+    if world_id is None or location_id is None:
+        return
+    bump(world_id, location_id)
+    transaction.on_commit(lambda: bump(world_id, location_id))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from game import log_archive
+
+class Command(BaseCommand):
+    help = "Move old character logs into compressed archive segments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=log_archive.RETENTION_DAYS, help="archive logs older than this many days")
+        parser.add_argument("--keep", type=int, default=log_archive.KEEP_LATEST, help="always keep this many of each character's newest logs")
+        parser.add_argument("--segment-size", type=int, default=log_archive.SEGMENT_SIZE, help="logs per archive segment")
+
+    def handle(self, *args, **options):
+        report = log_archive.archive_logs(options["days"], options["keep"], options["segment_size"])
+        ratio = report.bytes_after / report.bytes_before if report.bytes_before else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {report.logs} logs from {report.characters} characters into {report.segments} segments "
+            f"({report.bytes_before} -> {report.bytes_after} bytes, {ratio:.0%})"
+        ))
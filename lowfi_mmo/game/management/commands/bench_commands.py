@@ -0,0 +1,45 @@
+import random
+import re
+import time
+from django.core.management.base import BaseCommand
+from game import commands
+
+class Command(BaseCommand):
+    help = "Microbenchmark command parsing with many verbs registered"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verbs", type=int, default=60, help="Extra verbs to register on top of the built in ones")
+        parser.add_argument("--inputs", type=int, default=100_000)
+        parser.add_argument("--distinct", type=int, default=500, help="Distinct inputs, i.e. how well the parse cache can do")
+
+    def handle(self, *args, verbs, inputs, distinct, **options):
+        registry = commands.CommandRegistry()
+        for builtin in commands.COMMANDS:
+            registry.register(builtin.name, builtin.args_regex, builtin.arg_syntax, builtin.description, builtin.aliases)(builtin.handler)
+        for i in range(verbs):
+            registry.register(f"verb{i}", r"(?: ([a-zA-Z\ ]*))?", "[thing]", "Benchmark verb", aliases=[f"v{i}"])(lambda character, arg: None)
+
+        rng = random.Random(0)
+        nouns = ["main street", "bronze key", "trapdoor", "city center", "library", "forest"]
+        verb_names = [verb for verb in registry.verbs]
+        distinct_inputs = [f"{rng.choice(verb_names)} {rng.choice(nouns)}" for _ in range(distinct)]
+        workload = [rng.choice(distinct_inputs) for _ in range(inputs)]
+
+        # what parse_command used to do: try every command's full regex in turn
+        full_regexes = [(c.name, rf"^(?:{'|'.join([c.name, *c.aliases])}){c.args_regex}$") for c in registry.commands]
+        def linear_scan(raw_input):
+            for name, regex in full_regexes:
+                match = re.match(regex, raw_input.strip().replace("'", ""), re.IGNORECASE)
+                if match:
+                    return name, match.groups()
+            return None, None
+
+        uncached = lambda raw_input: registry._parse(raw_input.strip().replace("'", ""))
+        cached = lambda raw_input: commands.parse_command(None, raw_input, registry)
+        self.stdout.write(f"{len(registry.commands)} commands, {len(registry.verbs)} verbs, {inputs} inputs ({distinct} distinct)")
+        for label, parse in [("linear scan", linear_scan), ("verb table", uncached), ("verb table + lru", cached)]:
+            started = time.perf_counter()
+            for raw_input in workload:
+                parse(raw_input)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{label:>18}: {inputs / elapsed:12,.0f} parses/s ({elapsed / inputs * 1e6:.2f}us each)")
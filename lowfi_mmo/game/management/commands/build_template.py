@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+from game import models
+from game.worldgen.world_creator import content_version, populate_world
+
+class Command(BaseCommand):
+    help = "Build the shared template world for the current worldgen files and report what it cost"
+
+    def handle(self, *args, **options):
+        version = content_version()
+        existing = models.World.objects.filter(is_template=True, content_version=version).first()
+        if existing:
+            self.stdout.write(f"Template \"{existing}\" is already up to date.")
+            return
+        with atomic():
+            template = models.World.objects.create(name=f"template {version[:8]}", is_template=True, content_version=version)
+            report = populate_world(template)
+        self.stdout.write(self.style.SUCCESS(f"Built template \"{template}\": {report}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from game import inventory
+
+class Command(BaseCommand):
+    help = "Check characters' carried weight and item count totals against their items"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="fix any totals that are out of step")
+
+    def handle(self, *args, **options):
+        mismatches = inventory.find_mismatches()
+        for m in mismatches:
+            self.stdout.write(f"Character {m.character_id}: {m.carried_kg:g} kg / {m.carried_count} items recorded, {m.actual_kg:g} kg / {m.actual_count} items carried")
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All inventory totals are consistent."))
+        elif options["rebuild"]:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {inventory.rebuild(mismatches)} characters' totals."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(mismatches)} characters are out of step, run with --rebuild to fix them."))
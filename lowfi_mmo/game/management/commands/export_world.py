@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from game import models, world_transfer
+import gzip
+
+class Command(BaseCommand):
+    help = "Write one world to a gzipped JSON Lines file that import_world can load"
+
+    def add_arguments(self, parser):
+        parser.add_argument("world_id", type=int)
+        parser.add_argument("--output", help="file to write, world-<id>.jsonl.gz by default")
+
+    def handle(self, *args, **options):
+        world = models.World.objects.filter(id=options["world_id"]).first()
+        if not world:
+            raise CommandError(f"World {options['world_id']} does not exist")
+        path = options["output"] or f"world-{world.id}.jsonl.gz"
+        with gzip.open(path, "wt", encoding="utf-8") as out:
+            counts = world_transfer.export_world(world, out)
+        rows = ", ".join(f"{count} {kind}" for kind, count in counts.items())
+        self.stdout.write(self.style.SUCCESS(f"Exported \"{world}\" to {path} ({rows})"))
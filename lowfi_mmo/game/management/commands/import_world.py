@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from game import world_transfer
+import gzip
+
+class Command(BaseCommand):
+    help = "Create a new world from a file written by export_world"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--owner", required=True, help="username of the new world's owner")
+        parser.add_argument("--name", help="name for the new world, the exported name by default")
+        parser.add_argument("--chunk-size", type=int, default=world_transfer.CHUNK_SIZE, help="rows inserted per transaction")
+
+    def handle(self, *args, **options):
+        owner = User.objects.filter(username=options["owner"]).first()
+        if not owner:
+            raise CommandError(f"User \"{options['owner']}\" does not exist")
+        with gzip.open(options["path"], "rt", encoding="utf-8") as lines:
+            try:
+                report = world_transfer.import_world(lines, owner, options["name"], options["chunk_size"])
+            except world_transfer.TransferError as error:
+                raise CommandError(str(error))
+        rows = ", ".join(f"{count} {model}" for model, count in report.rows.items())
+        self.stdout.write(self.style.SUCCESS(f"Imported world \"{report.world}\" ({report.world.id}): {rows}"))
+        if report.unknown_users:
+            self.stdout.write(self.style.WARNING(f"{report.unknown_users} characters' players aren't on this deployment, they now belong to {owner}"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from game import models, llm_cache
+
+class Command(BaseCommand):
+    help = "Show the cached NPC replies and their hit rate, and evict old or excess ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--evict", action="store_true", help="evict entries past the age and size limits now")
+        parser.add_argument("--clear", action="store_true", help="delete every cached reply")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            deleted, _ = models.LLMResponse.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} cached replies"))
+        elif options["evict"]:
+            self.stdout.write(self.style.SUCCESS(f"Evicted {llm_cache.evict()} cached replies"))
+        totals = models.LLMResponse.objects.aggregate(entries=Count("pk"), size=Sum("size"), hits=Sum("hits"))
+        self.stdout.write(
+            f"{totals['entries']} replies, {totals['size'] or 0} of {llm_cache.MAX_BYTES} bytes, served {totals['hits'] or 0} times. "
+            f"Hit rate {llm_cache.hit_rate():.0%} across running processes."
+        )
@@ -0,0 +1,189 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, connections, OperationalError
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+from game import models
+from game.worldgen.world_creator import get_base_world, populate_world
+from game.worldgen.character_creator import spawn_npcs
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+
+# bots play through the real views, picking what to do next from what the game last told them
+LOCATION_REGEX = re.compile(r'<span class="location">([^<]*)</span>')
+ITEM_REGEX = re.compile(r'<span class="item">([^<]*)</span>')
+
+@dataclass
+class Stats:
+    latencies: list = field(default_factory=list)
+    commands: int = 0
+    failed_commands: int = 0 # the game said no, e.g. "You cannot go down"
+    bad_responses: int = 0
+    lock_errors: int = 0
+    other_errors: int = 0
+    queries: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+class Bot:
+    def __init__(self, client, url, rng):
+        self.client = client
+        self.url = url
+        self.rng = rng
+        self.paths = []
+        self.items = []
+        self.carrying = []
+
+    def next_command(self):
+        roll = self.rng.random()
+        if not self.paths or roll < 0.3:
+            return "look"
+        if roll < 0.75:
+            return f"go {self.rng.choice(self.paths)}"
+        if roll < 0.9 and self.items:
+            return f"take {self.rng.choice(self.items)}"
+        if self.carrying:
+            # try keys on whatever the paths lead through
+            return f"use {self.rng.choice(self.carrying)} on {self.rng.choice(self.paths).split(' ')[-1]}"
+        return "look"
+
+    def observe(self, command, log):
+        if not log["success"]:
+            return
+        if command.startswith("take"):
+            taken = ITEM_REGEX.findall(log["message"])
+            self.carrying += taken
+            self.items = [item for item in self.items if item not in taken]
+        elif command.startswith("look") or command.startswith("go"):
+            self.paths = LOCATION_REGEX.findall(log["message"])
+            self.items = ITEM_REGEX.findall(log["message"])
+
+    def play(self, commands, think_seconds, stats, start):
+        start.wait()
+        try:
+            for _ in range(commands):
+                command = self.next_command()
+                started = time.perf_counter()
+                try:
+                    response = self.client.post(self.url, {"command": command})
+                except OperationalError as error:
+                    with stats.lock:
+                        if "locked" in str(error): stats.lock_errors += 1
+                        else: stats.other_errors += 1
+                    continue
+                except Exception:
+                    with stats.lock:
+                        stats.other_errors += 1
+                    continue
+                elapsed = time.perf_counter() - started
+                log = response.json() if response.status_code == 200 else None
+                with stats.lock:
+                    stats.commands += 1
+                    stats.latencies.append(elapsed)
+                    stats.bad_responses += log is None
+                    stats.failed_commands += bool(log) and not log["success"]
+                if log:
+                    self.observe(command, log)
+                if think_seconds:
+                    time.sleep(self.rng.uniform(0, 2 * think_seconds))
+        finally:
+            connections.close_all()
+
+class Command(BaseCommand):
+    help = "Simulate players sending commands concurrently through the play views and report how the game holds up"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bots", type=int, default=20, help="number of simulated players")
+        parser.add_argument("--commands", type=int, default=50, help="commands each bot sends")
+        parser.add_argument("--think-ms", type=int, default=0, help="average pause between a bot's commands")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--populate", action="store_true", help="give the world its own copy of the content instead of sharing the template")
+        parser.add_argument("--keep", action="store_true", help="keep the load test world and bot users afterwards")
+        parser.add_argument("--inline", action="store_true", help="run each command in its own request instead of in game ticks")
+
+    def handle(self, *args, **options):
+        run_id = uuid.uuid4().hex[:8]
+        owner = User.objects.create_user(f"loadtest-{run_id}")
+        if options["populate"]:
+            world = models.World.objects.create(owner=owner, name=f"loadtest {run_id}")
+            self.stdout.write(f"Populated world: {populate_world(world)}")
+        else:
+            world = models.World.objects.create(owner=owner, name=f"loadtest {run_id}", base=get_base_world())
+            spawn_npcs(world)
+        users = [owner]
+        try:
+            bots = self.spawn_bots(world, options["bots"], run_id, users, random.Random(options["seed"]))
+            with override_settings(GAME_TICK_SECONDS=None) if options["inline"] else nullcontext():
+                self.run_bots(bots, options["commands"], options["think_ms"] / 1000)
+        finally:
+            if not options["keep"]:
+                world.delete()
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def spawn_bots(self, world, count, run_id, users, rng):
+        started = time.perf_counter()
+        bots = []
+        for i in range(count):
+            user = User.objects.create_user(f"loadtest-{run_id}-{i}")
+            users.append(user)
+            client = Client()
+            client.force_login(user)
+            # the same form post a player would make
+            name = f"Bot{i}"
+            client.post(reverse("character_create", kwargs={"world_id": world.id}), {
+                "character-name": name,
+                "character-appearance": "Robotic",
+                "character-personality": "Relentless",
+                "character-description": "Here to find out how many of us it takes",
+            })
+            character = models.Character.objects.get(world=world, user=user)
+            url = reverse("play_command", kwargs={"world_id": world.id, "character_slug": character.slug})
+            bots.append(Bot(client, url, random.Random(rng.random())))
+        self.stdout.write(f"Spawned {count} bots in {time.perf_counter() - started:.2f}s")
+        return bots
+
+    def run_bots(self, bots, commands, think_seconds):
+        stats = Stats()
+        def count_query(execute, sql, params, many, context):
+            with stats.lock:
+                stats.queries += 1
+            return execute(sql, params, many, context)
+        def count_connection_queries(sender, connection, **kwargs):
+            if count_query not in connection.execute_wrappers: # connections reconnect after each request
+                connection.execute_wrappers.append(count_query)
+        # every thread's connection, including the tick scheduler's
+        connection_created.connect(count_connection_queries)
+        connection.execute_wrappers.append(count_query)
+        start = threading.Barrier(len(bots) + 1)
+        try:
+            with ThreadPoolExecutor(len(bots)) as executor:
+                futures = [executor.submit(bot.play, commands, think_seconds, stats, start) for bot in bots]
+                start.wait()
+                started = time.perf_counter()
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - started
+        finally:
+            connection_created.disconnect(count_connection_queries)
+            connection.execute_wrappers.remove(count_query)
+        self.report(stats, elapsed)
+
+    def report(self, stats, elapsed):
+        if len(stats.latencies) > 1:
+            percentiles = statistics.quantiles(stats.latencies, n=100, method="inclusive") # never past the slowest
+            p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+        else:
+            p50 = p95 = p99 = stats.latencies[0] if stats.latencies else 0
+        self.stdout.write(f"{stats.commands} commands in {elapsed:.2f}s: {stats.commands / elapsed:.1f} commands/s")
+        self.stdout.write(f"latency: p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, p99 {p99 * 1000:.1f}ms, max {max(stats.latencies, default=0) * 1000:.1f}ms")
+        self.stdout.write(f"queries per command: {stats.queries / max(stats.commands, 1):.1f}")
+        self.stdout.write(f"commands the game refused: {stats.failed_commands}, non-200 responses: {stats.bad_responses}")
+        errors = f"lock contention errors: {stats.lock_errors}, other errors: {stats.other_errors}"
+        self.stdout.write(self.style.ERROR(errors) if stats.lock_errors or stats.other_errors else self.style.SUCCESS(errors))
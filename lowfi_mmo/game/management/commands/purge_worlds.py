@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from game import world_purge
+
+class Command(BaseCommand):
+    help = "Remove deleted worlds from the database in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=world_purge.BATCH_SIZE, help="rows deleted per transaction")
+        parser.add_argument("--pause-ms", type=int, default=int(world_purge.PAUSE_SECONDS * 1000), help="pause between batches to let other writers in")
+
+    def handle(self, *args, **options):
+        def progress(report):
+            if report.done:
+                self.stdout.write(self.style.SUCCESS(f"Purged world {report.world_id}: {report.total_rows} rows in {report.batches} batches"))
+            else:
+                self.stdout.write(f"world {report.world_id}: {report.table} {report.rows[report.table]} rows ({report.total_rows} total)")
+        reports = world_purge.purge_deleted_worlds(batch_size=options["batch_size"], pause_seconds=options["pause_ms"] / 1000, progress=progress)
+        if not reports:
+            self.stdout.write("No deleted worlds to purge")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from game import npcs
+import random
+import time
+
+class Command(BaseCommand):
+    help = "Move npcs around every world, for deployments that don't simulate them in the web process"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=npcs.tick_seconds() or 5, help="time between ticks")
+        parser.add_argument("--once", action="store_true", help="run a single tick and report on it")
+        parser.add_argument("--seed", type=int, help="make the npcs' choices repeatable")
+
+    def handle(self, *args, **options):
+        simulation = npcs.Simulation(random.Random(options["seed"]))
+        while True:
+            started = time.monotonic()
+            report = simulation.tick()
+            if options["once"] or options["verbosity"] > 1:
+                self.stdout.write(f"{report.npcs} npcs in {report.batches} batches: {report.moved} moved, {report.greeted} greeted players ({time.monotonic() - started:.3f}s)")
+            if options["once"]:
+                return
+            time.sleep(max(0, options["seconds"] - (time.monotonic() - started)))
@@ -0,0 +1,203 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.db.backends.signals import connection_created
+from contextvars import ContextVar
+from functools import wraps
+import bisect
+import inspect
+import os
+import threading
+import time
+import uuid
+
+# calls, latency, queries and failures per command verb and per systems function, kept in process
+# and cheap to record: a lock, a few additions and a bisect per call. each process publishes its
+# numbers to the METRICS_CACHE every few seconds and the metrics view adds up every process it
+# finds there, so with a shared cache one scrape covers all the workers.
+CACHE_ALIAS = getattr(settings, "METRICS_CACHE", "default")
+PUBLISH_SECONDS = 5
+WORKER_TIMEOUT_SECONDS = 5 * 60 # a worker that stops publishing drops out of the totals after this
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+OUTCOMES = ("ok", "refused", "error") # refused: the game said no, error: an exception
+
+WORKERS_KEY = "metrics:workers"
+
+class Series:
+    __slots__ = ("outcomes", "seconds", "seconds_sum", "queries", "queries_sum")
+
+    def __init__(self):
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.seconds = [0] * (len(SECONDS_BUCKETS) + 1) # non-cumulative, the last one is +Inf
+        self.seconds_sum = 0.0
+        self.queries = [0] * (len(QUERY_BUCKETS) + 1)
+        self.queries_sum = 0
+
+    def record(self, outcome, seconds, queries):
+        self.outcomes[outcome] += 1
+        self.seconds[bisect.bisect_left(SECONDS_BUCKETS, seconds)] += 1
+        self.seconds_sum += seconds
+        self.queries[bisect.bisect_left(QUERY_BUCKETS, queries)] += 1
+        self.queries_sum += queries
+
+    def snapshot(self):
+        return {
+            "outcomes": dict(self.outcomes),
+            "seconds": list(self.seconds),
+            "seconds_sum": self.seconds_sum,
+            "queries": list(self.queries),
+            "queries_sum": self.queries_sum,
+        }
+
+class Registry:
+    def __init__(self):
+        self.series = {} # (kind, name) -> Series
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.published = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, outcome, seconds, queries):
+        with self._lock:
+            series = self.series.get((kind, name))
+            if series is None:
+                series = self.series[(kind, name)] = Series()
+            series.record(outcome, seconds, queries)
+        if time.monotonic() - self.published > PUBLISH_SECONDS:
+            self.publish()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: series.snapshot() for key, series in self.series.items()}
+
+    def publish(self):
+        self.published = time.monotonic()
+        cache = caches[CACHE_ALIAS]
+        cache.set(f"metrics:worker:{self.worker_id}", self.snapshot(), WORKER_TIMEOUT_SECONDS)
+        workers = cache.get(WORKERS_KEY) or set()
+        if self.worker_id not in workers:
+            # two workers adding themselves at once can lose one, it adds itself again next publish
+            cache.set(WORKERS_KEY, workers | {self.worker_id}, None)
+
+    def reset(self):
+        with self._lock:
+            self.series.clear()
+
+registry = Registry()
+
+def collect():
+    """Every live worker's series added together, this one's up to date."""
+    registry.publish()
+    cache = caches[CACHE_ALIAS]
+    workers = cache.get(WORKERS_KEY) or set()
+    snapshots = cache.get_many([f"metrics:worker:{worker_id}" for worker_id in workers])
+    if len(snapshots) < len(workers):
+        live = {key.rsplit(":", 1)[1] for key in snapshots}
+        cache.set(WORKERS_KEY, (cache.get(WORKERS_KEY) or set()) - (workers - live), None)
+    totals = {}
+    for snapshot in snapshots.values():
+        for key, series in snapshot.items():
+            total = totals.setdefault(key, Series())
+            for outcome, count in series["outcomes"].items():
+                total.outcomes[outcome] += count
+            total.seconds = [a + b for a, b in zip(total.seconds, series["seconds"])]
+            total.queries = [a + b for a, b in zip(total.queries, series["queries"])]
+            total.seconds_sum += series["seconds_sum"]
+            total.queries_sum += series["queries_sum"]
+    return totals
+
+# queries are counted by a wrapper on every connection, into whichever measurements are running in the
+# current context. contextvars follow sync_to_async into its thread, so async commands are counted too.
+_counters = ContextVar("metrics_counters", default=())
+
+def count_query(execute, sql, params, many, context):
+    for counter in _counters.get():
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+def install_query_counter(connection, **kwargs):
+    if count_query not in connection.execute_wrappers: # the wrapper list outlives reconnects
+        connection.execute_wrappers.append(count_query)
+
+connection_created.connect(install_query_counter)
+for connection in connections.all(initialized_only=True):
+    install_query_counter(connection)
+
+def outcome_of(result):
+    # systems.Result and CharacterLog both have success
+    return "refused" if getattr(result, "success", True) is False else "ok"
+
+def timed(kind, name=None):
+    """Record calls to a sync or async function under kind and name.
+
+    name is a string, a function of the call's arguments, or by default the function's name.
+    """
+    def decorator(function):
+        def series_name(args, kwargs):
+            if callable(name):
+                return name(*args, **kwargs)
+            return name or function.__name__
+
+        def start():
+            counter = [0]
+            token = _counters.set(_counters.get() + (counter,))
+            return counter, token, time.perf_counter()
+
+        def finish(args, kwargs, outcome, counter, token, started):
+            seconds = time.perf_counter() - started
+            _counters.reset(token)
+            registry.record(kind, series_name(args, kwargs), outcome, seconds, counter[0])
+
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                counter, token, started = start()
+                outcome = "error"
+                try:
+                    result = await function(*args, **kwargs)
+                    outcome = outcome_of(result)
+                    return result
+                finally:
+                    finish(args, kwargs, outcome, counter, token, started)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            counter, token, started = start()
+            outcome = "error"
+            try:
+                result = function(*args, **kwargs)
+                outcome = outcome_of(result)
+                return result
+            finally:
+                finish(args, kwargs, outcome, counter, token, started)
+        return wrapper
+    return decorator
+
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def histogram_lines(metric, labels, buckets, counts, total):
+    lines, cumulative = [], 0
+    for bound, count in zip([*buckets, "+Inf"], counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f"{metric}_sum{{{labels}}} {total}")
+    lines.append(f"{metric}_count{{{labels}}} {cumulative}")
+    return lines
+
+def render(totals=None):
+    """The Prometheus text exposition format."""
+    totals = collect() if totals is None else totals
+    keys = sorted(totals)
+    calls = ["# HELP lowfi_calls_total Calls by outcome: ok, refused by the game, or error.", "# TYPE lowfi_calls_total counter"]
+    seconds = ["# HELP lowfi_call_seconds Time per call, including its transaction for commands.", "# TYPE lowfi_call_seconds histogram"]
+    queries = ["# HELP lowfi_call_queries Database queries per call.", "# TYPE lowfi_call_queries histogram"]
+    for kind, name in keys:
+        series = totals[(kind, name)]
+        labels = f'kind="{label(kind)}",name="{label(name)}"'
+        for outcome in OUTCOMES:
+            calls.append(f'lowfi_calls_total{{{labels},outcome="{outcome}"}} {series.outcomes[outcome]}')
+        seconds += histogram_lines("lowfi_call_seconds", labels, SECONDS_BUCKETS, series.seconds, series.seconds_sum)
+        queries += histogram_lines("lowfi_call_queries", labels, QUERY_BUCKETS, series.queries, series.queries_sum)
+    return "\n".join(calls + seconds + queries) + "\n"
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0002_remove_item_unlock_description_remove_item_unlocks_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entity',
+            name='overrides',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='copies', to='game.entity'),
+        ),
+        migrations.AddField(
+            model_name='world',
+            name='base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='instances', to='game.world'),
+        ),
+        migrations.AddField(
+            model_name='world',
+            name='content_version',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='world',
+            name='is_template',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='world',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='world',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_template', True)), fields=('content_version',), name='unique_template_content_version'),
+        ),
+    ]
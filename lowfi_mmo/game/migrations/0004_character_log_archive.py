@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0003_world_templates_and_entity_copies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CharacterLogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('log_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='characterlog',
+            index=models.Index(fields=['character', 'success', 'created_at'], name='characterlog_history_idx'),
+        ),
+        migrations.AddField(
+            model_name='characterlogarchive',
+            name='character',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game.character'),
+        ),
+        migrations.AddIndex(
+            model_name='characterlogarchive',
+            index=models.Index(fields=['character', 'last_created_at'], name='characterlogarchive_range_idx'),
+        ),
+    ]
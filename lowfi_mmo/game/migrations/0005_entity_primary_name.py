@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:54
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_primary_names(apps, schema_editor):
+    Entity = apps.get_model('game', 'Entity')
+    Name = apps.get_model('game', 'Name')
+    first_name = Name.objects.filter(entity=OuterRef('pk')).order_by('id')
+    Entity.objects.update(
+        primary_name=Coalesce(Subquery(first_name.values('name')[:1]), Value('')),
+        primary_slug=Coalesce(Subquery(first_name.values('slug')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0004_character_log_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entity',
+            name='primary_name',
+            field=models.CharField(blank=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='entity',
+            name='primary_slug',
+            field=models.SlugField(blank=True, editable=False),
+        ),
+        migrations.RunPython(backfill_primary_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:55
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_inventory_totals(apps, schema_editor):
+    Character = apps.get_model('game', 'Character')
+    Item = apps.get_model('game', 'Item')
+    carried = Item.objects.filter(carrier=OuterRef('pk')).order_by().values('carrier')
+    Character.objects.update(
+        carried_kg=Coalesce(Subquery(carried.annotate(total=Sum('kg')).values('total')), Value(0.0), output_field=FloatField()),
+        carried_count=Coalesce(Subquery(carried.annotate(total=Count('pk')).values('total')), Value(0), output_field=IntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0005_entity_primary_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='carried_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='character',
+            name='carried_kg',
+            field=models.FloatField(default=0.0, editable=False),
+        ),
+        migrations.RunPython(backfill_inventory_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0006_character_inventory_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorldLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('positions', models.JSONField(default=dict)),
+                ('edges', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('world', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='layout', to='game.world')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0007_world_layout'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='character',
+            index=models.Index(fields=['position', 'user'], name='character_position_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='characterlog',
+            index=models.Index(fields=['character', 'created_at'], name='characterlog_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entity',
+            index=models.Index(fields=['world', 'overrides'], name='entity_world_overrides_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='name',
+            index=models.Index(fields=['slug', 'entity'], name='name_slug_entity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='path',
+            index=models.Index(fields=['start', 'noun_slug'], name='path_start_noun_idx'),
+        ),
+    ]
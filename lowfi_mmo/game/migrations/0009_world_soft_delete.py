@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:08
+
+import django.db.models.manager
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='world',
+            options={'base_manager_name': 'all_objects', 'ordering': ['name']},
+        ),
+        migrations.AlterModelManagers(
+            name='world',
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('all_objects', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='world',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='world',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='world',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted_at__isnull', True)), fields=('owner', 'name'), name='unique_owner_world_name'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0009_world_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='character',
+            name='home',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='game.location'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_character_home'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResponse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('prompt_version', models.PositiveIntegerField()),
+                ('response', models.TextField()),
+                ('size', models.PositiveIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('used_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['used_at'], name='llmresponse_lru_idx'), models.Index(fields=['created_at'], name='llmresponse_age_idx')],
+            },
+        ),
+    ]
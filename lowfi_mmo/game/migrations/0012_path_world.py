@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def backfill_path_worlds(apps, schema_editor):
+    Entity = apps.get_model('game', 'Entity')
+    Path = apps.get_model('game', 'Path')
+    Path.objects.update(world_id=Subquery(Entity.objects.filter(pk=OuterRef('start_id')).values('world_id')[:1]))
+    # paths from a template location into a world built on it belong to that world
+    into_instances = {}
+    for path_id, world_id in Path.objects.filter(end__world__base_id=F('start__world_id')).values_list('id', 'end__world_id'):
+        into_instances.setdefault(world_id, []).append(path_id)
+    for world_id, path_ids in into_instances.items():
+        Path.objects.filter(id__in=path_ids).update(world_id=world_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_llm_response_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='path',
+            name='world',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='game.world'),
+        ),
+        migrations.RunPython(backfill_path_worlds, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='path',
+            name='world',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='paths', to='game.world'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='path',
+            unique_together={('world', 'start', 'end', 'preposition'), ('world', 'start', 'preposition', 'noun')},
+        ),
+    ]
@@ -2,8 +2,8 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, MinValueValidator
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
 from django.utils.text import slugify
+from copy import copy as shallow_copy
 
 alphanumeric_validator = RegexValidator(
     r'^[a-zA-Z0-9\s\']*$',
@@ -13,17 +13,45 @@ alphanumeric_validator = RegexValidator(
 def slugify_spaceless(entity):
     return slugify(str(entity)).replace("-", "")
 
+class WorldManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
 class World(models.Model):
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE) # null for shared templates
     name = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
+    # copy-on-write: content is read through from the base template, only per-world changes are stored here
+    base = models.ForeignKey("World", null=True, blank=True, on_delete=models.PROTECT, related_name="instances")
+    is_template = models.BooleanField(default=False)
+    content_version = models.CharField(max_length=64, blank=True) # hash of the worldgen files a template was built from
+    # set when the owner deletes the world, which hides it straight away. game/world_purge.py removes it in the background
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    objects = WorldManager()
+    all_objects = models.Manager() # including deleted worlds waiting to be purged
     # TODO: timezone field somehow
+    @property
+    def content_world_ids(self):
+        return [self.id, self.base_id] if self.base_id else [self.id]
     def __str__(self):
         return self.name
     class Meta:
         ordering = ['name']
-        unique_together = [["owner", "name"]]
+        base_manager_name = "all_objects"
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "name"], condition=models.Q(deleted_at__isnull=True), name="unique_owner_world_name"),
+            models.UniqueConstraint(fields=["content_version"], condition=models.Q(is_template=True), name="unique_template_content_version"),
+        ]
     
+class WorldLayout(models.Model):
+    """Where the world visualizer draws each location, see worldgen/world_layout.py."""
+    world = models.OneToOneField(World, on_delete=models.CASCADE, related_name="layout")
+    positions = models.JSONField(default=dict) # location id -> [x, y]
+    edges = models.JSONField(default=list) # the [start id, end id] pairs the positions were laid out for
+    updated_at = models.DateTimeField(auto_now=True)
+    def __str__(self):
+        return f"Layout of {self.world}"
+
 class WorldMember(models.Model):
     world = models.ForeignKey(World, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -36,27 +64,92 @@ class Tag(models.Model):
         return self.name
 
 class EntityQuerySet(models.QuerySet):
+    narrowed = False # to a location or an inventory, few enough entities for fuzzy_match to list them
+    def _clone(self):
+        clone = super()._clone()
+        clone.narrowed = self.narrowed
+        return clone
+    def narrow(self):
+        clone = self._chain()
+        clone.narrowed = True
+        return clone
     def in_world(self, world):
-        return self.filter(world=world)
+        if not world.base_id:
+            return self.filter(world=world)
+        # read through to the base template, hiding base entities this world has its own copy of
+        shadowed = Entity.objects.filter(world=world, overrides__isnull=False).values("overrides_id")
+        return self.filter(world_id__in=world.content_world_ids).exclude(pk__in=shadowed)
     def at_location(self, location):
-        return self.filter(position=location)
-    def fuzzy_match(self, query):
-        return self.filter(names__slug__iexact=slugify_spaceless(query))
+        return self.filter(position=location).narrow()
+    def carried_by(self, character):
+        return self.filter(carrier=character).narrow()
+    def fuzzy_match(self, query, world):
+        # ranked candidates come from the world's in-memory trigram index (game/fuzzy.py), best match first.
+        # a narrowed queryset only ranks names of its own entities, so a match here isn't crowded out by ones
+        # elsewhere. the index already only holds the world's names, so whole world searches skip listing them
+        from game import fuzzy
+        entity_ids = set(self.values_list("pk", flat=True)) if self.narrowed else None
+        return self.match_slugs(fuzzy.search(world, query, entity_ids=entity_ids))
+    async def afuzzy_match(self, query, world):
+        from game import fuzzy
+        entity_ids = {pk async for pk in self.values_list("pk", flat=True)} if self.narrowed else None
+        return self.match_slugs(await fuzzy.asearch(world, query, entity_ids=entity_ids))
+    def match_slugs(self, slugs):
+        # slugs best first, e.g. from fuzzy.asearch in async code
+        if not slugs:
+            return self.none()
+        ranks = [models.When(names__slug=slug, then=models.Value(rank)) for rank, slug in enumerate(slugs)]
+        match_rank = models.Min(models.Case(*ranks, default=models.Value(len(slugs))))
+        return self.filter(names__slug__in=slugs).annotate(match_rank=match_rank).order_by("match_rank", "pk")
 
 class Entity(models.Model):
     world = models.ForeignKey(World, on_delete=models.CASCADE)
     appearance = models.TextField(blank=True)
     description = models.TextField(blank=True)
     tags = models.ManyToManyField(Tag)
+    overrides = models.ForeignKey("Entity", null=True, blank=True, on_delete=models.CASCADE, related_name="copies") # base entity this is a per-world copy of
+    # denormalized from the entity's first Name (lowest id) so str(entity) doesn't query, kept up to date by signals.py
+    primary_name = models.CharField(max_length=20, blank=True, editable=False)
+    primary_slug = models.SlugField(blank=True, editable=False)
     objects: EntityQuerySet = EntityQuerySet.as_manager()
+    class Meta:
+        indexes = [
+            models.Index(fields=["world", "overrides"], name="entity_world_overrides_idx"), # in_world's shadowed copies
+        ]
+    @property
+    def origin_id(self):
+        return self.overrides_id or self.id
+    def copy_on_write(self, world):
+        """Return the world's own copy of a shared base entity, copying it on first write."""
+        if self.world_id == world.id:
+            return self
+        existing = type(self).objects.filter(world=world, overrides_id=self.id).first()
+        if existing:
+            return existing
+        copy = shallow_copy(self)
+        copy.pk = None
+        copy.id = None
+        copy._state.adding = True
+        copy.world = world
+        copy.overrides_id = self.id
+        copy.save()
+        from game import fuzzy
+        fuzzy.names_saved(Name.objects.bulk_create([Name(world=world, entity=copy, name=name.name, slug=name.slug) for name in self.names.all()]))
+        copy.tags.set(self.tags.all())
+        self.copy_relations_to(copy)
+        return copy
+    def copy_relations_to(self, copy):
+        pass
+    def update_primary_name(self):
+        first_name = self.names.order_by("id").values_list("name", "slug").first()
+        self.primary_name, self.primary_slug = first_name or ("", "")
+        Entity.objects.filter(pk=self.pk).update(primary_name=self.primary_name, primary_slug=self.primary_slug)
     @property
     def name(self):
-        first_name = self.names.order_by('id').first()
-        return first_name.name if first_name else "anonymous entity"
+        return self.primary_name or "anonymous entity"
     @property
     def slug(self):
-        first_name = self.names.first()
-        return first_name.slug if first_name else "anonymous-entity"
+        return self.primary_slug or "anonymous-entity"
     def __str__(self):
         return self.name
 
@@ -73,6 +166,9 @@ class Name(models.Model):
     class Meta:
         ordering = ['entity', 'name']
         unique_together = [["world", "slug"]]
+        indexes = [
+            models.Index(fields=["slug", "entity"], name="name_slug_entity_idx"), # match_slugs, joined from Entity
+        ]
 
 class Mystery(models.Model):
     world = models.ForeignKey(World, on_delete=models.CASCADE)
@@ -94,15 +190,24 @@ class Location(Entity):
     search_clue = models.ForeignKey(Clue, null=True, blank=True, on_delete=models.SET_NULL, related_name="locations_search")
 
 class PathQuerySet(models.QuerySet):
+    def in_world(self, world):
+        # base paths plus this world's own, e.g. to and from player apartments
+        return self.filter(start__world_id__in=world.content_world_ids, end__world_id__in=world.content_world_ids)
     def fuzzy_match_noun(self, noun):
-        # TODO: when closer to release, use postgres trigram similarity instead of slugify_spaceless.
-        return self.filter(noun_slug__iexact=slugify_spaceless(noun))
+        from game import fuzzy
+        slugs = fuzzy.rank(noun, self.values_list("noun_slug", flat=True).distinct())
+        return self.filter(noun_slug__in=slugs[:1])
     def fuzzy_match_preposition(self, preposition):
         return self.filter(preposition__iexact=preposition)
     def fuzzy_match_destinations(self, noun):
-        return self.filter(end__names__slug__iexact=slugify_spaceless(noun))
+        from game import fuzzy
+        slugs = fuzzy.rank(noun, self.values_list("end__names__slug", flat=True).distinct())
+        return self.filter(end__names__slug__in=slugs[:1])
 
 class Path(models.Model):
+    # the world the path belongs to: its locations' world, or for a path between a world and its template
+    # (e.g. to a player's apartment) the world, so every world can have its own paths from shared locations
+    world = models.ForeignKey(World, on_delete=models.CASCADE, related_name="paths", editable=False)
     preposition = models.CharField(max_length=20, blank=True, validators=[alphanumeric_validator])
     noun = models.CharField(max_length=20, blank=True, validators=[alphanumeric_validator])
     start = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="start_paths")
@@ -114,29 +219,50 @@ class Path(models.Model):
     objects = PathQuerySet.as_manager()
     def save(self, *args, **kwargs):
         self.noun_slug = slugify_spaceless(self.noun)
+        if not self.world_id:
+            self.world_id = self.owning_world_id()
         super(Path, self).save(*args, **kwargs)
+    def owning_world_id(self):
+        if self.start.world_id == self.end.world_id:
+            return self.start.world_id
+        return self.end.world_id if World.all_objects.filter(pk=self.end.world_id, base_id=self.start.world_id).exists() else self.start.world_id
     def clean(self):
         if self.start_id == self.end_id:
             raise ValidationError("Path start and end cannot be equal.")
-        if(self.start.world_id != self.world_id or self.end.world_id != self.end.world_id):
+        world = World.all_objects.get(pk=self.world_id or self.owning_world_id())
+        if(self.start.world_id not in world.content_world_ids or self.end.world_id not in world.content_world_ids):
             raise ValidationError("Path cannot connect locations from different worlds")
         if not self.preposition and not self.noun:
             raise ValidationError("Path needs a preposition, a noun, or both")
     def __str__(self):
         return f"{self.preposition}{' ' + self.noun if self.noun else ''}"
     class Meta:
-        unique_together = [["start", "end", "preposition"], ["start", "preposition", "noun"]]
+        # per world, since worlds add their own paths to the template's locations
+        unique_together = [["world", "start", "end", "preposition"], ["world", "start", "preposition", "noun"]]
+        indexes = [
+            models.Index(fields=["start", "noun_slug"], name="path_start_noun_idx"),
+        ]
 
 class Character(Entity):
     user = models.ForeignKey(User, null=True, blank=True, on_delete=models.CASCADE)
     personality = models.TextField(max_length=200)
-    carry_limit = models.PositiveIntegerField(default=10)
+    carry_limit = models.PositiveIntegerField(default=10) # kg
+    # running totals of carried items, kept by game/inventory.py (manage.py check_inventories rebuilds them)
+    carried_kg = models.FloatField(default=0.0, editable=False)
+    carried_count = models.PositiveIntegerField(default=0, editable=False)
     position = models.ForeignKey(Location, on_delete=models.RESTRICT)
     path_taken = models.ForeignKey(Path, null=True, blank=True, on_delete=models.SET_NULL)
+    home = models.ForeignKey(Location, null=True, blank=True, on_delete=models.SET_NULL, related_name="+") # where an npc wanders around, see npcs.py
     created_at = models.DateTimeField(auto_now_add=True)
     @property
     def carrying_weight(self):
-        return self.item_set.aggregate(Sum("kg"))
+        return self.carried_kg
+    def can_carry(self, item):
+        return self.carried_kg + item.kg <= self.carry_limit
+    class Meta:
+        indexes = [
+            models.Index(fields=["position", "user"], name="character_position_user_idx"), # players and npcs nearby
+        ]
     
 class ClueKnowledge(models.Model):
     clue = models.ForeignKey(Clue, on_delete=models.CASCADE)
@@ -157,6 +283,26 @@ class CharacterLog(models.Model):
         else: return ""
     def __str__(self):
         return self.message
+    class Meta:
+        indexes = [
+            models.Index(fields=["character", "success", "created_at"], name="characterlog_history_idx"),
+            models.Index(fields=["character", "created_at"], name="characterlog_recent_idx"), # newest first, ties broken by id
+        ]
+
+class CharacterLogArchive(models.Model):
+    """A compressed run of old CharacterLogs, see game/log_archive.py."""
+    character = models.ForeignKey(Character, on_delete=models.CASCADE)
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    log_count = models.PositiveIntegerField()
+    data = models.BinaryField() # zlib compressed JSON list of logs
+    created_at = models.DateTimeField(auto_now_add=True)
+    def __str__(self):
+        return f"{self.log_count} logs from {self.first_created_at:%Y-%m-%d} to {self.last_created_at:%Y-%m-%d}"
+    class Meta:
+        indexes = [
+            models.Index(fields=["character", "last_created_at"], name="characterlogarchive_range_idx"),
+        ]
 
 class Item(Entity):
     kg = models.FloatField(default=1.0, validators=[MinValueValidator(0.0)])
@@ -171,6 +317,12 @@ class Item(Entity):
     text = models.TextField(blank=True)
     text_clue = models.ForeignKey(Clue, null=True, blank=True, on_delete=models.SET_NULL, related_name="readable_from")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        item.loaded_position_id = item.__dict__.get("position_id") # so signals.py knows where it was picked up from
+        return item
+
     def is_readable(self):
         return hasattr(self, 'text')
 
@@ -187,4 +339,23 @@ class Block(Entity):
     paths = models.ManyToManyField(Path)
     active = models.BooleanField(default=True)
     unlocked_by = models.ForeignKey(Item, on_delete=models.CASCADE)
-    unlock_description = models.TextField(blank=True)
\ No newline at end of file
+    unlock_description = models.TextField(blank=True)
+    def copy_relations_to(self, copy):
+        copy.paths.set(self.paths.all())
+
+class LLMResponse(models.Model):
+    """A cached npc conversation reply, see game/llm_cache.py."""
+    key = models.CharField(max_length=64, unique=True) # sha256 of the normalized prompt
+    prompt_version = models.PositiveIntegerField()
+    response = models.TextField()
+    size = models.PositiveIntegerField() # bytes of response, for size based eviction
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    used_at = models.DateTimeField() # last written or served, for least recently used eviction
+    def __str__(self):
+        return self.response[:20] + "..."
+    class Meta:
+        indexes = [
+            models.Index(fields=["used_at"], name="llmresponse_lru_idx"),
+            models.Index(fields=["created_at"], name="llmresponse_age_idx"),
+        ]
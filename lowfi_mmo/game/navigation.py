@@ -0,0 +1,164 @@
+from game import models
+from game import fuzzy as fuzzy_names
+from game.world_cache import WorldCache
+from dataclasses import dataclass
+from collections import OrderedDict
+import heapq
+import threading
+
+# per-process cache of each world's path graph, so moving around doesn't hit the database
+# until the new position is saved. signals.py drops a world's graph whenever a Path, Block or Name changes.
+DEFAULT_TRAVEL_SECONDS = 10.0
+MAX_CACHED_ROUTE_TREES = 128 # per world, one per starting location
+
+@dataclass(frozen=True)
+class Edge:
+    path_id: int
+    start_id: int
+    end_id: int
+    preposition: str
+    noun: str
+    noun_slug: str
+    destination_slugs: frozenset
+    hidden: bool
+    travel_seconds: float
+    blocks: tuple # descriptions of the active blocks on this path
+
+    def __str__(self):
+        return f"{self.preposition}{' ' + self.noun if self.noun else ''}"
+
+class NavGraph:
+    def __init__(self, world_id, base_id, edges):
+        self.world_id = world_id
+        self.base_id = base_id
+        self.edges_by_id = {edge.path_id: edge for edge in edges}
+        self.edges_by_start = {}
+        self.location_ids_by_slug = {}
+        for edge in sorted(edges, key=lambda edge: edge.path_id):
+            self.edges_by_start.setdefault(edge.start_id, []).append(edge)
+            for slug in edge.destination_slugs:
+                self.location_ids_by_slug.setdefault(slug, set()).add(edge.end_id)
+        # shortest path trees by starting location. they live on the graph, so they're thrown away
+        # with it whenever a path, block or name changes
+        self._route_trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def edges_from(self, location_id):
+        return self.edges_by_start.get(location_id, [])
+
+    def resolve(self, location_id, preposition, noun, path_taken_id=None) -> Edge | None:
+        nearby = self.edges_from(location_id)
+        preposition = (preposition or "").lower()
+        by_preposition = lambda edges: [edge for edge in edges if edge.preposition.lower() == preposition]
+
+        candidates = []
+        if(preposition.startswith('back') and not noun and path_taken_id in self.edges_by_id):
+            previous_position_id = self.edges_by_id[path_taken_id].start_id
+            candidates = [edge for edge in nearby if edge.end_id == previous_position_id]
+        elif noun:
+            edges = by_preposition(nearby) if preposition else nearby
+            # exact path nouns, then exact destination names, then the same again with typos allowed
+            candidates = (
+                match_noun(edges, noun, lambda edge: {edge.noun_slug})
+                or match_noun(edges, noun, lambda edge: edge.destination_slugs)
+                or match_noun(edges, noun, lambda edge: {edge.noun_slug}, fuzzy=True)
+                or match_noun(edges, noun, lambda edge: edge.destination_slugs, fuzzy=True)
+            )
+        elif preposition and preposition not in ["to"]:
+            candidates = by_preposition(nearby)
+            if len(candidates) != 1: candidates = []
+        return candidates[0] if candidates else None
+
+    def find_location(self, name) -> int | None:
+        slug = models.slugify_spaceless(name)
+        if slug not in self.location_ids_by_slug:
+            best = fuzzy_names.rank(name, self.location_ids_by_slug.keys())[:1]
+            slug = best[0] if best else None
+        return min(self.location_ids_by_slug[slug]) if slug else None
+
+    def route(self, start_id, end_id) -> list[Edge] | None:
+        """The quickest way from one location to another by travel_seconds, skipping hidden and blocked paths."""
+        previous = self.route_tree(start_id)
+        if end_id not in previous:
+            return None
+        edges = []
+        while end_id != start_id:
+            edge = previous[end_id]
+            edges.append(edge)
+            end_id = edge.start_id
+        return edges[::-1]
+
+    def route_tree(self, start_id):
+        with self._lock:
+            if start_id in self._route_trees:
+                self._route_trees.move_to_end(start_id)
+                return self._route_trees[start_id]
+        previous = self.dijkstra(start_id)
+        with self._lock:
+            self._route_trees[start_id] = previous
+            while len(self._route_trees) > MAX_CACHED_ROUTE_TREES:
+                self._route_trees.popitem(last=False)
+        return previous
+
+    def dijkstra(self, start_id):
+        """Location id -> the edge used to reach it on its quickest route from start_id."""
+        seconds = {start_id: 0.0}
+        previous = {start_id: None}
+        queue = [(0.0, start_id)]
+        while queue:
+            elapsed, location_id = heapq.heappop(queue)
+            if elapsed > seconds[location_id]:
+                continue
+            for edge in self.edges_from(location_id):
+                if edge.hidden or edge.blocks:
+                    continue
+                arrival = elapsed + (edge.travel_seconds if edge.travel_seconds is not None else DEFAULT_TRAVEL_SECONDS)
+                if arrival < seconds.get(edge.end_id, float("inf")):
+                    seconds[edge.end_id] = arrival
+                    previous[edge.end_id] = edge
+                    heapq.heappush(queue, (arrival, edge.end_id))
+        return previous
+
+def match_noun(edges, noun, slugs_of, fuzzy=False):
+    if fuzzy:
+        best = fuzzy_names.rank(noun, {slug for edge in edges for slug in slugs_of(edge)})[:1]
+        slug = best[0] if best else None
+    else:
+        slug = models.slugify_spaceless(noun)
+    return [edge for edge in edges if slug in slugs_of(edge)]
+
+def get_graph(world) -> NavGraph:
+    return _graphs.get(world)
+
+async def aget_graph(world) -> NavGraph:
+    return await _graphs.aget(world)
+
+def build_graph(world) -> NavGraph:
+    paths = list(models.Path.objects.in_world(world).values_list(
+        "id", "start_id", "end_id", "preposition", "noun", "noun_slug", "hidden", "travel_seconds"
+    ))
+    destination_slugs = {}
+    for entity_id, slug in models.Name.objects.filter(world_id__in=world.content_world_ids, entity__location__isnull=False).values_list("entity_id", "slug"):
+        destination_slugs.setdefault(entity_id, set()).add(slug)
+    blocks = {}
+    for path_id, description in models.Block.objects.in_world(world).filter(active=True).values_list("paths__id", "description"):
+        blocks.setdefault(path_id, []).append(description)
+    edges = [
+        Edge(path_id, start_id, end_id, preposition, noun, noun_slug, frozenset(destination_slugs.get(end_id, ())), hidden, travel_seconds, tuple(blocks.get(path_id, ())))
+        for path_id, start_id, end_id, preposition, noun, noun_slug, hidden, travel_seconds in paths
+    ]
+    return NavGraph(world.id, world.base_id, edges)
+
+_graphs = WorldCache(build_graph)
+
+def invalidate(world_id, include_instances=True):
+    # changes to a template are visible in every world built on it
+    _graphs.invalidate(world_id, include_instances)
+
+def invalidate_path(start_world_id, end_world_id):
+    if start_world_id == end_world_id:
+        invalidate(start_world_id)
+    else:
+        # a path between a world and its template (e.g. to an apartment) only exists in that world
+        invalidate(start_world_id, include_instances=False)
+        invalidate(end_world_id, include_instances=False)
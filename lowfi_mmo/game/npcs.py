@@ -0,0 +1,140 @@
+from game import models, navigation, live
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from dataclasses import dataclass
+import logging
+import random
+import threading
+import time
+
+# moves every npc in every world a step at a time. a tick reads npcs in batches of BATCH_SIZE, decides
+# all their moves in memory against the cached path graphs, and writes each batch back with a single
+# bulk update, so a tick costs the same handful of queries per batch however many npcs there are.
+# run it in one process only, with manage.py simulate_npcs. on a single process dev server set
+# NPC_SIMULATE_IN_WEB and the first play request starts it there instead.
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, "NPC_BATCH_SIZE", 1000)
+WANDER_CHANCE = 0.2 # per tick, for an npc with no one around
+FOLLOW_CHANCE = 0.5 # per tick, for an npc with a player next door
+WANDER_STEPS = 3 # how many paths from home an npc will wander
+
+def tick_seconds():
+    return getattr(settings, "NPC_TICK_SECONDS", None)
+
+def simulate_in_web():
+    return getattr(settings, "NPC_SIMULATE_IN_WEB", False)
+
+@dataclass
+class Npc:
+    id: int
+    world_id: int
+    name: str
+    position_id: int
+    path_taken_id: int | None
+    home_id: int | None
+
+@dataclass
+class TickReport:
+    npcs: int = 0
+    moved: int = 0
+    greeted: int = 0
+    batches: int = 0
+
+class Simulation:
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.with_company = set() # npcs that had players around last tick, so they only greet newcomers
+
+    def tick(self) -> TickReport:
+        report = TickReport()
+        after_id = 0
+        with_company = set()
+        while True:
+            npcs = [Npc(*row) for row in models.Character.objects.filter(
+                user__isnull=True, id__gt=after_id, world__deleted_at__isnull=True, world__is_template=False,
+            ).order_by("id").values_list("id", "world_id", "primary_name", "position_id", "path_taken_id", "home_id")[:BATCH_SIZE]]
+            if not npcs:
+                break
+            after_id = npcs[-1].id
+            self.run_batch(npcs, report, with_company)
+        self.with_company = with_company
+        return report
+
+    def run_batch(self, npcs, report, with_company):
+        worlds = models.World.objects.in_bulk({npc.world_id for npc in npcs})
+        players = set(models.Character.objects.filter(user__isnull=False, world_id__in=worlds).values_list("world_id", "position_id"))
+        moves, greetings = [], []
+        for npc in npcs:
+            if (npc.world_id, npc.position_id) in players:
+                # someone to talk to, stay put
+                with_company.add(npc.id)
+                if npc.id not in self.with_company:
+                    greetings.append(npc)
+                continue
+            edge = self.choose_path(navigation.get_graph(worlds[npc.world_id]), npc, players)
+            if edge:
+                moves.append((npc, npc.position_id, edge))
+                npc.position_id, npc.path_taken_id = edge.end_id, edge.path_id
+        with transaction.atomic():
+            if moves:
+                models.Character.objects.bulk_update(
+                    [models.Character(pk=npc.id, position_id=npc.position_id, path_taken_id=npc.path_taken_id) for npc, _, _ in moves],
+                    ["position", "path_taken"], batch_size=BATCH_SIZE,
+                )
+            transaction.on_commit(lambda: publish(moves, greetings))
+        report.npcs += len(npcs)
+        report.moved += len(moves)
+        report.greeted += len(greetings)
+        report.batches += 1
+
+    def choose_path(self, graph, npc, players):
+        edges = [edge for edge in graph.edges_from(npc.position_id) if not edge.hidden and not edge.blocks]
+        toward_players = [edge for edge in edges if (npc.world_id, edge.end_id) in players]
+        if toward_players and self.rng.random() < FOLLOW_CHANCE:
+            return self.rng.choice(toward_players)
+        if npc.home_id:
+            edges = [edge for edge in edges if near_home(graph, npc.home_id, edge.end_id)]
+        if edges and self.rng.random() < WANDER_CHANCE:
+            return self.rng.choice(edges)
+        return None
+
+def near_home(graph, home_id, location_id):
+    route = graph.route(home_id, location_id)
+    return route is not None and len(route) <= WANDER_STEPS
+
+def publish(moves, greetings):
+    layer = live.get_channel_layer()
+    for npc, previous_position_id, edge in moves:
+        layer.publish(live.location_group(npc.world_id, previous_position_id), {"type": "event", "from": npc.id, "message": f"{npc.name} goes {edge}."})
+        layer.publish(live.location_group(npc.world_id, npc.position_id), {"type": "event", "from": npc.id, "message": f"{npc.name} arrives."})
+    for npc in greetings:
+        layer.publish(live.location_group(npc.world_id, npc.position_id), {"type": "event", "from": npc.id, "message": f"{npc.name} looks up and nods."})
+
+class Simulator:
+    """Runs Simulation ticks on a background thread every NPC_TICK_SECONDS, with NPC_SIMULATE_IN_WEB."""
+    def __init__(self):
+        self.simulation = Simulation()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if not simulate_in_web() or tick_seconds() is None:
+            return
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name="npc-simulation", daemon=True)
+                self._thread.start()
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.simulation.tick()
+            except Exception:
+                logger.exception("NPC tick failed")
+            finally:
+                close_old_connections()
+            time.sleep(max(0, (tick_seconds() or 5) - (time.monotonic() - started)))
+
+simulator = Simulator()
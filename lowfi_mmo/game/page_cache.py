@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import time
+
+# rendered world and character pages, cached per user under a version stamp that signals.py bumps
+# whenever one of that user's worlds, memberships or characters changes. the stamp doubles as the
+# ETag and Last-Modified, so browsers revalidating an unchanged page get a 304 without a render.
+CACHE_ALIAS = getattr(settings, "PAGE_CACHE", "default")
+TIMEOUT_SECONDS = 60 * 60
+
+def version_key(user_id):
+    return f"page:version:{user_id}"
+
+def user_version(user_id):
+    cache = caches[CACHE_ALIAS]
+    version = cache.get(version_key(user_id))
+    if version is None:
+        cache.add(version_key(user_id), time.time_ns(), None) # time based so an evicted version never goes back
+        version = cache.get(version_key(user_id))
+    return version
+
+def bump(user_id):
+    caches[CACHE_ALIAS].set(version_key(user_id), time.time_ns(), None)
+
+def changed(*user_ids):
+    for user_id in {user_id for user_id in user_ids if user_id is not None}:
+        bump(user_id)
+        transaction.on_commit(lambda user_id=user_id: bump(user_id))
+
+def cached_per_user(view):
+    def etag(request, *args, **kwargs):
+        return f"{request.user.id}-{user_version(request.user.id)}"
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(user_version(request.user.id) // 1_000_000_000, tz=timezone.utc)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        cache = caches[CACHE_ALIAS]
+        key = f"page:{request.user.id}:{user_version(request.user.id)}:{hashlib.md5(request.get_full_path().encode()).hexdigest()}"
+        content = cache.get(key) if request.method == "GET" else None
+        if content is not None:
+            response = HttpResponse(content)
+        else:
+            response = view(request, *args, **kwargs)
+            if request.method == "GET" and response.status_code == 200 and not response.streaming:
+                cache.set(key, response.content, TIMEOUT_SECONDS)
+        # only the user's own browser may keep it, and should check back each time
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+    return condition(etag_func=etag, last_modified_func=last_modified)(wrapper)
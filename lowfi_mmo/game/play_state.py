@@ -0,0 +1,64 @@
+from game import models
+from django.db.models import Q
+from dataclasses import dataclass
+
+MAX_HISTORY = 1
+
+@dataclass
+class PlayState:
+    """Everything the play page shows, loaded in a fixed number of queries."""
+    player: models.Character
+    paths: list[models.Path]
+    nearby_items: list[models.Item]
+    nearby_npcs: list[models.Character]
+    nearby_players: list[models.Character]
+    success_log: models.CharacterLog | None
+    error_log: models.CharacterLog | None
+    log_history: list[models.CharacterLog]
+
+def player_query(world_id, character_slug, user):
+    return models.Character.objects.select_related("world", "position").filter(world_id=world_id, world__deleted_at__isnull=True, names__slug=character_slug, user=user)
+
+def load_player(world_id, character_slug, user) -> models.Character:
+    return player_query(world_id, character_slug, user).get()
+
+async def aload_player(world_id, character_slug, user) -> models.Character:
+    return await player_query(world_id, character_slug, user).aget()
+
+def play_state_queries(player):
+    world, position = player.world, player.position
+    paths = models.Path.objects.in_world(world).filter(start=position)
+    nearby_items = models.Item.objects.in_world(world).at_location(position)
+    nearby_characters = models.Character.objects.filter(world=world, position=position).exclude(id=player.id)
+
+    # newest success, newest error and the recent history in one query
+    logs = models.CharacterLog.objects.filter(character=player)
+    newest = ("-created_at", "-id")
+    log_ids = (
+        Q(id__in=logs.filter(success=True).order_by(*newest).values("id")[:1])
+        | Q(id__in=logs.filter(success=False).order_by(*newest).values("id")[:1])
+        | Q(id__in=logs.order_by(*newest).values("id")[:MAX_HISTORY])
+    )
+    return paths, nearby_items, nearby_characters, logs.filter(log_ids).order_by(*newest)
+
+def load_play_state(world_id, character_slug, user) -> PlayState:
+    player = load_player(world_id, character_slug, user)
+    return build_play_state(player, *[list(query) for query in play_state_queries(player)])
+
+async def aload_play_state(world_id, character_slug, user) -> PlayState:
+    player = await aload_player(world_id, character_slug, user)
+    return build_play_state(player, *[[row async for row in query] for query in play_state_queries(player)])
+
+def build_play_state(player, paths, nearby_items, nearby_characters, recent_logs) -> PlayState:
+    success_logs = [log for log in recent_logs if log.success]
+    error_logs = [log for log in recent_logs if not log.success]
+    return PlayState(
+        player=player,
+        paths=paths,
+        nearby_items=nearby_items,
+        nearby_npcs=[character for character in nearby_characters if character.user_id is None],
+        nearby_players=[character for character in nearby_characters if character.user_id is not None],
+        success_log=success_logs[0] if success_logs else None,
+        error_log=error_logs[0] if error_logs else None,
+        log_history=recent_logs[:MAX_HISTORY],
+    )
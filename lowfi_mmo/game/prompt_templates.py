@@ -1 +1,22 @@
-chatgpt_image_prompt_generator_artsy = "Generate a one-sentence artistic description of the following scene. Focus on visuals, not narrative."
\ No newline at end of file
+chatgpt_image_prompt_generator_artsy = "Generate a one-sentence artistic description of the following scene. Focus on visuals, not narrative."
+
+# bump when npc_conversation changes, so anything keyed on the prompt knows it's stale
+NPC_CONVERSATION_VERSION = 1
+
+npc_conversation = """Narrate the following conversation that took place at {location}. This is in the middle of a book chapter, so no need for introductions.
+
+Participant 1: {player_name}
+Description: Player, {player_description}
+Personality: {player_personality}
+
+Participant 2: {npc_name}
+Description: {npc_description}
+Appearance: {npc_appearance}
+Personality: {npc_personality}
+
+Topic: {topic_name}
+Topic Location: {topic_location}
+Description: {topic_description}
+
+What {npc_name} knows about it:
+{clues}"""
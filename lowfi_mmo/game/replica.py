@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import connections
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import inspect
+
+# reads from read only views and look go to the READ_REPLICA connection, so they don't queue up behind
+# the connection running commands. with sqlite in WAL mode it's the same file on its own connection:
+# readers see the last commit and never block the writer. reads inside a transaction on the default
+# database stay there, since they need to see that transaction's own writes (e.g. look during a tick).
+_reading = ContextVar("replica_reading", default=False)
+
+def replica_alias():
+    return getattr(settings, "READ_REPLICA", None)
+
+@contextmanager
+def reading():
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+def read_only(view):
+    """Route a view's GET and HEAD reads to the replica."""
+    if inspect.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, *args, **kwargs)
+            with reading():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return view(request, *args, **kwargs)
+        with reading():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = replica_alias()
+        if alias and _reading.get() and not connections["default"].in_atomic_block:
+            return alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the same database underneath
+        if {obj1._state.db, obj2._state.db} <= {"default", replica_alias()}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db == replica_alias():
+            return False
+        return None
@@ -0,0 +1,119 @@
+from game import commands, metrics
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from concurrent.futures import Future
+from collections import defaultdict, deque
+import asyncio
+import logging
+import threading
+import time
+
+# runs play commands in ticks instead of one transaction per request. every GAME_TICK_SECONDS the
+# commands queued for each world run one after another and commit together, so sqlite sees one
+# writer per world per tick rather than a pile of requests fighting over the write lock.
+# with GAME_TICK_SECONDS = None commands run inline in the request like before.
+logger = logging.getLogger(__name__)
+
+COMMAND_TIMEOUT_SECONDS = 10
+
+def tick_seconds():
+    return getattr(settings, "GAME_TICK_SECONDS", None)
+
+class Scheduler:
+    def __init__(self):
+        self.queues = defaultdict(deque) # world id -> (character, raw input, future)
+        self.ticks = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, character, raw_input) -> Future:
+        future = self.enqueue(character, raw_input)
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name="game-scheduler", daemon=True)
+                self._thread.start()
+        return future
+
+    def enqueue(self, character, raw_input) -> Future:
+        """Queue a command for the next tick without starting the tick thread."""
+        future = Future()
+        with self._lock:
+            self.queues[character.world_id].append((character, raw_input, future))
+        return future
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Game tick failed")
+            finally:
+                close_old_connections()
+            time.sleep(max(0, (tick_seconds() or 0.1) - (time.monotonic() - started)))
+
+    def tick(self):
+        with self._lock:
+            world_ids = [world_id for world_id, queue in self.queues.items() if queue]
+            batches = {world_id: self.take_batch(self.queues[world_id]) for world_id in world_ids}
+            tick = self.ticks
+            self.ticks += 1
+        for world_id, batch in batches.items():
+            self.run_batch(order_batch(batch, tick))
+
+    def take_batch(self, queue):
+        # one command per character per tick, anything else they sent waits its turn in order
+        batch, later, seen = [], deque(), set()
+        while queue:
+            entry = queue.popleft()
+            if entry[0].id in seen:
+                later.append(entry)
+            else:
+                seen.add(entry[0].id)
+                batch.append(entry)
+        queue.extend(later)
+        return batch
+
+    @metrics.timed("tick", "batch")
+    def run_batch(self, batch):
+        done = []
+        try:
+            with transaction.atomic():
+                for character, raw_input, future in batch:
+                    try:
+                        # the caller's copy may be a few ticks old
+                        character.refresh_from_db(fields=["position", "path_taken", "carried_kg", "carried_count"])
+                        # handle_command is atomic too, so a command that blows up only rolls back its own savepoint
+                        done.append((future, commands.handle_command(character, raw_input), None))
+                    except Exception as error:
+                        done.append((future, None, error))
+        except Exception as error:
+            for _, _, future in batch:
+                future.set_exception(error)
+            raise
+        for future, log, error in done:
+            if error: future.set_exception(error)
+            else: future.set_result(log)
+
+def order_batch(batch, tick):
+    """Character id order, starting further along each tick so the same player doesn't always win a contested item."""
+    batch = sorted(batch, key=lambda entry: entry[0].id)
+    start = tick % len(batch) if batch else 0
+    return batch[start:] + batch[:start]
+
+scheduler = Scheduler()
+
+# both raise TimeoutError if the command hasn't run within COMMAND_TIMEOUT_SECONDS. it stays queued
+# and still runs in a later tick, so callers should say so rather than have the player send it again
+
+def run_command(character, raw_input):
+    if tick_seconds() is None:
+        return commands.handle_command(character, raw_input)
+    return scheduler.submit(character, raw_input).result(COMMAND_TIMEOUT_SECONDS)
+
+async def arun_command(character, raw_input):
+    if tick_seconds() is None:
+        return await commands.ahandle_command(character, raw_input)
+    # shielded, since cancelling the wait would cancel the future the tick sets its result on
+    future = asyncio.wrap_future(scheduler.submit(character, raw_input))
+    return await asyncio.wait_for(asyncio.shield(future), COMMAND_TIMEOUT_SECONDS)
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from game import models, navigation, fuzzy, look_cache, page_cache
+
+# drop cached navigation graphs now and again once the change is committed,
+# so a graph rebuilt by another request mid-transaction doesn't linger
+def invalidate_world(world_id):
+    navigation.invalidate(world_id)
+    transaction.on_commit(lambda: navigation.invalidate(world_id))
+
+def invalidate_path(path):
+    world_ids = dict(models.Location.objects.filter(id__in=[path.start_id, path.end_id]).values_list("id", "world_id"))
+    start_world_id, end_world_id = world_ids.get(path.start_id), world_ids.get(path.end_id)
+    navigation.invalidate_path(start_world_id, end_world_id)
+    transaction.on_commit(lambda: navigation.invalidate_path(start_world_id, end_world_id))
+    look_cache.changed(start_world_id, path.start_id)
+
+@receiver([post_save, post_delete], sender=models.Path)
+def path_changed(sender, instance, **kwargs):
+    invalidate_path(instance)
+
+@receiver([post_save, post_delete], sender=models.Block)
+@receiver([post_save, post_delete], sender=models.Name)
+def block_or_name_changed(sender, instance, **kwargs):
+    invalidate_world(instance.world_id)
+    if sender is models.Name:
+        look_cache.changed(instance.world_id)
+
+@receiver([post_save, post_delete], sender=models.Item)
+def item_changed(sender, instance, **kwargs):
+    # both where it is now and where it was
+    for position_id in {instance.position_id, getattr(instance, "loaded_position_id", None)}:
+        look_cache.changed(instance.world_id, position_id)
+    instance.loaded_position_id = instance.position_id
+
+@receiver(post_save, sender=models.Name)
+def name_saved(sender, instance, **kwargs):
+    fuzzy.name_saved(instance)
+    update_primary_name(instance)
+
+@receiver(post_delete, sender=models.Name)
+def name_deleted(sender, instance, origin=None, **kwargs):
+    fuzzy.name_deleted(instance)
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is models.Name: # otherwise the entity or world is going too
+        update_primary_name(instance)
+
+@receiver([post_save, post_delete], sender=models.World)
+def world_changed(sender, instance, **kwargs):
+    # cached world and character pages of everyone in the world
+    page_cache.changed(instance.owner_id, *models.WorldMember.objects.filter(world_id=instance.id).values_list("user_id", flat=True))
+
+@receiver([post_save, post_delete], sender=models.WorldMember)
+def world_member_changed(sender, instance, **kwargs):
+    page_cache.changed(instance.user_id)
+
+@receiver([post_save, post_delete], sender=models.Character)
+def character_changed(sender, instance, **kwargs):
+    page_cache.changed(instance.user_id)
+
+def update_primary_name(name):
+    # the entity that created the name (e.g. character.names.create) sees the change too
+    entity = name.entity if models.Name.entity.is_cached(name) else models.Entity(pk=name.entity_id)
+    entity.update_primary_name()
+    page_cache.changed(*models.Character.objects.filter(pk=name.entity_id).values_list("user_id", flat=True)) # renamed characters
+
+@receiver(m2m_changed, sender=models.Block.paths.through)
+def block_paths_changed(sender, instance, action, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, models.Block):
+        invalidate_world(instance.world_id)
+    else:
+        invalidate_path(instance)
@@ -1,4 +1,4 @@
-from game import models
+from game import models, navigation, inventory, look_cache, metrics, conversations
 from django.db.models import Sum, Max
 from django.db import transaction
 from dataclasses import dataclass
@@ -7,101 +7,203 @@ from dataclasses import dataclass
 class Result:
     success: bool
     message: str
+    event: str = "" # what other characters at the location see happen
 
     @classmethod
-    def succeed(cls, message=""):
-        return cls(True, message)
+    def succeed(cls, message="", event=""):
+        return cls(True, message, event)
     
     @classmethod
     def fail(cls, message=""):
         return cls(False, message)
 
+@metrics.timed("system", "move")
 @transaction.atomic
 def move(character, preposition, noun) -> Result: # todo: make this a traveler
+    # resolved against the cached path graph, only saving the new position touches the database
+    path, failure = find_path(navigation.get_graph(character.world), character, preposition, noun)
+    if failure:
+        return failure
+    character.position_id = path.end_id
+    character.path_taken_id = path.path_id
+    character.save(update_fields=["position", "path_taken"])
+    return moved(path, preposition, look(character, False))
+
+def find_path(graph, character, preposition, noun):
     if not preposition and not noun:
-        return Result.fail("Please specify where to go. Use <code>look</code> for nearby locations.")
+        return None, Result.fail("Please specify where to go. Use <code>look</code> for nearby locations.")
+    path = graph.resolve(character.position_id, preposition, noun, character.path_taken_id)
+    if not path:
+        return None, Result.fail(f"You cannot go {preposition if preposition else 'to'}{' ' + noun if noun else ''}")
+    # check for locks
+    if(path.blocks):
+        return None, Result.fail(f"You could not go {str(path)}. {' Additionally, '.join(path.blocks)}")
+    return path, None
 
-    path: models.Path | None = None
-    
-    nearby_paths: models.PathQuerySet = models.Path.objects.filter(start=character.position)
-    if(preposition and preposition.startswith('back') and not noun and character.previous_position):
-        print("if")
-        path = nearby_paths.filter(end=character.previous_position).first()
-    elif noun and preposition:
-        print("elif 1")
-        path = nearby_paths.fuzzy_match_noun(noun).fuzzy_match_preposition(preposition).first()
-        if not path: path = nearby_paths.fuzzy_match_preposition(preposition).fuzzy_match_destinations(noun).first()
-    elif noun:
-        print("elif2", noun)
-        path = nearby_paths.fuzzy_match_noun(noun).first()
-        if not path: path = nearby_paths.fuzzy_match_destinations(noun).first()
-    elif preposition and preposition not in ["to"]:
-        print("here")
-        possible_paths = nearby_paths.filter(preposition__iexact=preposition)
-        if(possible_paths.count() == 1): path = possible_paths.first()
+def moved(path, preposition, look_result):
+    return Result.succeed(f'<span class="success">You go {"back " if preposition == "back" else ""}{str(path)}.</span> ' + look_result.message)
 
-    if not path:
-        return Result.fail(f"You cannot go {preposition if preposition else 'to'}{' ' + noun if noun else ''}")
+@metrics.timed("system", "travel")
+@transaction.atomic
+def travel(character, destination) -> Result:
+    # the whole route in one command, planned on the cached path graph
+    route, failure = find_route(navigation.get_graph(character.world), character, destination)
+    if failure:
+        return failure
+    character.position_id = route[-1].end_id
+    character.path_taken_id = route[-1].path_id
+    character.save(update_fields=["position", "path_taken"])
+    return traveled(route, character.position, look(character, False))
 
-    # check for locks
-    blocks = path.block_set.filter(active=True)
-    if(blocks.count() > 0):
-        return Result.fail(f"You could not go {str(path)}. {' Additionally, '.join([block.description for block in blocks])}")
-    
-    character.previous_position = character.position
-    character.position = path.end
-    character.save()
-    return Result.succeed(f'<span class="success">You go {"back " if preposition == "back" else ""}{str(path)}.</span> ' + look(character, False).message)
-    
+def find_route(graph, character, destination):
+    location_id = graph.find_location(destination)
+    if not location_id:
+        return None, Result.fail(f"You don't know of anywhere called \"{destination}\".")
+    if location_id == character.position_id:
+        return None, Result.fail("You are already there.")
+    route = graph.route(character.position_id, location_id)
+    if not route:
+        return None, Result.fail(f"You don't know a way to get to {destination} from here.")
+    return route, None
+
+def traveled(route, destination, look_result):
+    seconds = sum(edge.travel_seconds if edge.travel_seconds is not None else navigation.DEFAULT_TRAVEL_SECONDS for edge in route)
+    duration = f"{round(seconds / 60)} minute{'' if round(seconds / 60) == 1 else 's'}" if seconds >= 90 else f"{round(seconds)} seconds"
+    steps = [f'<span class="location">{str(edge)}</span>' for edge in route]
+    via = last_comma_to_and(', '.join(steps)) if len(steps) > 2 else ' and '.join(steps)
+    return Result.succeed(f'<span class="success">You go {via}, arriving at {destination.name} after {duration}.</span> ' + look_result.message)
+
+@metrics.timed("system", "look")
 def look(character, describe_position=True):
-    location_description = character.position.description
-    formatted_description = location_description[0].lower() + location_description[1:]
-    items = character.position.item_set.all()
+    # only the nearby items and paths need the database, and they're cached until something there changes
+    nearby = look_cache.get(character.world, character.position_id, lambda: describe_nearby(
+        list(models.Item.objects.in_world(character.world).at_location(character.position_id)),
+        list(models.Path.objects.in_world(character.world).filter(start=character.position_id).exclude(hidden=True)),
+    ))
+    return describe_surroundings(character.position, nearby, describe_position)
+
+def describe_nearby(items, available_paths):
     colored_item = lambda item: f'<span class="item">{str(item)}</span>'
-    items_description = last_comma_to_and(f"Some nearby items include {', '.join([colored_item(item.name) for item in items])}.") if items.count() > 0 else ""
-    available_paths = character.position.start_paths.exclude(hidden=True)
+    items_description = last_comma_to_and(f"Some nearby items include {', '.join([colored_item(item.name) for item in items])}.") if items else ""
     colored_path = lambda path: f'<span class="location">{str(path)}</span>'
-    paths_description = last_comma_to_and("From here you can go " + ', '.join([colored_path(path) for path in available_paths]) + ".") if available_paths.count() > 0 else ""
-    initial_message = f'<span class="success">You look around.</span> You are at {character.position.name}. ' if describe_position else ''
-    return Result.succeed(f"{initial_message}You see {formatted_description} {items_description} {paths_description}")
+    paths_description = last_comma_to_and("From here you can go " + ', '.join([colored_path(path) for path in available_paths]) + ".") if available_paths else ""
+    return f"{items_description} {paths_description}"
 
+def describe_surroundings(position, nearby, describe_position):
+    location_description = position.description
+    formatted_description = location_description[0].lower() + location_description[1:]
+    initial_message = f'<span class="success">You look around.</span> You are at {position.name}. ' if describe_position else ''
+    return Result.succeed(f"{initial_message}You see {formatted_description} {nearby}")
+
+@metrics.timed("system", "take")
 def take(character, item_name):
-    item = models.Item.objects.at_location(character.position).fuzzy_match(item_name).first()
-    if(not item): return Result.fail(f"You don't see a nearby \"{item_name}\".")
-    item.position = None
-    item.carrier = character
-    item.save()
-    return Result.succeed(f'You pick up <span class="item">{item.name}</span>')
+    item = models.Item.objects.in_world(character.world).at_location(character.position).fuzzy_match(item_name, character.world).first()
+    if(not item): return not_nearby(item_name)
+    if(not character.can_carry(item)): return too_heavy(item)
+    name = item.name
+    item = item.copy_on_write(character.world)
+    if(not takeable(character, item) or not inventory.transfer(item, carrier=character)): return not_taken(character, item, item_name)
+    return took(character, name)
+
+def takeable(character, item):
+    # the world's copy is read again by copy_on_write, and transfer only claims the item from where it was read
+    return not item.carrier_id and item.position_id == character.position_id
+
+def not_taken(character, item, item_name):
+    return too_heavy(item) if takeable(character, item) else not_nearby(item_name)
+
+def not_nearby(item_name):
+    return Result.fail(f"You don't see a nearby \"{item_name}\".")
 
+def too_heavy(item):
+    return Result.fail(f'You can\'t carry <span class="item">{item.name}</span> as well as everything else you have.')
+
+def took(character, item_name):
+    return Result.succeed(f'You pick up <span class="item">{item_name}</span>', f'{character.name} picks up <span class="item">{item_name}</span>.')
+
+@metrics.timed("system", "use")
 def use(character, item_name, entity_name):
-    item = models.Item.objects.filter(world=character.world, carrier=character, names__name__iexact=item_name).first()
-    entity = models.Entity.objects.filter(world=character.world, names__name__iexact=entity_name).first()
-    if not item:
-        return Result.fail(f"You are not carrying an item named \"{item_name}.\"")
-    if not entity or (hasattr(entity, 'position') and entity.position_id != character.position_id):
-        return Result.fail(f"There is no entity named \"{entity_name}\" nearby.")
+    item = models.Item.objects.in_world(character.world).carried_by(character).fuzzy_match(item_name, character.world).first()
+    entity = models.Entity.objects.in_world(character.world).fuzzy_match(entity_name, character.world).first()
+    failure = check_use(character, item, item_name, entity, entity_name)
+    if failure:
+        return failure
 
     # UNBLOCK SYSTEM
-    maybe_key = models.Key.objects.filter(pk=item.id).first()
-    nearby_paths = character.position.start_paths.all()
-    maybe_block = models.Block.objects.filter(pk=entity.id, paths__in=nearby_paths).first()
-    if maybe_key:
-        if not maybe_block:
-            return Result.fail(f"There is no entity named \"{entity_name}\" nearby.")
-        return unblock(maybe_key, maybe_block)
+    maybe_block = models.Block.objects.in_world(character.world).filter(pk=entity.id, paths__start=character.position).first()
+    if maybe_block:
+        return unblock(character, item, maybe_block)
     
     return Result.fail(f'<span class="item">{item.name}</span> cannot be used on {entity.name}')
 
-def unblock(key, block):
-    if(key.unlocks != block):
+def check_use(character, item, item_name, entity, entity_name):
+    if not item:
+        return Result.fail(f"You are not carrying an item named \"{item_name}.\"")
+    if not entity or (hasattr(entity, 'position') and entity.position_id != character.position_id):
+        return Result.fail(f"There is no entity named \"{entity_name}\" nearby.")
+
+@metrics.timed("system", "unblock")
+def unblock(character, key, block):
+    if(block.unlocked_by_id != key.origin_id):
         return Result.fail(f"You try to unlock {block.name} with {key.name}, but it doesn't work.")
     if(block.active):
+        name = block.name
+        block = block.copy_on_write(character.world)
         block.active = False
         block.save()
-        return Result.succeed(key.unlock_description)
+        return unblocked(character, name, block)
     else:
         return Result.fail(f"{block.name} was already unlocked") # TODO: make this message dynamic
 
+def unblocked(character, block_name, block):
+    return Result.succeed(block.unlock_description, f"{character.name} unlocks {block_name}.")
+
+@metrics.timed("system", "talk")
+def talk(character, npc_name, topic_name):
+    npc = models.Character.objects.in_world(character.world).at_location(character.position_id).filter(user__isnull=True).fuzzy_match(npc_name, character.world).first()
+    if(not npc): return Result.fail(f"There is no one called \"{npc_name}\" here to talk to.")
+    topic = models.Entity.objects.in_world(character.world).fuzzy_match(topic_name, character.world).first()
+    if(not topic): return Result.fail(f"{npc.name} has never heard of \"{topic_name}\".")
+    if(conversations.narrator.busy()): return Result.fail(f"{npc.name} is lost in thought. Try again in a moment.")
+    # the reply is written in the background once this commits, streamed to the player and then logged
+    conversation = conversations.prepare(character, npc, topic)
+    transaction.on_commit(lambda: conversations.narrator.start(conversation))
+    return Result.succeed(f"You ask {npc.name} about {topic.name}.", f"{character.name} talks to {npc.name}.")
+
+# async versions of the systems above for the async play views. they share the checks and messages,
+# only the queries differ: async ORM calls, and related objects fetched up front since lazy loads would block.
+# systems writing more than one row (take, use, talk) have no async version, commands.ahandle_command runs
+# them in a thread in one transaction with their log
+
+@metrics.timed("system", "move")
+async def amove(character, preposition, noun) -> Result:
+    path, failure = find_path(await navigation.aget_graph(character.world), character, preposition, noun)
+    if failure:
+        return failure
+    character.position = await models.Location.objects.aget(pk=path.end_id)
+    character.path_taken_id = path.path_id
+    await character.asave(update_fields=["position", "path_taken"])
+    return moved(path, preposition, await alook(character, False))
+
+@metrics.timed("system", "travel")
+async def atravel(character, destination) -> Result:
+    route, failure = find_route(await navigation.aget_graph(character.world), character, destination)
+    if failure:
+        return failure
+    character.position = await models.Location.objects.aget(pk=route[-1].end_id)
+    character.path_taken_id = route[-1].path_id
+    await character.asave(update_fields=["position", "path_taken"])
+    return traveled(route, character.position, await alook(character, False))
+
+@metrics.timed("system", "look")
+async def alook(character, describe_position=True):
+    async def describe():
+        return describe_nearby(
+            [item async for item in models.Item.objects.in_world(character.world).at_location(character.position_id)],
+            [path async for path in models.Path.objects.in_world(character.world).filter(start=character.position_id).exclude(hidden=True)],
+        )
+    return describe_surroundings(character.position, await look_cache.aget(character.world, character.position_id, describe), describe_position)
+
 def read(reader_character, readable):
     return f"{reader_character.entity.name} read {readable.entity.name}. It said: {readable.message}"
 
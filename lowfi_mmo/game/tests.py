@@ -1,3 +1,785 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.urls import reverse
+from game import models, navigation, fuzzy, live, world_cache, log_archive, scheduler, inventory, systems, metrics, replica, world_purge, world_transfer, npcs, commands, conversations, llm, llm_cache, play_state
+from game.worldgen.world_creator import get_base_world, populate_world
+from game.worldgen.character_creator import spawn_npcs
+from asgiref.sync import async_to_sync
+import asyncio
+import random
+from datetime import datetime, timedelta
+import io
+from unittest import mock
+
+@override_settings(GAME_TICK_SECONDS=None, NPC_TICK_SECONDS=None) # background threads can't see the test transaction
+class GameTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="player", password="password")
+        cls.world = models.World.objects.create(owner=cls.user, name="Test World", base=get_base_world())
+
+    def setUp(self):
+        world_cache.clear_all() # rolled back ids get reused between tests
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def create_character(self, name="Bob", world=None):
+        world = world or self.world
+        self.client.post(reverse("character_create", kwargs={"world_id": world.id}), {
+            "character-name": name,
+            "character-appearance": "Tall",
+            "character-personality": "Friendly",
+            "character-description": "Likes tacos",
+        })
+        return models.Character.objects.get(world=world, names__name=name)
+
+    def move_to(self, slug, *characters):
+        """Put characters somewhere in the test world, both in the database and on the instances."""
+        location = models.Location.objects.in_world(self.world).get(names__slug=slug)
+        models.Character.objects.filter(pk__in=[character.pk for character in characters]).update(position=location)
+        for character in characters:
+            character.position = location
+        return location
+
+    def assertMaxQueries(self, budget, func, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            result = func(*args, **kwargs)
+        self.assertLessEqual(len(queries), budget, "\n".join(query["sql"] for query in queries.captured_queries))
+        return result
+
+class PlayQueryBudgetTests(GameTestCase):
+    # session + user, player, paths, items, nearby characters, logs
+    GET_BUDGET = 7
+    # the GET budget plus loading the player, running a go command with its look and writing the log
+    POST_BUDGET = GET_BUDGET + 10
+
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+        self.url = reverse("play", kwargs={"world_id": self.world.id, "character_slug": self.character.slug})
+
+    def test_play_page_stays_within_budget(self):
+        response = self.assertMaxQueries(self.GET_BUDGET, self.client.get, self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_play_page_budget_does_not_grow_with_history_or_neighbours(self):
+        for i in range(20):
+            models.CharacterLog.objects.create(character=self.character, command="look", success=i % 2 == 0, message=f"log {i}")
+        for name in ["Alice", "Carol", "Dave"]:
+            self.create_character(name)
+            models.Character.objects.filter(names__name=name).update(position=self.character.position)
+        self.assertMaxQueries(self.GET_BUDGET, self.client.get, self.url)
+
+    def test_play_command_stays_within_budget(self):
+        self.client.post(self.url, {"command": "go nowhere"}) # builds the world's navigation graph
+        response = self.assertMaxQueries(self.POST_BUDGET, self.client.post, self.url, {"command": "go outside"})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "You go outside.")
+
+    def test_play_shows_latest_logs(self):
+        self.client.post(self.url, {"command": "dance"})
+        self.client.post(self.url, {"command": "look"})
+        response = self.client.get(self.url)
+        self.assertTrue(response.context["success_log"].message.startswith('<span class="success">You look around.'))
+        self.assertEqual(response.context["error_log"].command, "dance")
+        self.assertEqual([log.command for log in response.context["log_history"]], ["look"])
+
+class LogHistoryTests(GameTestCase):
+    def test_history_pages_through_live_and_archived_logs(self):
+        character = self.create_character()
+        character.characterlog_set.all().delete()
+        start = datetime.now() - timedelta(days=100)
+        for i in range(30):
+            log = models.CharacterLog.objects.create(character=character, command=f"command {i}", success=True, message="")
+            models.CharacterLog.objects.filter(id=log.id).update(created_at=start + timedelta(minutes=i // 2)) # pairs share a timestamp
+        report = log_archive.archive_logs(keep_latest=5, segment_size=10)
+        self.assertEqual((report.logs, report.segments), (25, 3))
+
+        url = reverse("play_history", kwargs={"world_id": self.world.id, "character_slug": character.slug})
+        commands, cursor = [], ""
+        while cursor is not None:
+            page = self.client.get(url, {"before": cursor, "limit": 7}).json()
+            commands += [log["command"] for log in page["logs"]]
+            cursor = page["next"]
+        self.assertEqual(commands, [f"command {i}" for i in reversed(range(30))])
+
+class SchedulerTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scheduler = scheduler.Scheduler() # ticks driven by hand, no thread
+        self.characters = [self.create_character(name) for name in ["Alice", "Bob"]]
+        self.move_to("curiositycorner", *self.characters)
+
+    def test_contested_item_goes_to_one_player_per_tick(self):
+        futures = [self.scheduler.enqueue(character, "take bronze key") for character in reversed(self.characters)]
+        self.scheduler.tick()
+        logs = [future.result(0) for future in reversed(futures)]
+        self.assertEqual([log.success for log in logs], [True, False]) # first tick starts with the lowest id
+        key = models.Item.objects.in_world(self.world).get(names__slug="bronzekey")
+        self.assertEqual(key.carrier_id, self.characters[0].id)
+
+    def test_one_command_per_character_per_tick(self):
+        alice = self.characters[0]
+        first, second = self.scheduler.enqueue(alice, "look"), self.scheduler.enqueue(alice, "go outside")
+        self.scheduler.tick()
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+        self.scheduler.tick()
+        self.assertTrue(second.result(0).success)
+
+    @override_settings(GAME_TICK_SECONDS=None)
+    def test_runs_inline_without_a_tick(self):
+        log = scheduler.run_command(self.characters[0], "look")
+        self.assertTrue(log.success)
+
+    @override_settings(GAME_TICK_SECONDS=0.1)
+    def test_timed_out_commands_stay_queued(self):
+        alice = self.characters[0]
+        kwargs = {"world_id": self.world.id, "character_slug": alice.slug}
+        with (
+            mock.patch.object(scheduler, "scheduler", self.scheduler),
+            mock.patch.object(self.scheduler, "submit", self.scheduler.enqueue), # no tick thread to run it
+            mock.patch.object(scheduler, "COMMAND_TIMEOUT_SECONDS", 0.01),
+        ):
+            response = self.client.post(reverse("play_command", kwargs=kwargs), {"command": "take bronze key"})
+            self.assertEqual(response.status_code, 503)
+            self.assertContains(self.client.post(reverse("play", kwargs=kwargs), {"command": "look"}), '"look" is still queued')
+            with self.assertRaises(TimeoutError):
+                scheduler.run_command(alice, "look")
+        self.scheduler.tick()
+        self.assertEqual(models.Item.objects.in_world(self.world).get(names__slug="bronzekey").carrier_id, alice.id)
+        self.scheduler.tick()
+        self.assertEqual(list(alice.characterlog_set.order_by("-pk").values_list("command", flat=True)[:3]), ["look", "take bronze key", "start game"])
+
+class PrimaryNameTests(GameTestCase):
+    def test_primary_name_follows_first_name(self):
+        character = self.create_character("Bob")
+        self.assertTrue(character.characterlog_set.get().message.startswith("You are Bob."))
+        self.assertNumQueries(0, str, character)
+        character.names.create(world=self.world, name="Bobby")
+        self.assertEqual(character.name, "Bob")
+        character.names.order_by("id").first().delete()
+        character.refresh_from_db()
+        self.assertEqual((character.name, character.slug), ("Bobby", "bobby"))
+
+    def test_template_entities_have_primary_names(self):
+        self.assertFalse(models.Entity.objects.filter(world=self.world.base, primary_name="").exists())
+
+class PopulateWorldTests(GameTestCase):
+    # a few bulk inserts per model, however much content there is
+    QUERY_BUDGET = 25
+
+    def test_populate_stays_within_query_budget(self):
+        world = models.World.objects.create(owner=self.user, name="Populated")
+        report = populate_world(world)
+        self.assertLessEqual(report.queries, self.QUERY_BUDGET, str(report))
+        self.assertEqual(report.rows["Location"], models.Location.objects.filter(world=world).count())
+        self.assertEqual(report.rows["Location"], models.Location.objects.filter(world=self.world.base).count())
+        fields = ["primary_name", "description", "kg", "position__primary_name"]
+        self.assertEqual(
+            sorted(models.Item.objects.filter(world=world).values_list(*fields)),
+            sorted(models.Item.objects.filter(world=self.world.base).values_list(*fields)),
+        )
+
+class FuzzyTests(GameTestCase):
+    def test_rank_prefers_exact_then_allows_typos(self):
+        self.assertEqual(fuzzy.rank("bronze key", ["bronzekey", "bronzekeys", "trapdoor"]), ["bronzekey", "bronzekeys"])
+        self.assertEqual(fuzzy.rank("bronse kee", ["bronzekey", "trapdoor"]), ["bronzekey"])
+        self.assertEqual(fuzzy.rank("lamp", ["trapdoor"]), [])
+
+    def test_index_adds_and_removes_names(self):
+        index = fuzzy.NameIndex([(1, "bronzekey", 10), (2, "trapdoor", 11)])
+        self.assertEqual(index.search("bronze kee"), ["bronzekey"])
+        index.add(3, "bronzekey", 12) # a copy's name, same slug
+        index.remove(1)
+        self.assertEqual(index.search("bronze key", entity_ids={12}), ["bronzekey"])
+        index.remove(3)
+        self.assertEqual(index.search("bronze key"), [])
+
+    def test_limit_counts_only_candidate_entities(self):
+        index = fuzzy.NameIndex([(i, f"bronzekey{letter}", i) for i, letter in enumerate("abcdefghijklm")])
+        self.assertNotIn("bronzekeya", index.search("bronze key", limit=10))
+        self.assertEqual(index.search("bronze key", limit=10, entity_ids={0}), ["bronzekeya"])
+
+    def test_built_index_sees_saved_bulk_created_and_deleted_names(self):
+        self.assertEqual(fuzzy.search(self.world, "ann"), []) # builds the index
+        [ann] = spawn_npcs(self.world, [{"names": ["Ann"], "position": "curiosity corner"}])
+        self.assertEqual(fuzzy.search(self.world, "ann"), ["ann"])
+        name = ann.names.create(world=self.world, name="Annabel")
+        self.assertIn("annabel", fuzzy.search(self.world, "annabel"))
+        name.delete()
+        self.assertEqual(fuzzy.search(self.world, "annabel"), [])
+        key = models.Item.objects.in_world(self.world).get(names__slug="bronzekey")
+        copy = key.copy_on_write(self.world)
+        self.assertEqual(models.Item.objects.in_world(self.world).fuzzy_match("bronze key", self.world).get(), copy)
+
+    def test_only_narrowed_querysets_list_their_entities(self):
+        fuzzy.search(self.world, "key") # builds the index
+        everything = models.Entity.objects.in_world(self.world)
+        self.assertNumQueries(0, everything.fuzzy_match, "bronze key", self.world)
+        corner = models.Location.objects.in_world(self.world).get(names__slug="curiositycorner")
+        items_here = models.Item.objects.in_world(self.world).at_location(corner).filter(kg__gt=0)
+        self.assertTrue(items_here.narrowed)
+        self.assertNumQueries(1, items_here.fuzzy_match, "bronze key", self.world)
+        self.assertEqual(everything.fuzzy_match("bronze key", self.world).first().pk, items_here.fuzzy_match("bronze key", self.world).first().pk)
+
+class WorldCopyTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = models.World.objects.create(owner=self.user, name="Other World", base=self.world.base)
+
+    def test_same_character_name_in_two_worlds(self):
+        bob, other_bob = self.create_character("Bob"), self.create_character("Bob", self.other)
+        hub = models.Location.objects.get(world=self.world.base, names__slug="apartmentcomplex")
+        for character in (bob, other_bob):
+            path = navigation.get_graph(character.world).resolve(hub.id, "to", "bobs apartment", None)
+            self.assertEqual(path.end_id, character.position_id)
+
+    def test_copy_on_write_leaves_other_worlds_and_template_alone(self):
+        key = models.Item.objects.in_world(self.world).get(names__slug="bronzekey")
+        copy = key.copy_on_write(self.world)
+        copy.description = "Rusty"
+        copy.save()
+        self.assertNotEqual(copy.pk, key.pk)
+        self.assertEqual(copy.copy_on_write(self.world), copy)
+        self.assertEqual(models.Item.objects.in_world(self.world).get(names__slug="bronzekey"), copy) # the template's is shadowed
+        self.assertEqual(models.Item.objects.in_world(self.other).get(names__slug="bronzekey"), key)
+        key.refresh_from_db()
+        self.assertNotEqual(key.description, "Rusty")
+        self.assertEqual(list(copy.names.values_list("slug", flat=True)), ["bronzekey"])
+
+class InventoryTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+        self.move_to("curiositycorner", self.character)
+        self.url = reverse("play", kwargs={"world_id": self.world.id, "character_slug": self.character.slug})
+
+    def test_take_keeps_totals(self):
+        self.client.post(self.url, {"command": "take bronze key"})
+        self.character.refresh_from_db()
+        self.assertEqual((self.character.carried_kg, self.character.carried_count), (1.0, 1))
+        self.assertEqual(inventory.find_mismatches(), [])
+
+    def test_take_respects_carry_limit(self):
+        models.Character.objects.filter(pk=self.character.pk).update(carry_limit=0)
+        self.client.post(self.url, {"command": "take bronze key"})
+        self.assertFalse(self.character.characterlog_set.latest("id").success)
+        self.assertFalse(models.Item.objects.filter(carrier=self.character).exists())
+
+    def test_stale_items_cannot_be_taken_again(self):
+        alice = self.create_character("Alice")
+        self.move_to("curiositycorner", alice)
+        base_key = models.Item.objects.in_world(self.world).get(names__slug="bronzekey")
+        key = base_key.copy_on_write(self.world)
+        stale = models.Item.objects.get(pk=key.pk)
+        self.assertTrue(inventory.transfer(key, carrier=self.character))
+        self.assertFalse(inventory.transfer(stale, carrier=alice))
+        self.assertEqual(stale.carrier_id, self.character.id) # refreshed
+        # the template's key read before it was copied leads to the copy in Bob's hands, which stays there
+        self.assertFalse(systems.takeable(alice, base_key.copy_on_write(self.world)))
+        self.assertEqual(models.Item.objects.get(pk=key.pk).carrier_id, self.character.id)
+        self.assertEqual(inventory.find_mismatches(), [])
+
+class AsyncSystemTests(GameTestCase):
+    """Each async system against its sync version on the same fixture, rolled back in between."""
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+
+    def state(self):
+        character = models.Character.objects.get(pk=self.character.pk)
+        return (
+            character.position_id, character.path_taken_id, character.carried_kg, character.carried_count,
+            sorted(models.Item.objects.in_world(self.world).values_list("primary_name", "position_id", "carrier_id")),
+            sorted(models.Block.objects.in_world(self.world).values_list("primary_name", "active")),
+            models.Entity.objects.filter(world=self.world).count(),
+        )
+
+    def assertSameOutcome(self, system, async_system, *args):
+        outcomes = []
+        for run, load in [(system, play_state.load_player), (async_to_sync(async_system), async_to_sync(play_state.aload_player))]:
+            with transaction.atomic():
+                world_cache.clear_all() # nothing cached from the other run
+                cache.clear()
+                character = load(self.world.id, self.character.slug, self.user)
+                outcomes.append((run(character, *args), self.state()))
+                transaction.set_rollback(True)
+        self.assertEqual(outcomes[0], outcomes[1])
+        return outcomes[0][0]
+
+    def test_move(self):
+        self.assertTrue(self.assertSameOutcome(systems.move, systems.amove, "outside", None).success)
+        self.assertFalse(self.assertSameOutcome(systems.move, systems.amove, "to", "nowhere").success)
+
+    def test_look(self):
+        self.move_to("curiositycorner", self.character)
+        self.assertTrue(self.assertSameOutcome(systems.look, systems.alook).success)
+
+    def test_travel(self):
+        self.assertTrue(self.assertSameOutcome(systems.travel, systems.atravel, "curiosity corner").success)
+
+    def test_multi_row_commands_commit_with_their_log(self):
+        self.move_to("curiositycorner", self.character)
+        load = lambda: async_to_sync(play_state.aload_player)(self.world.id, self.character.slug, self.user)
+        with mock.patch.object(models.CharacterLog.objects, "create", side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                async_to_sync(commands.ahandle_command)(load(), "take bronze key")
+        self.assertFalse(models.Item.objects.filter(carrier=self.character).exists())
+        self.assertEqual(inventory.find_mismatches(), [])
+        self.assertTrue(async_to_sync(commands.ahandle_command)(load(), "take bronze key").success)
+        self.assertTrue(models.Item.objects.filter(carrier=self.character).exists())
+
+class WorldLayoutTests(GameTestCase):
+    def test_layout_is_stored_and_updated_when_paths_change(self):
+        url = reverse("world_visualize", kwargs={"world_id": self.world.id})
+        self.client.get(url)
+        positions = models.WorldLayout.objects.get(world=self.world).positions
+        self.assertMaxQueries(4, self.client.get, url) # world, labels, edges and the stored layout
+        self.create_character() # adds an apartment and paths to it
+        self.client.get(url)
+        updated = models.WorldLayout.objects.get(world=self.world).positions
+        self.assertEqual(len(updated), len(positions) + 1)
+
+class NavigationTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.corner = models.Location.objects.in_world(self.world).get(names__slug="curiositycorner")
+
+    def test_cached_graph_is_reused(self):
+        graph = navigation.get_graph(self.world)
+        self.assertIs(self.assertMaxQueries(0, navigation.get_graph, self.world), graph)
+        self.assertIs(graph.route_tree(self.corner.id), graph.route_tree(self.corner.id))
+
+    def test_saving_a_path_drops_the_graph(self):
+        graph = navigation.get_graph(self.world)
+        mansion = models.Location.objects.in_world(self.world).get(names__slug="ruinedmansionlivingroom")
+        path = models.Path.objects.create(start=self.corner, end=mansion, preposition="through", noun="Hatch")
+        updated = navigation.get_graph(self.world)
+        self.assertIsNot(updated, graph)
+        self.assertEqual(updated.resolve(self.corner.id, "through", "hatch").path_id, path.id)
+        path.delete()
+        self.assertIsNone(navigation.get_graph(self.world).resolve(self.corner.id, "through", "hatch"))
+
+    def test_template_path_changes_reach_worlds_built_on_it(self):
+        graph = navigation.get_graph(self.world)
+        path = models.Path.objects.filter(world=self.world.base).first()
+        path.travel_seconds = 1
+        path.save()
+        self.assertEqual(navigation.get_graph(self.world).edges_by_id[path.id].travel_seconds, 1)
+        self.assertIsNot(navigation.get_graph(self.world), graph)
+
+class TravelTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+        self.url = reverse("play", kwargs={"world_id": self.world.id, "character_slug": self.character.slug})
+
+    def travel(self, destination):
+        self.client.post(self.url, {"command": f"travel to {destination}"})
+        self.character.refresh_from_db()
+        return self.character.characterlog_set.latest("id")
+
+    def test_travel_takes_the_whole_route(self):
+        log = self.travel("curiosity corner")
+        self.assertTrue(log.success, log.message)
+        self.assertEqual(self.character.position.slug, "curiositycorner")
+
+    def test_blocked_route_opens_once_unlocked(self):
+        self.move_to("ruinedmansionlivingroom", self.character)
+        self.assertFalse(self.travel("secret bunker").success)
+        trapdoor = models.Block.objects.in_world(self.world).get(names__slug="trapdoor").copy_on_write(self.world)
+        trapdoor.active = False
+        trapdoor.save()
+        self.assertTrue(self.travel("secret bunker").success)
+
+class LookCacheTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+        self.move_to("curiositycorner", self.character)
+
+    def test_repeat_look_only_reads_the_cache(self):
+        first = systems.look(self.character)
+        second = self.assertMaxQueries(0, systems.look, self.character)
+        self.assertEqual(first, second)
+
+    def test_look_sees_items_leave(self):
+        self.assertIn("bronze key", systems.look(self.character).message)
+        systems.take(self.character, "bronze key")
+        self.assertNotIn("bronze key", systems.look(self.character).message)
+        other = self.create_character("Alice")
+        self.move_to("curiositycorner", other)
+        self.assertNotIn("bronze key", systems.look(other).message)
+
+class PageCacheTests(GameTestCase):
+    def test_unchanged_pages_get_304(self):
+        url = reverse("world_list")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Test World")
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+
+        self.world.name = "Renamed World"
+        self.world.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertContains(response, "Renamed World")
+
+    def test_cached_render_skips_queries_until_a_character_changes(self):
+        url = reverse("character_list")
+        self.client.get(url)
+        self.assertMaxQueries(2, self.client.get, url) # session and user
+        character = self.create_character()
+        self.assertContains(self.client.get(url), character.name)
+
+class MetricsTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.character = self.create_character()
+        self.url = reverse("play_command", kwargs={"world_id": self.world.id, "character_slug": self.character.slug})
+
+    def test_commands_and_systems_are_counted(self):
+        self.client.post(self.url, {"command": "look"})
+        self.client.post(self.url, {"command": "go nowhere"})
+        self.client.post(self.url, {"command": "dance"})
+        totals = metrics.collect()
+        self.assertEqual(totals[("command", "look")].outcomes, {"ok": 1, "refused": 0, "error": 0})
+        self.assertEqual(totals[("command", "go")].outcomes["refused"], 1)
+        self.assertEqual(totals[("command", "unknown")].outcomes["refused"], 1)
+        self.assertEqual(sum(totals[("system", "look")].seconds), 1)
+        self.assertGreater(totals[("command", "look")].queries_sum, totals[("system", "look")].queries_sum)
+
+    def test_metrics_endpoint_is_prometheus_text(self):
+        self.client.post(self.url, {"command": "look"})
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('lowfi_calls_total{kind="command",name="look",outcome="ok"} 1', text)
+        self.assertIn('lowfi_call_seconds_bucket{kind="command",name="look",le="+Inf"} 1', text)
+        self.assertIn('lowfi_call_queries_count{kind="system",name="look"} 1', text)
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1").status_code, 403)
+
+class QueryPlanTests(GameTestCase):
+    # every query on the play hot path has to find its rows through an index. tables are tiny in
+    # tests, but sqlite plans without statistics here, so a SCAN now is a SCAN on a big world too
+    def setUp(self):
+        super().setUp()
+        self.character = self.create_character()
+
+    def assertNoTableScans(self, func, *args, **kwargs):
+        captured = []
+        def capture(execute, sql, params, many, context):
+            captured.append((sql, params))
+            return execute(sql, params, many, context)
+        with connection.execute_wrapper(capture):
+            func(*args, **kwargs)
+        self.assertTrue(captured)
+        for sql, params in captured:
+            if not sql.lstrip().upper().startswith("SELECT"):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                scans = [row[3] for row in cursor.fetchall() if row[3].startswith("SCAN") and row[3] != "SCAN CONSTANT ROW"]
+            self.assertEqual(scans, [], sql)
+
+    def test_play_page(self):
+        url = reverse("play", kwargs={"world_id": self.world.id, "character_slug": self.character.slug})
+        self.assertNoTableScans(self.client.get, url)
+
+    def test_systems(self):
+        self.assertNoTableScans(systems.look, self.character)
+        self.assertNoTableScans(systems.move, self.character, "to", "hallway")
+        self.assertNoTableScans(systems.take, self.character, "bronze key")
+        self.assertNoTableScans(systems.use, self.character, "bronze key", "door")
+        self.assertNoTableScans(systems.travel, self.character, "main street")
+
+class WorldPurgeTests(GameTestCase):
+    def test_deleted_world_is_hidden_then_purged_in_batches(self):
+        character = self.create_character()
+        self.move_to("curiositycorner", character)
+        self.assertTrue(systems.take(character, "bronze key").success)
+        base_entities = models.Entity.objects.filter(world=self.world.base).count()
+        self.client.post(reverse("world_delete", kwargs={"world_id": self.world.id}))
+        self.assertEqual(self.client.get(reverse("world_details", kwargs={"world_id": self.world.id})).status_code, 404)
+        self.assertTrue(models.World.all_objects.filter(id=self.world.id).exists())
+        # the name is free again straight away
+        models.World.objects.create(owner=self.user, name=self.world.name, base=self.world.base)
+
+        progress = []
+        report = world_purge.purge_world(self.world.id, batch_size=2, pause_seconds=0, progress=lambda report: progress.append(report.total_rows))
+        self.assertTrue(report.done)
+        self.assertEqual(progress, sorted(progress))
+        self.assertGreater(report.rows["entities"], 0)
+        self.assertFalse(models.World.all_objects.filter(id=self.world.id).exists())
+        self.assertFalse(models.Entity.objects.filter(world_id=self.world.id).exists())
+        self.assertFalse(models.Name.objects.filter(world_id=self.world.id).exists())
+        self.assertFalse(models.CharacterLog.objects.filter(character_id=character.id).exists())
+        self.assertEqual(models.Entity.objects.filter(world=self.world.base).count(), base_entities)
+        connection.check_constraints() # nothing left pointing at purged rows
+
+class WorldTransferTests(GameTestCase):
+    def test_export_then_import_restores_the_world(self):
+        character = self.create_character()
+        self.move_to("curiositycorner", character)
+        self.assertTrue(systems.take(character, "bronze key").success)
+        self.assertTrue(systems.travel(character, "ruined mansion living room").success)
+        exported = io.StringIO()
+        counts = world_transfer.export_world(self.world, exported)
+        self.assertEqual(counts["character"], 1)
+        self.assertEqual(counts["item"], 1) # the world's own copy of the key
+
+        # alongside the original, which is left as it was
+        report = self.assertMaxQueries(40, world_transfer.import_world, io.StringIO(exported.getvalue()), self.user, "Copy", chunk_size=2)
+        self.assertEqual(models.Character.objects.get(world=self.world), character)
+        restored = models.Character.objects.get(world=report.world)
+        self.assertEqual((restored.name, restored.user, restored.position.slug), ("Bob", self.user, "ruinedmansionlivingroom"))
+        self.assertEqual(restored.created_at, character.created_at)
+        self.assertEqual([item.name for item in models.Item.objects.filter(carrier=restored)], ["bronze key"])
+        self.assertEqual(models.CharacterLog.objects.filter(character=restored).count(), 1)
+        self.assertTrue(systems.use(restored, "bronze key", "trapdoor").success)
+        self.assertTrue(models.Block.objects.in_world(self.world).get(names__slug="trapdoor").active)
+
+class NpcTests(GameTestCase):
+    def test_new_worlds_get_npcs_from_toml(self):
+        self.client.post(reverse("world_create"), {"world-name": "Fresh"})
+        joe = models.Character.objects.get(world__name="Fresh", user=None)
+        self.assertEqual((joe.name, joe.position.slug, joe.home_id), ("Joe", "curiositycorner", joe.position_id))
+
+    def test_npc_names_are_taken(self):
+        spawn_npcs(self.world, [{"names": ["Joe"], "position": "curiosity corner"}])
+        response = self.client.post(reverse("character_create", kwargs={"world_id": self.world.id}), {
+            "character-name": "joe", "character-appearance": "Tall", "character-personality": "Friendly", "character-description": "Likes tacos",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "already called joe")
+        self.assertFalse(models.Character.objects.filter(world=self.world, user=self.user).exists())
+
+    @override_settings(NPC_TICK_SECONDS=5)
+    def test_web_requests_only_simulate_when_asked(self):
+        simulator = npcs.Simulator()
+        simulator.start()
+        self.assertIsNone(simulator._thread)
+
+    def test_tick_queries_do_not_grow_with_npcs(self):
+        spawn_npcs(self.world, [{"names": ["Ann"], "position": "main street"}])
+        simulation = npcs.Simulation(random.Random(1))
+        simulation.tick() # build the path graph
+        spawn_npcs(self.world, [{"names": [f"Npc {letter}"], "position": "main street"} for letter in "abcdefghij"])
+        with CaptureQueriesContext(connection) as many_npcs:
+            report = simulation.tick()
+        self.assertEqual(report.npcs, 11)
+        self.assertGreater(report.moved, 0)
+        # npcs, worlds, players, one bulk update in its savepoint, and the empty read that ends the batches
+        self.assertLessEqual(len(many_npcs), 7)
+
+    def test_npcs_wait_for_players_and_greet_them_once(self):
+        [ann] = spawn_npcs(self.world, [{"names": ["Ann"], "position": "curiosity corner"}])
+        character = self.create_character()
+        self.move_to("curiositycorner", character)
+        simulation = npcs.Simulation(random.Random(1))
+        self.assertEqual(simulation.tick().greeted, 1)
+        for _ in range(10):
+            report = simulation.tick()
+            self.assertEqual((report.moved, report.greeted), (0, 0))
+        ann.refresh_from_db()
+        self.assertEqual(ann.position.slug, "curiositycorner")
+
+class LiveTests(GameTestCase):
+    async def test_publish_and_move_fan_out_to_groups(self):
+        layer = live.InMemoryChannelLayer()
+        here, there = live.location_group(1, 10), live.location_group(1, 11)
+        mover = layer.subscribe(live.character_group(1), here)
+        stayer = layer.subscribe(here)
+        layer.publish(here, {"n": 1})
+        self.assertEqual(((await mover.get(1))["n"], (await stayer.get(1))["n"]), (1, 1))
+        layer.move(live.character_group(1), here, there)
+        layer.publish(here, {"n": 2})
+        layer.publish(there, {"n": 3})
+        self.assertEqual(((await mover.get(1))["n"], (await stayer.get(1))["n"]), (3, 2))
+        self.assertIsNone(await mover.get(0.01))
+
+    async def test_slow_readers_lose_the_oldest_messages(self):
+        subscription = live.InMemoryChannelLayer().subscribe("group")
+        for n in range(live.MAX_QUEUED_MESSAGES + 1):
+            subscription.layer.publish("group", {"n": n})
+        self.assertEqual((await subscription.get(1))["n"], 1)
+
+    async def test_stream_sends_messages_as_server_sent_events(self):
+        character = models.Character(id=1, world_id=1, position_id=10)
+        events = live.stream(character)
+        self.assertEqual(await anext(events), "retry: 3000\n\n")
+        next_event = asyncio.ensure_future(anext(events))
+        await asyncio.sleep(0.01) # subscribed now
+        live.get_channel_layer().publish(live.character_group(1), {"type": "log", "message": "hi"})
+        self.assertEqual(await next_event, 'event: log\ndata: {"type": "log", "message": "hi"}\n\n')
+        await events.aclose()
+
+    def test_play_command_returns_the_log_as_json(self):
+        character = self.create_character()
+        url = reverse("play_command", kwargs={"world_id": self.world.id, "character_slug": character.slug})
+        response = self.client.post(url, {"command": "look"})
+        log = character.characterlog_set.latest("id")
+        self.assertEqual(response.json(), {"id": log.id, "command": "look", "success": True, "css_class": log.css_class, "message": log.message})
+
+    def test_live_stream_is_only_for_your_characters(self):
+        character = self.create_character()
+        response = self.client.get(reverse("play_live", kwargs={"world_id": self.world.id, "character_slug": character.slug}))
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        response.close()
+        self.assertEqual(self.client.get(reverse("play_live", kwargs={"world_id": self.world.id, "character_slug": "nobody"})).status_code, 404)
+
+class RecordingLayer:
+    def __init__(self):
+        self.messages = []
+    def publish(self, group, message):
+        self.messages.append(message)
+
+class QueuedExecutor:
+    def __init__(self):
+        self.tasks = []
+    def submit(self, function, *args):
+        self.tasks.append(args)
+
+class ConversationTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        [self.ann] = spawn_npcs(self.world, [{"names": ["Ann"], "position": "curiosity corner", "personality": "Grumpy"}])
+        self.character = self.create_character()
+        self.move_to("curiositycorner", self.character)
+
+    def test_talk_command_finds_npc_and_topic(self):
+        log = commands.handle_command(self.character, "talk to ann about curiosity corner")
+        self.assertTrue(log.success, log.message)
+        self.assertFalse(commands.handle_command(self.character, "talk to bob about curiosity corner").success)
+
+    def test_stub_reply_streams_the_same_every_time(self):
+        conversation = conversations.prepare(self.character, self.ann, self.ann.position)
+        self.assertIn("Grumpy", conversation.prompt)
+        layer, executor = RecordingLayer(), QueuedExecutor()
+        narrator = conversations.Narrator(llm.StubBackend(word_count=5), layer, executor=executor)
+        narrator.start(conversation)
+        [(flight,)] = executor.tasks
+        reply = narrator.narrate(flight)
+        [log] = narrator.land(flight)
+        talk = [message for message in layer.messages if message["type"] == "talk"]
+        self.assertEqual(reply, "".join(message["text"] for message in talk))
+        self.assertEqual((len(talk), talk[-1]["done"]), (6, True))
+        self.assertEqual(next(llm.StubBackend(word_count=5).stream(conversation.prompt)), talk[0]["text"])
+        self.assertEqual((log.character_id, log.message, log.success), (self.character.id, reply, True))
+        self.assertEqual(layer.messages[-1], {
+            "type": "log", "id": log.id, "command": "talk to Ann about Curiosity Corner", "success": True, "css_class": log.css_class, "message": reply,
+        })
+
+    def test_talk_starts_the_reply_once_it_commits(self):
+        narrator = conversations.Narrator(llm.StubBackend(word_count=5), RecordingLayer(), executor=QueuedExecutor())
+        with mock.patch.object(conversations, "narrator", narrator):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.assertTrue(commands.handle_command(self.character, "talk to ann about curiosity corner").success)
+            self.assertEqual(narrator._executor.tasks, [])
+            for callback in callbacks:
+                callback()
+        [(flight,)] = narrator._executor.tasks
+        narrator.narrate(flight)
+        narrator.land(flight)
+        self.assertEqual(
+            list(self.character.characterlog_set.order_by("pk").values_list("command", flat=True))[-2:],
+            ["talk to ann about curiosity corner", "talk to Ann about Curiosity Corner"],
+        )
+
+    def test_identical_requests_share_one_reply_and_cache_it(self):
+        layer, executor = RecordingLayer(), QueuedExecutor()
+        narrator = conversations.Narrator(llm.StubBackend(word_count=5), layer, executor=executor)
+        first, second = (conversations.prepare(self.character, self.ann, self.ann.position) for _ in range(2))
+        narrator.start(first)
+        narrator.start(second)
+        [(flight,)] = executor.tasks # one model call for both
+        hits = llm_cache.stats.hits
+        reply = narrator.narrate(flight)
+        narrator.land(flight)
+        for conversation in (first, second):
+            self.assertEqual(reply, "".join(message["text"] for message in layer.messages if message["id"] == conversation.id))
+        narrator.start(conversations.prepare(self.character, self.ann, self.ann.position))
+        self.assertEqual(narrator.narrate(executor.tasks[1][0]), reply)
+        self.assertEqual(llm_cache.stats.hits, hits + 1)
+        self.assertEqual(models.LLMResponse.objects.get().hits, 1)
+
+    def test_cache_evicts_old_then_least_recently_used(self):
+        for key in "abcd":
+            llm_cache.store(key, "x" * 10)
+        now = datetime.now()
+        models.LLMResponse.objects.filter(key="a").update(created_at=now - timedelta(days=60))
+        for minutes, key in enumerate("dbc"):
+            models.LLMResponse.objects.filter(key=key).update(used_at=now + timedelta(minutes=minutes))
+        self.assertEqual(llm_cache.evict(max_bytes=20, max_age=timedelta(days=30)), 2)
+        self.assertEqual(set(models.LLMResponse.objects.values_list("key", flat=True)), {"b", "c"})
+
+    def test_busy_npcs_refuse_to_talk(self):
+        narrator = conversations.Narrator(max_concurrent=1, max_waiting=0)
+        narrator.in_flight = 1
+        self.assertTrue(narrator.busy())
+        self.assertFalse(narrator.start(conversations.prepare(self.character, self.ann, self.ann.position)))
+        log = self.character.characterlog_set.latest("pk")
+        self.assertEqual((log.success, log.message), (False, "No answer, they&#x27;re lost in thought."))
+
+class CommandRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = commands.CommandRegistry()
+        for name, aliases in [("go", ["g"]), ("pick", []), ("pick up", ["grab"])]:
+            handler = lambda character, thing, name=name: systems.Result.succeed(f"{name}: {thing}")
+            self.registry.register(name, r"(?: ([a-zA-Z\ ]*))?", "[thing]", "Test verb", aliases=aliases)(handler)
+
+    def dispatch(self, raw_input):
+        return self.registry.dispatch(None, raw_input).message
+
+    def test_verbs_and_aliases_dispatch_to_their_handlers(self):
+        self.assertEqual(self.dispatch("go north"), "go: north")
+        self.assertEqual(self.dispatch("G north"), "go: north")
+        self.assertEqual(self.dispatch("grab key"), "pick up: key")
+        self.assertEqual(commands.parse_command(None, "ask ann about bronze key"), ("talk", ("ann", "bronze key")))
+        self.assertEqual(commands.parse_command(None, "travel to secret bunker"), commands.parse_command(None, "travel secret bunker"))
+
+    def test_multi_word_verbs_are_tried_longest_first(self):
+        self.assertEqual(self.dispatch("Pick Up key"), "pick up: key")
+        self.assertEqual(self.dispatch("pick upper shelf"), "pick: upper shelf")
+        self.assertEqual(self.dispatch("pick"), "pick: None")
+
+    def test_unknown_verbs_fail(self):
+        for raw_input in ["dance", "pickup key", "gone north", ""]:
+            result = self.registry.dispatch(None, raw_input)
+            self.assertEqual((result.success, result.message), (False, f'"{raw_input}" is not a valid command.'))
+        with self.assertRaises(AssertionError):
+            self.registry.register("Grab", r"", "", "Taken")(lambda character: None)
+
+    def test_repeated_input_parses_the_same_from_the_cache(self):
+        first = commands.parse_command(None, " go north ", self.registry)
+        hits = self.registry.parse.cache_info().hits
+        self.assertEqual(commands.parse_command(None, "go north", self.registry), first)
+        self.assertEqual(commands.parse_command(None, "go north", self.registry), ("go", ("north",)))
+        self.assertEqual(self.registry.parse.cache_info().hits, hits + 2)
+        self.registry.register("go north", r"", "", "Test verb")(lambda character: None) # new verbs drop stale parses
+        self.assertEqual(commands.parse_command(None, "go north", self.registry), ("go north", ()))
+
+class ReplicaTests(SimpleTestCase):
+    databases = {"default"}
+
+    def test_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1) # NORMAL
+
+    def test_only_read_only_reads_outside_transactions_use_the_replica(self):
+        router = replica.ReadReplicaRouter()
+        self.assertIsNone(router.db_for_read(models.Item))
+        with replica.reading():
+            self.assertEqual(router.db_for_read(models.Item), "replica")
+            with transaction.atomic():
+                self.assertIsNone(router.db_for_read(models.Item))
+        self.assertEqual(router.db_for_write(models.Item), "default")
 
-# Create your tests here.
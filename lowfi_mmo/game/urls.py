@@ -17,5 +17,11 @@ urlpatterns = [
     path('worlds/<int:world_id>/characters/create/', views.character_create, name='character_create'),
     path('worlds/<int:world_id>/characters/edit/<slug:character_slug>/', views.character_edit, name="character_edit"),
     path('play/<int:world_id>/<slug:character_slug>/', views.play, name='play'),
+    path('play/<int:world_id>/<slug:character_slug>/command/', views.play_command, name='play_command'),
+    path('play/<int:world_id>/<slug:character_slug>/live/', views.play_live, name='play_live'),
+    path('play/<int:world_id>/<slug:character_slug>/history/', views.play_history, name='play_history'),
+
+    # monitoring
+    path('metrics/', views.game_metrics, name='metrics'),
 
 ]
\ No newline at end of file
@@ -1,11 +1,17 @@
 from django.shortcuts import render, redirect, get_object_or_404, get_list_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseForbidden, HttpResponseNotFound
-from game import models, forms
-from .commands import handle_command
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseForbidden, HttpResponseNotFound, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from game import models, forms, play_state, live, log_archive, metrics, world_purge, npcs
+from django.conf import settings
+from game.page_cache import cached_per_user
+from game.replica import read_only
+from .scheduler import arun_command
 from django.db import transaction
 from django.http import HttpResponse
-from .worldgen.world_creator import populate_world
+from .worldgen.world_creator import get_base_world
+from .worldgen.character_creator import spawn_npcs
 from .worldgen.world_visualizer import world_to_html
 from .commands import COMMANDS
 from datetime import datetime
@@ -13,39 +19,83 @@ from datetime import datetime
 def index(request):
     return render(request, "index.html")
 
-@login_required
-def play(request, world_id, character_slug):
-    player = models.Character.objects.get(world__id=world_id, names__slug=character_slug, user=request.user)
-
+@read_only
+async def play(request, world_id, character_slug):
+    # async all the way down (see scheduler.arun_command), so a waiting player doesn't hold a thread
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    npcs.simulator.start() # no-op once running, or without NPC_SIMULATE_IN_WEB
+    queued_command = None
     if(request.method=="POST"):
         command = request.POST.get('command')
-        handle_command(player, command)
-
-    paths = player.position.start_paths.all()
-    nearby_npcs = models.Character.objects.filter(position=player.position, user=None)
-    nearby_players = models.Character.objects.filter(position=player.position).exclude(id=player.id)
-    most_recent_success_log = player.characterlog_set.filter(success=True).order_by('-created_at').first()
-    most_recent_error_log = player.characterlog_set.filter(success=False).order_by('-created_at').first()
-
-    MAX_HISTORY = 1
-    logs = player.characterlog_set.order_by('-created_at')[:MAX_HISTORY]
+        try:
+            await arun_command(await play_state.aload_player(world_id, character_slug, user), command)
+        except TimeoutError:
+            queued_command = command # runs in a later tick
 
+    state = await play_state.aload_play_state(world_id, character_slug, user)
     context = {
-        "player": player,
-        "nearby_npcs": nearby_npcs,
-        "nearby_players": nearby_players,
-        "paths": paths,
-        'success_log': most_recent_success_log,
-        'error_log': most_recent_error_log,
-        'log_history': logs,
+        "player": state.player,
+        "character_slug": character_slug,
+        "nearby_npcs": state.nearby_npcs,
+        "nearby_players": state.nearby_players,
+        "nearby_items": state.nearby_items,
+        "paths": state.paths,
+        'success_log': state.success_log,
+        'error_log': state.error_log,
+        'log_history': state.log_history,
+        'queued_command': queued_command,
         'commands': COMMANDS,
     }
     return render(request, "play.html", context)
 
+@require_POST
+async def play_command(request, world_id, character_slug):
+    # live play: send the command, get back just its log rather than a whole page
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponseForbidden("Log in to play.")
+    try:
+        log = await arun_command(await play_state.aload_player(world_id, character_slug, user), request.POST.get('command', ''))
+    except TimeoutError:
+        return JsonResponse({"error": "The server is busy, your command is still queued."}, status=503)
+    return JsonResponse({"id": log.id, "command": log.command, "success": log.success, "css_class": log.css_class, "message": log.message})
+
 @login_required
+def play_history(request, world_id, character_slug):
+    # older logs a page at a time, newest first, including ones that have been archived
+    player = play_state.load_player(world_id, character_slug, request.user)
+    try:
+        before = log_archive.decode_cursor(request.GET["before"]) if request.GET.get("before") else None
+        limit = min(max(int(request.GET.get("limit", 20)), 1), 100)
+    except ValueError:
+        return JsonResponse({"error": "Invalid cursor or limit."}, status=400)
+    logs, next_cursor = log_archive.history(player, before, limit)
+    return JsonResponse({
+        "logs": [{"id": log.id, "command": log.command, "success": log.success, "css_class": log.css_class, "message": log.message, "created_at": log.created_at.isoformat()} for log in logs],
+        "next": next_cursor,
+    })
+
+async def play_live(request, world_id, character_slug):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponseForbidden("Log in to play.")
+    try:
+        player = await play_state.aload_player(world_id, character_slug, user)
+    except models.Character.DoesNotExist:
+        return HttpResponseNotFound("Character not found.")
+    response = StreamingHttpResponse(live.stream(player), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no" # don't let a proxy hold events back
+    return response
+
+@login_required
+@read_only
+@cached_per_user
 def world_list(request):
-    owned_worlds = models.World.objects.filter(owner=request.user)
-    participant_worlds = models.World.objects.filter(worldmember__user=request.user)
+    owned_worlds = list(models.World.objects.filter(owner=request.user))
+    participant_worlds = list(models.World.objects.filter(worldmember__user=request.user))
     context = {
         "owned_worlds": owned_worlds,
         "participant_worlds": participant_worlds,
@@ -60,8 +110,9 @@ def world_create(request):
         world_form = forms.WorldForm(request.POST, prefix="world")
         if(world_form.is_valid()):
             world_form.instance.owner = request.user
+            world_form.instance.base = get_base_world() # content is shared, not copied
             world = world_form.save()
-            populate_world(world)
+            spawn_npcs(world)
             return redirect("world_list")
     else:
         world_form = forms.WorldForm(prefix="world")
@@ -94,9 +145,11 @@ def world_edit(request, world_id):
     
 
 @login_required
+@read_only
+@cached_per_user
 def world_details(request, world_id):
     world = get_object_or_404(models.World, id=world_id)
-    if(not world.worldmember_set.filter(user=request.user) and not world.owner == request.user):
+    if(world.owner_id != request.user.id and not world.worldmember_set.filter(user=request.user).exists()):
         return HttpResponseNotFound("World not found.")
     
     player_character = models.Character.objects.filter(world_id=world_id, user=request.user).first()
@@ -114,7 +167,7 @@ def world_delete(request, world_id):
     if(world.owner != request.user):
         return HttpResponseForbidden("You are not allowed to delete this world.")
     if(request.method == "POST"):
-        world.delete()
+        world_purge.delete_world(world) # gone from view now, from the database in the background
         return redirect("world_list")
     
     context = {
@@ -125,8 +178,9 @@ def world_delete(request, world_id):
     return render(request, "form.html", context)
 
 @login_required
+@cached_per_user
 def character_list(request):
-    user_characters = models.Character.objects.filter(user=request.user)
+    user_characters = models.Character.objects.filter(user=request.user, world__deleted_at__isnull=True).select_related("position")
     return render(request, "characters/character_select.html", {"user_characters": user_characters})
 
 @login_required
@@ -134,17 +188,17 @@ def character_list(request):
 def character_create(request, world_id):
     world = get_object_or_404(models.World, id=world_id)
     if(request.method=="POST"):
-        character_form = forms.CharacterForm(request.POST, prefix="character") # avoid real person name autocomplete
+        character_form = forms.CharacterForm(request.POST, prefix="character", world=world) # avoid real person name autocomplete
         if(character_form.is_valid()):
             character_form.instance.user = request.user
             character_form.instance.world_id = world_id
             character_name = character_form.cleaned_data['name']
             HUB_NAME = "apartment complex"
-            hub = models.Location.objects.get(world_id=world_id, names__name__iexact=HUB_NAME)
+            hub = models.Location.objects.in_world(world).get(names__name__iexact=HUB_NAME)
             spawnpoint = models.Location.objects.create(world_id=world_id, appearance="Interior of cheap apartment living room", description=f"A dingy little apartment that isn't worth writing home about. It's alright, you suppose.")
             spawnpoint.names.create(world_id=world_id, name=f"{character_name}'s apartment")
-            models.Path.objects.create(preposition="outside", start=spawnpoint, end=hub)
-            models.Path.objects.create(preposition="to", noun=f"{character_name}'s apartment", start=hub, end=spawnpoint)
+            models.Path.objects.create(world_id=world_id, preposition="outside", start=spawnpoint, end=hub)
+            models.Path.objects.create(world_id=world_id, preposition="to", noun=f"{character_name}'s apartment", start=hub, end=spawnpoint)
             character_form.instance.position = spawnpoint
             character = character_form.save()
             character.names.create(world_id=world_id, name=character_form.cleaned_data['name'])
@@ -160,7 +214,7 @@ def character_create(request, world_id):
             )
             return redirect("world_details", world_id=world_id)
     else:
-        character_form = forms.CharacterForm(prefix="character")
+        character_form = forms.CharacterForm(prefix="character", world=world)
     context = {
         "form": character_form,
         "form_heading": f"Create character in {world}",
@@ -169,20 +223,20 @@ def character_create(request, world_id):
     return render(request, "form.html", context)
 
 def character_edit(request, world_id, character_slug):
-    character = get_object_or_404(models.Character, world_id=world_id, names__slug=character_slug, user=request.user)
+    character = get_object_or_404(models.Character, world_id=world_id, world__deleted_at__isnull=True, names__slug=character_slug, user=request.user)
     if(character.user_id != request.user.id):
         return HttpResponseForbidden("You don't have permissions to edit this character.")
     if(request.method=="POST"):
-        character_form = forms.CharacterForm(request.POST, instance=character, prefix="character")
+        character_form = forms.CharacterForm(request.POST, instance=character, prefix="character", world=character.world)
         if(character_form.is_valid()):
             character_form.save()
             name = character_form.cleaned_data['name']
-            first_name = character.names.first()
+            first_name = character.names.order_by("id").first()
             first_name.name = name
             first_name.save()
             return redirect("world_details", world_id=world_id)
     else:
-        character_form = forms.CharacterForm(instance=character, prefix="character", initial={"name": character.name})
+        character_form = forms.CharacterForm(instance=character, prefix="character", initial={"name": character.name}, world=character.world)
     context = {
         "form": character_form,
         "form_heading": "Edit Character",
@@ -192,9 +246,18 @@ def character_edit(request, world_id, character_slug):
     return render(request, "form.html", context)
 
 
+@read_only
 def world_visualize(request, world_id):
     area = get_object_or_404(models.World, id=world_id)
     plot_html = world_to_html(area)
     response = HttpResponse(content_type='text/html')
     response.write(plot_html)
-    return response
\ No newline at end of file
+    return response
+
+
+def game_metrics(request):
+    # for a prometheus scraper on the box, or staff checking by hand
+    allowed_ips = getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"])
+    if request.META.get("REMOTE_ADDR") not in allowed_ips and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,64 @@
+from asgiref.sync import sync_to_async
+from collections import OrderedDict
+import threading
+
+_caches = []
+
+def clear_all():
+    for cache in _caches:
+        cache.clear()
+
+def invalidate_all(world_id):
+    for cache in _caches:
+        cache.invalidate(world_id)
+
+class WorldCache:
+    """Per-process LRU of structures built from a world's content (path graphs, name indexes).
+
+    Entries remember their world's template so changes to a template can drop every world built on it.
+    """
+    def __init__(self, build, max_worlds=256):
+        self.build = build
+        self.max_worlds = max_worlds
+        self._entries = OrderedDict() # world id -> (base id, value)
+        self._lock = threading.Lock()
+        _caches.append(self)
+
+    def get(self, world):
+        entry = self._lookup(world)
+        return entry[1] if entry else self._store(world, self.build(world))
+
+    async def aget(self, world):
+        # builds query the database, so from async code they run in a thread
+        entry = self._lookup(world)
+        return entry[1] if entry else self._store(world, await sync_to_async(self.build)(world))
+
+    def _lookup(self, world):
+        with self._lock:
+            entry = self._entries.get(world.id)
+            if entry:
+                self._entries.move_to_end(world.id)
+            return entry
+
+    def _store(self, world, value):
+        with self._lock:
+            self._entries[world.id] = (world.base_id, value)
+            while len(self._entries) > self.max_worlds:
+                self._entries.popitem(last=False)
+        return value
+
+    def cached(self, world_id):
+        """Cached values that read from this world, i.e. its own and those of worlds built on it."""
+        with self._lock:
+            return [value for cached_id, (base_id, value) in self._entries.items() if world_id in (cached_id, base_id)]
+
+    def invalidate(self, world_id, include_instances=True):
+        with self._lock:
+            self._entries.pop(world_id, None)
+            if include_instances:
+                for cached_id in [cached_id for cached_id, (base_id, _) in self._entries.items() if base_id == world_id]:
+                    del self._entries[cached_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
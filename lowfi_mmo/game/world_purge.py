@@ -0,0 +1,133 @@
+from game import models, world_cache
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+import threading
+import time
+
+# deleting a world only marks it deleted, which hides it everywhere at once. the rows go later, in
+# the background: table by table, a batch of ids at a time, each batch a plain DELETE in its own
+# short transaction. Django's world.delete() would load every row into memory to cascade and signal
+# and hold the write lock until the whole world was gone, stalling every other world meanwhile.
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, "WORLD_PURGE_BATCH_SIZE", 500)
+PAUSE_SECONDS = getattr(settings, "WORLD_PURGE_PAUSE_SECONDS", 0.05) # between batches, so waiting writers get the lock
+
+def purge_steps(world_id):
+    """(table, queryset) pairs in an order where each batch leaves nothing pointing at a deleted row."""
+    in_world = Q(world_id=world_id)
+    return [
+        ("character logs", models.CharacterLog.objects.filter(character__world_id=world_id)),
+        ("log archives", models.CharacterLogArchive.objects.filter(character__world_id=world_id)),
+        ("clue knowledge", models.ClueKnowledge.objects.filter(Q(character__world_id=world_id) | Q(clue__mystery__world_id=world_id))),
+        ("block paths", models.Block.paths.through.objects.filter(
+            Q(block__world_id=world_id) | Q(path__start__world_id=world_id) | Q(path__end__world_id=world_id))),
+        ("entity tags", models.Entity.tags.through.objects.filter(entity__world_id=world_id)),
+        ("names", models.Name.objects.filter(in_world)),
+        ("blocks", models.Block.objects.filter(in_world)),
+        ("items", models.Item.objects.filter(in_world | Q(carrier__world_id=world_id) | Q(position__world_id=world_id))),
+        ("characters", models.Character.objects.filter(in_world)),
+        ("paths", models.Path.objects.filter(in_world | Q(start__world_id=world_id) | Q(end__world_id=world_id))),
+        ("locations", models.Location.objects.filter(in_world)),
+        ("entities", models.Entity.objects.filter(in_world)),
+        ("clues", models.Clue.objects.filter(mystery__world_id=world_id)),
+        ("mystery connections", models.Mystery.connections.through.objects.filter(
+            Q(from_mystery__world_id=world_id) | Q(to_mystery__world_id=world_id))),
+        ("mysteries", models.Mystery.objects.filter(in_world)),
+        ("members", models.WorldMember.objects.filter(in_world)),
+        ("layout", models.WorldLayout.objects.filter(in_world)),
+        ("world", models.World.all_objects.filter(id=world_id)),
+    ]
+
+@dataclass
+class PurgeReport:
+    world_id: int
+    rows: dict = field(default_factory=dict) # table -> rows deleted so far
+    batches: int = 0
+    table: str = "" # the one being purged now
+    done: bool = False
+
+    @property
+    def total_rows(self):
+        return sum(self.rows.values())
+
+def delete_world(world):
+    """Hide the world now and purge it in the background once the deletion is committed."""
+    world.deleted_at = datetime.now()
+    world.save(update_fields=["deleted_at"])
+    world_cache.invalidate_all(world.id)
+    transaction.on_commit(purger.start)
+
+def purge_world(world_id, batch_size=BATCH_SIZE, pause_seconds=PAUSE_SECONDS, progress=None) -> PurgeReport:
+    report = PurgeReport(world_id)
+    for table, queryset in purge_steps(world_id):
+        report.table = table
+        report.rows[table] = 0
+        while True:
+            with transaction.atomic():
+                ids = list(queryset.order_by().values_list("pk", flat=True).distinct()[:batch_size])
+                if ids:
+                    # straight to SQL: no collector, no signals, only this table's rows
+                    report.rows[table] += queryset.model._base_manager.filter(pk__in=ids)._raw_delete(queryset.db)
+            if not ids:
+                break
+            report.batches += 1
+            if progress:
+                progress(report)
+            if pause_seconds:
+                time.sleep(pause_seconds)
+    report.done = True
+    world_cache.invalidate_all(world_id)
+    if progress:
+        progress(report)
+    return report
+
+def purge_deleted_worlds(**kwargs) -> list[PurgeReport]:
+    reports = []
+    while world_id := models.World.all_objects.filter(deleted_at__isnull=False).order_by("deleted_at").values_list("id", flat=True).first():
+        reports.append(purge_world(world_id, **kwargs))
+    return reports
+
+class Purger:
+    """Purges deleted worlds one after another on a background thread, which stops when there are none left."""
+    def __init__(self):
+        self.current: PurgeReport | None = None
+        self._wanted = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            self._wanted = True # a thread that's just finishing looks again
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self.run, name="world-purge", daemon=True)
+                self._thread.start()
+
+    def run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._wanted:
+                        return
+                    self._wanted = False
+                try:
+                    purge_deleted_worlds(progress=self.report)
+                except Exception:
+                    # whatever is left is picked up by the next purge, or manage.py purge_worlds
+                    logger.exception("World purge failed")
+        finally:
+            self.current = None
+            close_old_connections()
+
+    def report(self, report):
+        self.current = report
+        if report.done:
+            logger.info("Purged world %s: %s rows in %s batches", report.world_id, report.total_rows, report.batches)
+        else:
+            logger.debug("Purging world %s: %s, %s rows so far", report.world_id, report.table, report.total_rows)
+
+purger = Purger()
@@ -0,0 +1,250 @@
+from game import models, world_purge, page_cache
+from game.worldgen.world_creator import WorldBuilder, get_base_world
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from dataclasses import dataclass, field
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+import base64
+import json
+import logging
+
+# one world as gzipped JSON Lines: a header line, then one line per row, parents before the rows that
+# point at them. rows are streamed with iterator() on export, so memory stays flat however big the world.
+# ids in the file are the exporting database's; references to the template a world is built on are
+# made by slug instead, since template ids differ between deployments. import inserts in chunks and
+# remaps every id to the ones the new rows get.
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 500
+ENTITY_FIELDS = ["appearance", "description", "primary_name", "primary_slug"]
+
+@dataclass
+class Section:
+    kind: str
+    model: type
+    fields: list # copied as they are
+    refs: dict = field(default_factory=dict) # field attname -> id space it points into: entity, path, mystery or clue
+    id_space: str | None = None # where other rows find this one
+    scope: tuple = ("world_id",) # lookups to the world id, any of which makes a row part of the world
+
+    def rows(self, world_id):
+        condition = Q()
+        for lookup in self.scope:
+            condition |= Q(**{lookup: world_id})
+        return self.model._base_manager.filter(condition)
+
+SECTIONS = [
+    Section("mystery", models.Mystery, ["name"], id_space="mystery"),
+    Section("mystery_connection", models.Mystery.connections.through, [], {"from_mystery_id": "mystery", "to_mystery_id": "mystery"}, scope=("from_mystery__world_id",)),
+    Section("clue", models.Clue, ["summary"], {"mystery_id": "mystery"}, id_space="clue", scope=("mystery__world_id",)),
+    Section("location", models.Location, ENTITY_FIELDS + ["category"],
+            {"overrides_id": "entity", "arrive_clue_id": "clue", "search_clue_id": "clue"}, id_space="entity"),
+    Section("path", models.Path, ["preposition", "noun", "noun_slug", "travel_seconds", "hidden", "discoverable"],
+            {"start_id": "entity", "end_id": "entity"}, id_space="path"),
+    Section("character", models.Character, ENTITY_FIELDS + ["personality", "carry_limit", "carried_kg", "carried_count", "created_at"],
+            {"overrides_id": "entity", "position_id": "entity", "path_taken_id": "path", "home_id": "entity"}, id_space="entity"),
+    Section("item", models.Item, ENTITY_FIELDS + ["kg", "value", "text"],
+            {"overrides_id": "entity", "carrier_id": "entity", "position_id": "entity", "inspect_clue_id": "clue", "text_clue_id": "clue"}, id_space="entity"),
+    Section("block", models.Block, ENTITY_FIELDS + ["active", "unlock_description"],
+            {"overrides_id": "entity", "unlocked_by_id": "entity"}, id_space="entity"),
+    Section("block_path", models.Block.paths.through, [], {"block_id": "entity", "path_id": "path"}, scope=("block__world_id",)),
+    Section("name", models.Name, ["name", "slug"], {"entity_id": "entity"}),
+    Section("entity_tag", models.Entity.tags.through, [], {"entity_id": "entity"}, scope=("entity__world_id",)),
+    Section("character_log", models.CharacterLog, ["command", "success", "message", "created_at"], {"character_id": "entity"}, scope=("character__world_id",)),
+    Section("log_archive", models.CharacterLogArchive, ["first_created_at", "last_created_at", "log_count", "data", "created_at"],
+            {"character_id": "entity"}, scope=("character__world_id",)),
+]
+SECTIONS_BY_KIND = {section.kind: section for section in SECTIONS}
+
+# export
+
+def ref_lookups(attname, id_space):
+    relation = attname.removesuffix("_id")
+    if id_space == "entity":
+        return [f"{relation}__world_id", f"{relation}__primary_slug"]
+    if id_space == "path":
+        return [f"{relation}__world_id", f"{relation}__start__primary_slug", f"{relation}__end__primary_slug", f"{relation}__preposition"]
+    return []
+
+def encode_ref(world_id, attname, id_space, row):
+    """The id if the row it points at is exported too, else how to find it in the template."""
+    value, relation = row[attname], attname.removesuffix("_id")
+    if value is None:
+        return None
+    if id_space == "entity" and row[f"{relation}__world_id"] != world_id:
+        return {"base": row[f"{relation}__primary_slug"]}
+    if id_space == "path" and row[f"{relation}__world_id"] != world_id:
+        return {"base": [row[f"{relation}__start__primary_slug"], row[f"{relation}__end__primary_slug"], row[f"{relation}__preposition"]]}
+    if id_space == "clue" and row[f"{relation}__mystery__world_id"] != world_id:
+        return None # clues aren't wired into the world yet (see mystery_creator.py), so template clues aren't carried over
+    return value
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (bytes, memoryview)):
+        return base64.b64encode(bytes(value)).decode()
+    return value
+
+def export_rows(section, world_id):
+    lookups = ["pk", *section.fields, *section.refs]
+    for attname, id_space in section.refs.items():
+        lookups += ref_lookups(attname, id_space)
+        if id_space == "clue":
+            lookups.append(f"{attname.removesuffix('_id')}__mystery__world_id")
+    if section.kind == "character":
+        lookups.append("user__username")
+    if section.kind == "entity_tag":
+        lookups.append("tag__name")
+    queryset = section.rows(world_id).order_by("pk").values(*lookups).distinct()
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        record = {"type": section.kind, "id": row["pk"]}
+        record.update({name: encode(row[name]) for name in section.fields})
+        record.update({attname: encode_ref(world_id, attname, id_space, row) for attname, id_space in section.refs.items()})
+        if section.kind == "character":
+            record["user"] = row["user__username"]
+        if section.kind == "entity_tag":
+            record["tag"] = row["tag__name"]
+        yield record
+
+def export_world(world, out) -> Counter:
+    """Write the world to out, a text stream, one JSON object per line."""
+    base = world.base
+    counts = Counter()
+    header = {
+        "type": "world", "format": FORMAT_VERSION, "name": world.name,
+        "base_content_version": base.content_version if base else None,
+    }
+    out.write(json.dumps(header) + "\n")
+    for section in SECTIONS:
+        for record in export_rows(section, world.id):
+            out.write(json.dumps(record, separators=(",", ":")) + "\n")
+            counts[section.kind] += 1
+    return counts
+
+# import
+
+class TransferError(Exception):
+    pass
+
+@dataclass
+class ImportReport:
+    world: models.World | None = None
+    rows: Counter = field(default_factory=Counter)
+    unknown_users: int = 0 # characters whose player isn't on this deployment, given to the importing owner
+
+class Importer:
+    def __init__(self, world, owner):
+        self.world = world
+        self.owner = owner
+        self.builder = WorldBuilder(world)
+        self.ids = {"entity": {}, "path": {}, "mystery": {}, "clue": {}}
+        self.users = {}
+        self.report = ImportReport(world, self.builder.row_counts)
+        # the template's names and paths are looked up by slug, loaded once on first use
+        self._base_entities = None
+        self._base_paths = None
+
+    def base_entity(self, slug):
+        if self._base_entities is None:
+            self._base_entities = dict(models.Name.objects.filter(world_id=self.world.base_id).values_list("slug", "entity_id"))
+        if slug not in self._base_entities:
+            raise TransferError(f"\"{slug}\" isn't in this deployment's template world")
+        return self._base_entities[slug]
+
+    def base_path(self, start_slug, end_slug, preposition):
+        if self._base_paths is None:
+            self._base_paths = {
+                (start, end, preposition): path_id for path_id, start, end, preposition
+                in models.Path.objects.filter(world_id=self.world.base_id).values_list("id", "start_id", "end_id", "preposition")
+            }
+        key = (self.base_entity(start_slug), self.base_entity(end_slug), preposition)
+        if key not in self._base_paths:
+            raise TransferError(f"The template has no path {preposition} from \"{start_slug}\" to \"{end_slug}\"")
+        return self._base_paths[key]
+
+    def resolve(self, id_space, value):
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            return self.base_path(*value["base"]) if id_space == "path" else self.base_entity(value["base"])
+        return self.ids[id_space][value]
+
+    def user(self, username):
+        if username is None:
+            return None
+        if username not in self.users:
+            self.users[username] = User.objects.filter(username=username).first()
+        if self.users[username] is None:
+            self.report.unknown_users += 1
+            return self.owner
+        return self.users[username]
+
+    def build(self, section, record):
+        values = {}
+        for name in section.fields:
+            values[name] = section.model._meta.get_field(name).to_python(record[name])
+        for attname, id_space in section.refs.items():
+            values[attname] = self.resolve(id_space, record[attname])
+        if section.kind == "character":
+            values["user"] = self.user(record["user"])
+        if section.kind == "entity_tag":
+            values["tag_id"] = self.tag_ids[record["tag"]]
+        if section.scope == ("world_id",):
+            values["world"] = self.world
+        return section.model(**values)
+
+    def insert(self, section, records):
+        if section.kind == "entity_tag":
+            tag_names = {record["tag"] for record in records}
+            models.Tag.objects.bulk_create([models.Tag(name=name) for name in tag_names], ignore_conflicts=True)
+            self.tag_ids = dict(models.Tag.objects.filter(name__in=tag_names).values_list("name", "id"))
+        objs = [self.build(section, record) for record in records]
+        created = [obj.created_at for obj in objs] if "created_at" in section.fields else None
+        with transaction.atomic():
+            if issubclass(section.model, models.Entity):
+                self.builder.create_entities(section.model, objs)
+            else:
+                self.builder.bulk_create(section.model, objs)
+            if created:
+                # auto_now_add stamped them with now, put the exported times back
+                for obj, created_at in zip(objs, created):
+                    obj.created_at = created_at
+                section.model._base_manager.bulk_update(objs, ["created_at"])
+        if section.id_space:
+            self.ids[section.id_space].update((record["id"], obj.pk) for record, obj in zip(records, objs))
+
+def import_world(lines, owner, name=None, chunk_size=CHUNK_SIZE) -> ImportReport:
+    """Create a new world for owner from export_world's lines, inserting chunk_size rows per transaction."""
+    lines = iter(lines)
+    header = json.loads(next(lines))
+    if header.get("type") != "world" or header.get("format") != FORMAT_VERSION:
+        raise TransferError("Not a world export, or from an incompatible version")
+    base = get_base_world() if header["base_content_version"] else None
+    if base and base.content_version != header["base_content_version"]:
+        logger.warning("World was exported against template %s, importing onto %s", header["base_content_version"][:8], base.content_version[:8])
+    world = models.World.objects.create(owner=owner, name=name or header["name"], base=base)
+    importer = Importer(world, owner)
+    try:
+        section, chunk = None, []
+        for line in lines:
+            record = json.loads(line)
+            if chunk and (record["type"] != section.kind or len(chunk) >= chunk_size):
+                importer.insert(section, chunk)
+                chunk = []
+            section = SECTIONS_BY_KIND[record["type"]]
+            chunk.append(record)
+        if chunk:
+            importer.insert(section, chunk)
+    except Exception:
+        # chunks are committed as they go, so clear away the half imported world
+        world_purge.delete_world(world)
+        raise
+    page_cache.changed(*[user.id for user in importer.users.values() if user]) # bulk inserts skip the signals
+    return importer.report
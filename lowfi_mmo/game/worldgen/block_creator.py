@@ -1,17 +1,32 @@
 from .world_creator import extract_details
 from game import models
-from .world_creator import add_names_and_tags
 
-def create_block(world, block_dict):
-    key = models.Item.objects.in_world(world).get(names__name__iexact=block_dict["unlocked_by"])
+def create_blocks(builder, block_dicts):
+    paths_by_ends = {}
+    for path in builder.paths:
+        paths_by_ends.setdefault((path.start_id, path.end_id), []).append(path)
+
+    blocks = []
+    blocked_paths = []
+    for block_dict in block_dicts:
+        block, paths = create_block(builder, block_dict, paths_by_ends)
+        blocks.append(block)
+        blocked_paths.append(paths)
+    builder.create_entities(models.Block, blocks)
+
+    Through = models.Block.paths.through
+    builder.bulk_create(Through, [Through(block_id=block.id, path_id=path.id) for block, paths in zip(blocks, blocked_paths) for path in paths])
+
+def create_block(builder, block_dict, paths_by_ends):
+    key = builder.get(models.Item, block_dict["unlocked_by"])
     block_details = extract_details(block_dict)
-    block = models.Block.objects.create(world=world, unlocked_by=key, **block_details)
-    add_names_and_tags(block, block_dict)
+    block = models.Block(world=builder.world, unlocked_by=key, unlock_description=block_dict.get('unlock_description', ''), **block_details)
+    builder.add_names_and_tags(block, block_dict)
     one_way = block_dict.get('one_way', False)
-    starts = [block_dict['from']] if one_way else [block_dict['from'], block_dict['to']]
-    ends = [block_dict['to']] if one_way else [block_dict['from'], block_dict['to']]
-    blocked_paths = models.Path.objects.filter(start__world=world, end__world=world, start__names__name__in=starts, end__names__name__in=ends)
-    if(blocked_paths.count() == 0): raise Exception(f"Block \"{block}\" has no paths")
-    if(blocked_paths.count() > 2): raise Exception(f"Block \"{block}\" is blocking too many paths: " + ", ".join([str(path) + " (" + str(path.start) + " -> " + str(path.end) + ")" for path in blocked_paths])) # possibly temporary
-    for path in blocked_paths:
-        block.paths.add(path)
\ No newline at end of file
+    start = builder.get(models.Location, block_dict['from'])
+    end = builder.get(models.Location, block_dict['to'])
+    ends = [(start.id, end.id)] if one_way else [(start.id, end.id), (end.id, start.id)]
+    blocked_paths = [path for pair in ends for path in paths_by_ends.get(pair, [])]
+    if(len(blocked_paths) == 0): raise Exception(f"Block \"{block_dict['names'][0]}\" has no paths")
+    if(len(blocked_paths) > 2): raise Exception(f"Block \"{block_dict['names'][0]}\" is blocking too many paths: " + ", ".join([str(path) for path in blocked_paths])) # possibly temporary
+    return block, blocked_paths
@@ -0,0 +1,34 @@
+from game import models
+from .world_creator import WorldBuilder, extract_details, parse_toml_file
+import os
+
+def npc_dicts():
+    containing_folder = os.path.dirname(os.path.abspath(__file__))
+    return parse_toml_file(os.path.join(containing_folder, "characters", "npcs.toml"))["characters"]
+
+def spawn_npcs(world, character_dicts=None):
+    """Give a new world its own npcs from characters/npcs.toml, at home in the locations named there.
+
+    npcs move about (see game/npcs.py), so unlike locations and items every world gets its own rather
+    than reading them through from the template.
+    """
+    character_dicts = npc_dicts() if character_dicts is None else character_dicts
+    location_ids = dict(models.Name.objects.filter(
+        world_id__in=world.content_world_ids, entity__location__isnull=False
+    ).values_list("slug", "entity_id"))
+    builder = WorldBuilder(world)
+    npcs = []
+    for character_dict in character_dicts:
+        assert 'position' in character_dict, f"Character \"{character_dict['names'][0]}\" needs a position"
+        location_id = location_ids.get(models.slugify_spaceless(character_dict['position']))
+        if not location_id:
+            raise models.Location.DoesNotExist(f"Location named \"{character_dict['position']}\" does not exist.")
+        npc = models.Character(
+            world=world, position_id=location_id, home_id=location_id, personality=character_dict.get('personality', ''),
+            **extract_details(character_dict),
+        )
+        builder.add_names_and_tags(npc, character_dict)
+        npcs.append(npc)
+    builder.create_entities(models.Character, npcs)
+    builder.save_names_and_tags()
+    return npcs
@@ -1,40 +1,48 @@
 from game import models
 from django.db import IntegrityError
-from .world_creator import add_names_and_tags, extract_details
+from .world_creator import extract_details
 
-def create_locations(world, locations):
-    paths = []
-    for location_dict in locations:
-        location_db = create_location(world, location_dict)
-        for loc_exit in location_dict['exits']:
-            paths.append({'start_obj': location_db, 'exit': loc_exit})
+def create_locations(builder, locations):
+    location_objs = [create_location(builder, location_dict) for location_dict in locations]
+    builder.create_entities(models.Location, location_objs)
+
+    item_objs = []
+    for location_db, location_dict in zip(location_objs, locations):
         for item_dict in location_dict.get("items", []):
-            create_item(world, item_dict, location_db)
-    for path in paths:
-        create_path(world, path)
+            item_objs.append(create_item(builder, item_dict, location_db))
+    builder.create_entities(models.Item, item_objs)
+
+    path_objs = []
+    for location_db, location_dict in zip(location_objs, locations):
+        for loc_exit in location_dict['exits']:
+            path_objs.append(create_path(builder, location_db, loc_exit))
+    seen = set()
+    for path in path_objs:
+        for key in [(path.start.id, path.end.id, path.preposition), (path.start.id, path.preposition, path.noun)]:
+            if key in seen:
+                raise IntegrityError(f"{path.preposition if path.noun else '<no preposition>'}-{path.noun if path.noun else '<no noun>'} already exists for location {path.start}")
+            seen.add(key)
+    builder.paths += builder.bulk_create(models.Path, path_objs)
 
-def create_item(world, item_dict, position):
+def create_item(builder, item_dict, position):
     item_details = extract_details(item_dict)
-    item_db = models.Item.objects.create(world=world, position=position, **item_details)
-    add_names_and_tags(item_db, item_dict)
+    item_db = models.Item(world=builder.world, position=position, **item_details)
+    builder.add_names_and_tags(item_db, item_dict)
+    return item_db
 
-def create_location(world, location_dict):
+def create_location(builder, location_dict):
     assert 'exits' in location_dict, f"Location \"{str(location_dict)[:30] + '...'}\" must have at least one exit path"
     location_details = extract_details(location_dict)
-    location_db = models.Location.objects.create(world=world, **location_details)
-    add_names_and_tags(location_db, location_dict)
+    location_db = models.Location(world=builder.world, **location_details)
+    builder.add_names_and_tags(location_db, location_dict)
     return location_db
 
-def create_path(world, path):
-    start = path['start_obj']
-    try:
-        end = models.Location.objects.get(world=world, names__name__iexact=path['exit']['to'])
-    except models.Location.DoesNotExist:
-        raise models.Location.DoesNotExist(f"Location named \"{path['exit']['to']}\" does not exist.")
-    preposition = path['exit'].get('preposition', 'to')
-    noun = path['exit'].get('noun', '')
+def create_path(builder, start, loc_exit):
+    end = builder.get(models.Location, loc_exit['to'])
+    preposition = loc_exit.get('preposition', 'to')
+    noun = loc_exit.get('noun', '')
     assert preposition or noun, "Path must have a preposition or a noun"
-    try:
-        models.Path.objects.create(preposition=preposition, noun=noun, start=start, end=end, hidden=path.get('hidden', False)) # TODO: optional travel_seconds
-    except IntegrityError:
-        raise IntegrityError(f"{preposition if noun else '<no preposition>'}-{noun if noun else '<no noun>'} already exists for location {path['exit']['name']}")
\ No newline at end of file
+    path = models.Path(world=builder.world, preposition=preposition, noun=noun, noun_slug=models.slugify_spaceless(noun), start=start, end=end, hidden=loc_exit.get('hidden', False), discoverable=loc_exit.get('discoverable', True))
+    if 'travel_seconds' in loc_exit:
+        path.travel_seconds = loc_exit['travel_seconds']
+    return path
@@ -1,18 +1,16 @@
-from .world_creator import extract_details
 from game import models
-from .world_creator import add_names_and_tags
-from collections import defaultdict
 
-def create_mysteries(world, mystery_dicts):
-    connections: defaultdict[models.Mystery, list[str]] = defaultdict(lambda: [])
+def create_mysteries(builder, mystery_dicts):
+    mysteries = []
+    clues = []
     for mystery_dict in mystery_dicts:
         assert 'name' in mystery_dict, "Mysteries must be named"
-        mystery = models.Mystery.objects.create(world=world, name=mystery_dict['name'])
-        connections[mystery] += mystery_dict.get('connections', [])
+        mystery = models.Mystery(world=builder.world, name=mystery_dict['name'])
+        mysteries.append(mystery)
         assert 'clues' in mystery_dict, f"{mystery} must have at least one clue"
         for clue_dict in mystery_dict["clues"]:
             assert 'summary' in clue_dict, f"{clue_dict} must have a summary"
-            clue = models.Clue.objects.create(mystery=mystery, summary=clue_dict['summary'])
+            clues.append(models.Clue(mystery=mystery, summary=clue_dict['summary']))
             # TODO: wire up the ways to discover the clue
             if('discoverable_at' in clue_dict):
                 ...
@@ -20,7 +18,15 @@ def create_mysteries(world, mystery_dicts):
                 ...
             if('known_by' in clue_dict):
                 ...
-    
-    for mystery, connections in connections.items():
-        for connection in connections:
-            mystery.connections.add(models.Mystery.objects.get(world=world, name__iexact=connection))
\ No newline at end of file
+    builder.bulk_create(models.Mystery, mysteries)
+    builder.bulk_create(models.Clue, clues)
+
+    mysteries_by_name = {mystery.name.lower(): mystery for mystery in mysteries}
+    connections = set()
+    for mystery, mystery_dict in zip(mysteries, mystery_dicts):
+        for connection in mystery_dict.get('connections', []):
+            if connection.lower() not in mysteries_by_name:
+                raise models.Mystery.DoesNotExist(f"Mystery named \"{connection}\" does not exist.")
+            connections.add((mystery.id, mysteries_by_name[connection.lower()].id))
+    Through = models.Mystery.connections.through
+    builder.bulk_create(Through, [Through(from_mystery_id=from_id, to_mystery_id=to_id) for from_id, to_id in sorted(connections)])
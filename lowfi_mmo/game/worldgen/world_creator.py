@@ -1,31 +1,87 @@
-from game import models
+from game import models, fuzzy
 from django.db.transaction import atomic
 import uuid
 import tomllib
 import os
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 import glob
+import hashlib
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cache
 
-@atomic
-def populate_world(world):
+logger = logging.getLogger(__name__)
+
+def get_base_world():
+    """Shared read-only template that new worlds read their content through."""
+    version = content_version()
+    base = models.World.objects.filter(is_template=True, content_version=version).first()
+    if base: return base
+    try:
+        with atomic():
+            base = models.World.objects.create(name=f"template {version[:8]}", is_template=True, content_version=version)
+            populate_world(base)
+    except IntegrityError:
+        # another request built the same template first
+        base = models.World.objects.get(is_template=True, content_version=version)
+    return base
+
+@cache
+def content_version():
     containing_folder = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for file_path in sorted(glob.glob(f'{containing_folder}/**/*.toml', recursive=True)):
+        digest.update(os.path.relpath(file_path, containing_folder).encode())
+        with open(file_path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+@dataclass
+class PopulateReport:
+    queries: int = 0
+    seconds: float = 0.0
+    rows: Counter = field(default_factory=Counter)
+    def __str__(self):
+        rows = ", ".join(f"{count} {model}" for model, count in sorted(self.rows.items()))
+        return f"{self.queries} queries in {self.seconds:.3f}s ({rows})"
+
+@atomic
+def populate_world(world) -> PopulateReport:
+    started = time.perf_counter()
+    report = PopulateReport()
+    def count_query(execute, sql, params, many, context):
+        report.queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        # stage 1: parse everything
+        containing_folder = os.path.dirname(os.path.abspath(__file__))
+        location_dicts = parse_all_toml_files(os.path.join(containing_folder, "locations"))
+        blocks_dict = parse_toml_file(os.path.join(containing_folder, "blocks.toml"))
+        mystery_dicts = parse_all_toml_files(os.path.join(containing_folder, "mysteries"))
 
-    # create locations
-    locations_folder =  os.path.join(containing_folder, "locations")
-    location_dicts = parse_all_toml_files(locations_folder)
-    from .location_creator import create_locations
-    create_locations(world, location_dicts)
+        # stage 2: build objects and resolve names in memory, writing one model at a time
+        builder = WorldBuilder(world, report.rows)
+        from .location_creator import create_locations
+        create_locations(builder, location_dicts)
+        from .block_creator import create_blocks
+        create_blocks(builder, blocks_dict["blocks"])
+        from .mystery_creator import create_mysteries
+        create_mysteries(builder, mystery_dicts)
 
-    # create blocks
-    blocks_dict = parse_toml_file(os.path.join(containing_folder, "blocks.toml"))
-    from .block_creator import create_block
-    for block_dict in blocks_dict["blocks"]:
-        create_block(world, block_dict)
+        # stage 3: names and tags for every entity at once
+        builder.save_names_and_tags()
 
-    # create mysteries
-    mystery_dicts = parse_all_toml_files(os.path.join(containing_folder, "mysteries"))
-    from .mystery_creator import create_mysteries
-    create_mysteries(world, mystery_dicts)
+        # npcs belong to each world rather than the template, see character_creator.py
+        if not world.is_template:
+            from .character_creator import spawn_npcs
+            report.rows["Character"] += len(spawn_npcs(world))
+
+    report.seconds = time.perf_counter() - started
+    logger.info("Populated world \"%s\": %s", world, report)
+    return report
 
 
 def parse_all_toml_files(directory):
@@ -39,17 +95,78 @@ def parse_toml_file(file_path):
     with open(file_path, 'rb') as file:
         return tomllib.load(file)
 
-def add_names_and_tags(db_entity, data):
-    assert 'names' in data, f"Entities must have at least one name"
-    for name in data['names']:
-        try:
-            name_obj = models.Name.objects.create(world=db_entity.world, entity=db_entity, name=name)
-            db_entity.names.add(name_obj)
-        except IntegrityError:
-            raise IntegrityError(f"Entity with name \"{name}\" has already been created.")
-    for tag in data.get('tags', []):
-        tag_obj, _ = models.Tag.objects.get_or_create(name=tag)
-        db_entity.tags.add(tag_obj)
+class WorldBuilder:
+    """Collects worldgen objects so each model is written with a handful of bulk inserts."""
+    def __init__(self, world, row_counts=None):
+        self.world = world
+        self.row_counts = row_counts if row_counts is not None else Counter()
+        self.entities_by_name = {}
+        self.slugs = set()
+        self.names = []
+        self.entity_tags = []
+        self.paths = []
+
+    def add_names_and_tags(self, db_entity, data):
+        assert 'names' in data, f"Entities must have at least one name"
+        for name in data['names']:
+            slug = models.slugify_spaceless(name)
+            if slug in self.slugs:
+                raise IntegrityError(f"Entity with name \"{name}\" has already been created.")
+            self.slugs.add(slug)
+            self.entities_by_name[name.lower()] = db_entity
+            self.names.append((db_entity, name))
+            if not db_entity.primary_name:
+                db_entity.primary_name, db_entity.primary_slug = name, slug
+        for tag in data.get('tags', []):
+            self.entity_tags.append((db_entity, tag))
+
+    def get(self, model, name):
+        entity = self.entities_by_name.get(name.lower())
+        if not isinstance(entity, model):
+            raise model.DoesNotExist(f"{model.__name__} named \"{name}\" does not exist.")
+        return entity
+
+    def bulk_create(self, model, objs):
+        objs = model.objects.bulk_create(objs)
+        self.row_counts[model.__name__] += len(objs)
+        if model is models.Name:
+            fuzzy.names_saved(objs) # worlds already searched, e.g. when npcs are spawned later
+        return objs
+
+    def create_entities(self, model, objs):
+        # bulk_create refuses multi-table inherited models, so bulk_create the Entity rows (SQLite
+        # returns their pks) and then write all the child rows in one executemany
+        if not objs: return objs
+        parent_fields = [f for f in models.Entity._meta.concrete_fields if not f.primary_key]
+        parents = models.Entity.objects.bulk_create([
+            models.Entity(**{f.attname: getattr(obj, f.attname) for f in parent_fields}) for obj in objs
+        ])
+        for obj, parent in zip(objs, parents):
+            obj.pk = obj.id = parent.id
+            obj._state.adding = False
+            obj._state.db = parent._state.db
+        child_fields = model._meta.local_concrete_fields
+        quote = connection.ops.quote_name
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            quote(model._meta.db_table), ", ".join(quote(f.column) for f in child_fields), ", ".join(["%s"] * len(child_fields)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True), connection) for f in child_fields] for obj in objs])
+        self.row_counts[model.__name__] += len(objs)
+        return objs
+
+    def save_names_and_tags(self):
+        self.bulk_create(models.Name, [
+            models.Name(world=self.world, entity_id=entity.id, name=name, slug=models.slugify_spaceless(name)) for entity, name in self.names
+        ])
+        tag_names = {tag for _, tag in self.entity_tags}
+        tags = {tag.name: tag for tag in models.Tag.objects.filter(name__in=tag_names)}
+        models.Tag.objects.bulk_create([models.Tag(name=name) for name in tag_names - tags.keys()], ignore_conflicts=True)
+        tags.update({tag.name: tag for tag in models.Tag.objects.filter(name__in=tag_names - tags.keys())})
+        Through = models.Entity.tags.through
+        self.bulk_create(Through, list({
+            (entity.id, tags[tag].id): Through(entity_id=entity.id, tag_id=tags[tag].id) for entity, tag in self.entity_tags
+        }.values()))
 
 def extract_details(dict):
-    return {key: value for key, value in dict.items() if key in ["appearance", "description"]}
\ No newline at end of file
+    return {key: value for key, value in dict.items() if key in ["appearance", "description"]}
@@ -0,0 +1,72 @@
+from game import models
+import numpy as np
+
+# positions for the world visualizer, computed once per world and stored in WorldLayout.
+# when paths change the stored layout is the starting point and only settles a little,
+# with new locations free to move, so the map doesn't jump around between renders.
+LAYOUT_SEED = 42
+ITERATIONS = 50
+INCREMENTAL_ITERATIONS = 15
+SETTLED_STEP = 0.1 # how far locations that were already placed can move in an incremental update, relative to new ones
+
+def force_layout(positions, edges, movable=None, iterations=ITERATIONS, temperature=0.1):
+    """Fruchterman-Reingold over all pairs at once: O(n^2) memory, but no python loop over nodes or edges.
+
+    positions is an (n, 2) array of starting points, edges an (m, 2) array of node indices.
+    """
+    positions = positions.copy()
+    k = 1 / np.sqrt(max(len(positions), 1)) # ideal edge length in a unit square
+    start, end = (edges[:, 0], edges[:, 1]) if len(edges) else (np.empty(0, int), np.empty(0, int))
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.maximum(np.linalg.norm(delta, axis=-1), 0.01)
+        displacement = (delta * (k * k / distance ** 2)[:, :, None]).sum(axis=1) # everything pushes apart
+        edge_delta = positions[start] - positions[end]
+        pull = edge_delta * (np.maximum(np.linalg.norm(edge_delta, axis=-1), 0.01) / k)[:, None] # paths pull together
+        np.add.at(displacement, start, -pull)
+        np.add.at(displacement, end, pull)
+        length = np.maximum(np.linalg.norm(displacement, axis=-1), 0.01)
+        step = displacement * (np.minimum(length, temperature) / length)[:, None]
+        if movable is not None:
+            step *= movable[:, None]
+        positions += step
+        temperature -= cooling
+    return positions
+
+def compute_positions(location_ids, edges, previous=None):
+    """Location id -> (x, y), starting from the previous layout's positions where there are any."""
+    rng = np.random.default_rng(LAYOUT_SEED)
+    location_ids = sorted(location_ids)
+    index = {location_id: i for i, location_id in enumerate(location_ids)}
+    edge_indexes = np.array([(index[a], index[b]) for a, b in edges], dtype=int).reshape(-1, 2)
+    starting = rng.random((len(location_ids), 2))
+    if not previous:
+        positions = force_layout(starting, edge_indexes)
+    else:
+        placed = np.array([location_id in previous for location_id in location_ids])
+        for location_id, i in index.items():
+            if location_id in previous:
+                starting[i] = previous[location_id]
+        # new locations start next to whatever they're connected to
+        for a, b in edges:
+            for new, neighbour in [(a, b), (b, a)]:
+                if new not in previous and neighbour in previous:
+                    starting[index[new]] = np.array(previous[neighbour]) + rng.normal(0, 0.01, 2)
+        movable = np.where(placed, SETTLED_STEP, 1.0)
+        positions = force_layout(starting, edge_indexes, movable, INCREMENTAL_ITERATIONS)
+    return {location_id: (float(x), float(y)) for location_id, (x, y) in zip(location_ids, positions)}
+
+def get_positions(world, location_ids, edges):
+    """The world's stored layout, brought up to date if its locations or paths have changed."""
+    edge_list = sorted([list(edge) for edge in edges])
+    layout = models.WorldLayout.objects.filter(world=world).first()
+    if layout and layout.edges == edge_list and set(layout.positions) == {str(location_id) for location_id in location_ids}:
+        return {int(location_id): tuple(xy) for location_id, xy in layout.positions.items()}
+    previous = {int(location_id): xy for location_id, xy in layout.positions.items()} if layout else None
+    positions = compute_positions(location_ids, edges, previous)
+    models.WorldLayout.objects.update_or_create(world=world, defaults={
+        "positions": {str(location_id): xy for location_id, xy in positions.items()},
+        "edges": edge_list,
+    })
+    return positions
@@ -1,51 +1,36 @@
 from game import models
+from .world_layout import get_positions
 import plotly.graph_objects as go
-import networkx as nx
 
 def world_to_html(world):
-    # Create a Graph object
-    G = nx.Graph()
-
-    # Add nodes for each location
-    locations = models.Location.objects.filter(world=world)
-
-    for location in locations:
-        G.add_node(location.id)
-
-    # Add edges for each path
-    paths = models.Path.objects.filter(start__world=world)
+    # location names and paths in one query each
+    labels = dict(models.Location.objects.in_world(world).values_list("id", "primary_name"))
+    paths = models.Path.objects.in_world(world)
 
     # disconnect the underground from the main city
     paths = paths.exclude(start__tags__name="underground", end__tags__name="outside").exclude(start__tags__name="outside", end__tags__name="underground")
-    
-    for path in paths:
-        G.add_edge(path.start.id, path.end.id)
+    directed = set(paths.values_list("start_id", "end_id"))
+    edges = {tuple(sorted(edge)) for edge in directed}
 
-    # Compute the layout
-    pos = nx.spring_layout(G)  # use seed=n here to fix it in place between renders
-
-    # Extract x and y coordinates along with labels
-    x_values = [pos[n][0] for n in G.nodes()]
-    y_values = [pos[n][1] for n in G.nodes()]
-    labels = [locations.get(id=n).name for n in G.nodes()]
+    # stored per world, only recomputed when locations or paths change
+    pos = get_positions(world, labels.keys(), edges)
 
     # Create a scatter plot for locations
-    scatter = go.Scatter(x=x_values, y=y_values, mode='markers', text=labels, showlegend=False)
-
-    # Determine bidirectional edges
-    bidirectional_edges = {frozenset([u, v]) for u, v in G.edges() if G.has_edge(v, u)}
-
-    # Create a line plot for paths and use colors to indicate direction
-    lines = [go.Scatter(x=[pos[u][0], pos[v][0]], y=[pos[u][1], pos[v][1]], mode='lines',
-                        line=dict(color='blue' if frozenset([u, v]) in bidirectional_edges else 'red'), showlegend=False)
-            for u, v in G.edges()]
+    nodes = sorted(labels)
+    scatter = go.Scatter(x=[pos[n][0] for n in nodes], y=[pos[n][1] for n in nodes], mode='markers+text', text=[labels[n] for n in nodes],
+                         textposition='top center', showlegend=False)
+
+    # one trace per color with breaks between segments, rather than a trace per path.
+    # blue paths go both ways, red ones only one way
+    lines = []
+    for color, two_way in [('blue', True), ('red', False)]:
+        x, y = [], []
+        for u, v in sorted(edges):
+            if ((u, v) in directed and (v, u) in directed) == two_way:
+                x += [pos[u][0], pos[v][0], None]
+                y += [pos[u][1], pos[v][1], None]
+        lines.append(go.Scatter(x=x, y=y, mode='lines', line=dict(color=color), hoverinfo='skip', showlegend=False))
 
     # Combine scatter and lines into one figure
-    fig = go.Figure(data=[scatter] + lines)
-
-
-    # Add annotations for each label
-    for i, label in enumerate(labels):
-        fig.add_annotation(x=x_values[i], y=y_values[i], text=label)
-
-    return fig.to_html(full_html=False, include_plotlyjs='cdn')
\ No newline at end of file
+    fig = go.Figure(data=lines + [scatter])
+    return fig.to_html(full_html=False, include_plotlyjs='cdn')
@@ -77,12 +77,81 @@ WSGI_APPLICATION = 'lowfi_mmo.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Run on every new connection. WAL lets readers and the writer work at the same time, busy_timeout waits
+# for the write lock instead of failing straight away, NORMAL sync is safe with WAL and skips an fsync per
+# commit, and reads come from memory mapped pages. IMMEDIATE transactions take the write lock when they
+# start, rather than failing to upgrade a read lock halfway through.
+SQLITE_PRAGMAS = "PRAGMA journal_mode=WAL; PRAGMA busy_timeout=5000; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456"
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'init_command': SQLITE_PRAGMAS, 'transaction_mode': 'IMMEDIATE'},
+    },
+    # the same file on a second connection, for read only views (see game/replica.py)
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'init_command': SQLITE_PRAGMAS + "; PRAGMA query_only=ON"},
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+DATABASE_ROUTERS = ['game.replica.ReadReplicaRouter']
+READ_REPLICA = 'replica' # None sends everything to default
+
+
+# Per-process by default. Point this at a shared cache (redis, memcached) when running several processes
+# so they see each other's invalidations (game/look_cache.py, game/page_cache.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
     }
 }
+LOOK_CACHE = 'default'
+PAGE_CACHE = 'default'
+
+
+# Live play channel (see game/live.py). The in-memory layer only reaches players connected to the same process.
+LIVE_CHANNEL_LAYER = "game.live.InMemoryChannelLayer"
+
+
+# Play commands are queued and run per world in ticks of this many seconds, committing each tick
+# in one transaction (see game/scheduler.py). None runs each command in its own request instead.
+GAME_TICK_SECONDS = 0.1
+
+
+# NPCs take a step every this many seconds (see game/npcs.py) while manage.py simulate_npcs runs. Only one
+# process should simulate: NPC_SIMULATE_IN_WEB runs it in the web process instead, for a single process dev server.
+NPC_TICK_SECONDS = 5
+NPC_SIMULATE_IN_WEB = False
+NPC_BATCH_SIZE = 1000
+
+
+# NPC conversations (see game/conversations.py). The stub backend works offline; for real replies use
+# "game.llm.OpenAIBackend" with OPENAI_API_KEY set. Replies are written by at most LLM_MAX_CONCURRENT
+# threads with LLM_MAX_WAITING more queued, past which NPCs are too busy to talk.
+LLM_BACKEND = "game.llm.StubBackend"
+LLM_MODEL = "gpt-4o-mini"
+LLM_TIMEOUT_SECONDS = 30
+LLM_MAX_CONCURRENT = 4
+LLM_MAX_WAITING = 16
+# Replies are cached in the database (see game/llm_cache.py) for up to this long and this many bytes in total.
+LLM_CACHE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+LLM_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+
+# Per-command metrics (see game/metrics.py), served in Prometheus text format at /metrics/. Each process
+# publishes its numbers to this cache, so it needs to be shared for one scrape to cover every process.
+METRICS_CACHE = 'default'
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+
+# Character log retention (see game/log_archive.py and the archive_logs management command)
+CHARACTER_LOG_RETENTION_DAYS = 30
+CHARACTER_LOG_KEEP_LATEST = 50
+CHARACTER_LOG_ARCHIVE_SEGMENT_SIZE = 500
 
 
 # Password validation